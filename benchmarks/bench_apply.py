@@ -0,0 +1,106 @@
+# /apply 并发吞吐基准：在临时数据库上启动 uvicorn，并发提交申请
+# 对比改动前后时，可以用 git worktree 检出旧版本并通过 --app-dir 指向它：
+#   git worktree add /tmp/panel-old <commit>
+#   python -m benchmarks.bench_apply --app-dir /tmp/panel-old
+#   python -m benchmarks.bench_apply
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("服务未能启动")
+
+async def drive(base_url: str, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await wait_ready(client)
+
+        async def apply(i: int):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/apply", data={
+                    "email": f"student{i}@example.com",
+                    "application_reason": "benchmark",
+                })
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(apply(i) for i in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--app-dir", default=os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_PATH": os.path.join(tmp, "bench.db"),
+            "PROVISION_BACKEND": "fake",
+            # 所有请求都来自本机，关闭按 IP 限流
+            "APPLY_IP_BURST": "0",
+            "PROVISION_HOME_ROOT": tmp,
+            "SMTP_PASSWORD": "your-smtp-password",
+        })
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=args.app_dir, env=env,
+        )
+        try:
+            result = asyncio.run(drive(f"http://127.0.0.1:{port}", args.requests, args.concurrency))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+    result["app_dir"] = args.app_dir
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
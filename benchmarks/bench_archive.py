@@ -0,0 +1,103 @@
+# 申请归档：移动速度、压缩率，以及归档前后管理面板查询的耗时
+# 在临时数据库中生成多个学期的申请（每个账户每学期一条，最近一学期中 1% 等待审批），归档早于 180 天的申请
+#   python -m benchmarks.bench_archive --accounts 20000 --semesters 6
+import argparse
+import asyncio
+import base64
+import datetime
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+REASON = "1. 姓名：张三，学号 2020{i:06d}，计算机科学与技术专业\n2. 申请《深度学习》课程，需要使用 GPU 完成课程大作业。\n3. 已阅读服务器使用规范。"
+
+def public_key(rng: random.Random, i: int) -> str:
+    # 与真实公钥一样，前缀固定，其余为随机的 base64
+    return "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAI" + base64.b64encode(rng.randbytes(32)).decode().rstrip("=") + f" student{i}"
+
+def populate(database_path: str, accounts: int, semesters: int) -> int:
+    rng = random.Random(0)
+    now = datetime.datetime.utcnow()
+    with sqlite3.connect(database_path) as conn:
+        conn.executemany(
+            "INSERT INTO accounts (id, email, status, latest_approval_time) VALUES (?, ?, '活跃状态', ?)",
+            ((i + 1, f"student{i}@example.com", now) for i in range(accounts)),
+        )
+        rows = (
+            (i + 1, public_key(rng, i), REASON.format(i=i),
+             '等待管理员同意' if s == semesters - 1 and i % 100 == 0 else '同意', now - datetime.timedelta(days=182 * (semesters - 1 - s) + i % 30))
+            for s in range(semesters) for i in range(accounts)
+        )
+        conn.executemany(
+            "INSERT INTO applications (account_id, public_key, application_reason, status, is_first_application, application_time) "
+            "VALUES (?, ?, ?, ?, 0, ?)",
+            rows,
+        )
+        conn.execute("UPDATE accounts SET latest_application_id = (SELECT MAX(id) FROM applications WHERE account_id = accounts.id)")
+        conn.execute("INSERT INTO pending_applications (application_id, account_id, application_time) "
+                     "SELECT id, account_id, application_time FROM applications WHERE status = '等待管理员同意' AND id IN (SELECT latest_application_id FROM accounts)")
+        return conn.execute("SELECT COUNT(*) FROM applications").fetchone()[0]
+
+async def time_queries(repeat: int) -> dict:
+    from sqlalchemy import select, func
+    from src.database import AsyncSessionLocal
+    from src.main import list_applications, get_latest_pendings
+    from src.models import Application
+    filters = {"status": '同意', "first": None, "date_from": None, "date_to": None, "cursor": None, "limit": 50}
+    timings = {"admin_page": [], "pending_queue": [], "status_counts": []}
+    async with AsyncSessionLocal() as db:
+        for _ in range(repeat):
+            for name, query in (
+                ("admin_page", lambda: list_applications(db, filters)),
+                ("pending_queue", lambda: get_latest_pendings(db)),
+                ("status_counts", lambda: db.execute(select(Application.status, func.count()).group_by(Application.status))),
+            ):
+                started = time.perf_counter()
+                await query()
+                timings[name].append(time.perf_counter() - started)
+    return {name: round(statistics.median(values) * 1000, 2) for name, values in timings.items()}
+
+async def run(repeat: int) -> dict:
+    from src.database import async_engine
+    from src.archive import archive_applications
+    before = await time_queries(repeat)
+    started = time.perf_counter()
+    archived = await archive_applications(180)
+    archive_seconds = time.perf_counter() - started
+    after = await time_queries(repeat)
+    await async_engine.dispose()
+    return {"archived": archived, "archive_seconds": round(archive_seconds, 2), "query_ms_before": before, "query_ms_after": after}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--semesters", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, "bench.db")
+        os.environ["DATABASE_PATH"] = database_path
+        os.environ["LOG_FILE"] = os.path.join(tmp, "bench.log")
+        from src.database import init_db
+        from src.archive import decompress
+        init_db()
+        rows = populate(database_path, args.accounts, args.semesters)
+        result = asyncio.run(run(args.repeat))
+        with sqlite3.connect(database_path) as conn:
+            payloads = [payload for (payload,) in conn.execute("SELECT payload FROM application_archive")]
+            remaining = conn.execute("SELECT COUNT(*) FROM applications").fetchone()[0]
+    print(json.dumps({
+        "applications": rows,
+        "remaining": remaining,
+        **result,
+        "payload_bytes_per_row": round(sum(map(len, payloads)) / len(payloads)) if payloads else None,
+        "uncompressed_bytes_per_row": round(sum(len(json.dumps(decompress(p), ensure_ascii=False).encode()) for p in payloads) / len(payloads)) if payloads else None,
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# 日志开销：调用方写一条日志的耗时（直接写文件 vs 队列 + 后台线程），以及每个请求因日志增加的耗时
+# --write-latency 模拟慢磁盘，直接写文件时这部分耗时会落在事件循环上
+#   python -m benchmarks.bench_logging --lines 20000 --requests 2000 --write-latency 0.0002
+import argparse
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import tempfile
+import time
+
+ROUNDS = 5
+
+class SlowFileHandler(logging.FileHandler):
+    def __init__(self, filename: str, latency: float, formatter: logging.Formatter):
+        super().__init__(filename, encoding="utf-8")
+        self.latency = latency
+        self.setFormatter(formatter)
+
+    def emit(self, record):
+        if self.latency:
+            time.sleep(self.latency)
+        super().emit(record)
+
+def measure_calls(logger: logging.Logger, lines: int) -> float:
+    started = time.perf_counter()
+    for i in range(lines):
+        logger.info(f"已为 student{i}@example.com 创建服务器账户", extra={"recipient": f"student{i}@example.com"})
+    return time.perf_counter() - started
+
+def bench_handlers(tmp: str, lines: int, latency: float) -> dict:
+    from src.logconfig import ContextQueueHandler, JSONFormatter
+
+    results = {}
+    # 原来的方式：basicConfig 的 FileHandler，在调用方线程中格式化并写文件
+    logger = logging.getLogger("bench.sync")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = SlowFileHandler(os.path.join(tmp, "sync.log"), latency, logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    elapsed = measure_calls(logger, lines)
+    handler.close()
+    results["sync_file"] = {"caller_us_per_line": round(elapsed / lines * 1e6, 2)}
+
+    logger = logging.getLogger("bench.queue")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(ContextQueueHandler(log_queue))
+    handler = SlowFileHandler(os.path.join(tmp, "queue.log"), latency, JSONFormatter())
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    elapsed = measure_calls(logger, lines)
+    drain_started = time.perf_counter()
+    listener.stop()
+    handler.close()
+    results["queue_json"] = {
+        "caller_us_per_line": round(elapsed / lines * 1e6, 2),
+        "drain_seconds": round(time.perf_counter() - drain_started, 3),
+    }
+    return results
+
+async def request_loop(client, total: int) -> float:
+    started = time.perf_counter()
+    for _ in range(total):
+        response = await client.get("/")
+        response.raise_for_status()
+    return time.perf_counter() - started
+
+async def bench_requests(total: int) -> dict:
+    import httpx
+    from src.main import app
+    from src.database import async_engine
+
+    # 只统计应用自身的日志
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await request_loop(client, 50)
+        # 交替进行多轮，减少预热和抖动的影响
+        disabled = enabled = 0.0
+        for _ in range(ROUNDS):
+            logging.disable(logging.CRITICAL)
+            disabled += await request_loop(client, total // ROUNDS)
+            logging.disable(logging.NOTSET)
+            enabled += await request_loop(client, total // ROUNDS)
+        total = total // ROUNDS * ROUNDS
+    await async_engine.dispose()
+    return {
+        "logging_disabled_us_per_request": round(disabled / total * 1e6, 1),
+        "logging_enabled_us_per_request": round(enabled / total * 1e6, 1),
+        "logging_cost_us_per_request": round((enabled - disabled) / total * 1e6, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-latency", type=float, default=0.0, help="模拟的单次写日志耗时（秒）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["LOG_FILE"] = os.path.join(tmp, "user-panel.log")
+        result = {"handlers": bench_handlers(tmp, args.lines, args.write_latency)}
+        from src.database import init_db
+        init_db()
+        result["requests"] = asyncio.run(bench_requests(args.requests))
+        from src.logconfig import stop_logging
+        stop_logging()
+        with open(os.environ["LOG_FILE"], encoding="utf-8") as f:
+            result["requests"]["log_lines"] = sum(1 for _ in f)
+    result["config"] = vars(args)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# 通过进程内 SMTP 服务器验证发件箱：所有邮件经同一个长连接送达
+#   python -m benchmarks.bench_mail --messages 200 --latency 0.01
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+async def enqueue(total: int) -> float:
+    from src.mailer import enqueue_mail
+
+    start = time.perf_counter()
+    for i in range(total):
+        await enqueue_mail(f"student{i}@example.com", "bench", f"message {i}")
+    return time.perf_counter() - start
+
+async def drain(timeout: float) -> float:
+    from sqlalchemy import select, func
+    from src import mailer
+    from src.database import AsyncSessionLocal
+    from src.models import MailOutbox
+
+    start = time.perf_counter()
+    mailer.start_sender()
+    try:
+        while time.perf_counter() - start < timeout:
+            async with AsyncSessionLocal() as db:
+                pending = (await db.execute(
+                    select(func.count()).where(MailOutbox.status.in_(['queued', 'sending']))
+                )).scalar_one()
+            if pending == 0:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        await mailer.stop_sender()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="SMTP 服务器处理每封邮件的模拟耗时（秒）")
+    parser.add_argument("--rate", type=float, default=0, help="每分钟发送上限，0 表示不限速")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    from src.smtp_stub import LocalSMTPServer
+    with tempfile.TemporaryDirectory() as tmp, LocalSMTPServer(latency=args.latency) as server:
+        os.environ.update({
+            "DATABASE_PATH": os.path.join(tmp, "bench.db"),
+            "SMTP_HOST": "127.0.0.1",
+            "SMTP_PORT": str(server.port),
+            "SMTP_STARTTLS": "false",
+            "SMTP_USER": "panel@example.com",
+            "SMTP_PASSWORD": "stub",
+            "MAIL_RATE_PER_MINUTE": str(args.rate),
+            "MAIL_POLL_INTERVAL": "0.05",
+        })
+        from src.database import init_db
+        init_db()
+
+        async def run():
+            from src.database import async_engine
+            try:
+                return await enqueue(args.messages), await drain(args.timeout)
+            finally:
+                await async_engine.dispose()
+
+        enqueue_seconds, seconds = asyncio.run(run())
+
+        print(json.dumps({
+            "messages": args.messages,
+            "delivered": len(server.messages),
+            "smtp_connections": server.connections,
+            "smtp_logins": server.logins,
+            "enqueue_ms_per_message": round(enqueue_seconds / args.messages * 1000, 3),
+            "drain_seconds": round(seconds, 3),
+        }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# 对比逐个创建与批量创建账户的开销
+# 使用 FakeCommandRunner 模拟进程启动耗时，公钥写入临时目录，不会改动系统账户
+#   python -m benchmarks.bench_provision --users 300 --latency 0.005
+# baseline 为改造前的逐个创建流程（id、useradd、bash -c chpasswd、mkdir、chown、两次 chmod），
+# per-user 为当前的 create_server_account，bulk 为 create_server_accounts
+import argparse
+import json
+import os
+import tempfile
+import time
+from src import utils
+
+def baseline_create_account(email: str, public_key: str | None, password: str):
+    # 保留改造前的命令序列，只把 subprocess.run 换成 command_runner，便于统计进程数和模拟耗时
+    runner = utils.command_runner
+    username = utils.get_username_from_email(email)
+    runner.run(["id", username])
+    if runner.lookup(username) is None:
+        runner.run(['useradd', '-m', '-s', '/bin/bash', username])
+        runner.run(['bash', '-c', f'echo "{username}:{password}" | chpasswd'])
+    else:
+        runner.run(['usermod', '-U', username])
+        runner.run(['usermod', '-s', '/bin/bash', username])
+    if public_key:
+        ssh_dir = os.path.join(utils.home_root(), username, ".ssh")
+        runner.run(['mkdir', '-p', ssh_dir])
+        os.makedirs(ssh_dir, exist_ok=True)
+        with open(os.path.join(ssh_dir, "authorized_keys"), 'w') as f:
+            f.write(public_key)
+            f.write('\n')
+        runner.run(['chown', '-R', f"{username}:{username}", ssh_dir])
+        runner.run(['chmod', '700', ssh_dir])
+        runner.run(['chmod', '600', os.path.join(ssh_dir, "authorized_keys")])
+
+def run(users: int, latency: float, mode: str) -> dict:
+    with tempfile.TemporaryDirectory() as home_root:
+        utils.HOME_ROOT = home_root
+        utils.command_runner = utils.FakeCommandRunner(latency)
+        password = utils.generate_password()
+        password_hash = utils.hash_password(password)
+        entries = [(f"student{i}@example.com", f"ssh-ed25519 AAAA{i} student{i}", password_hash) for i in range(users)]
+        start = time.perf_counter()
+        if mode == "bulk":
+            results = utils.create_server_accounts(entries)
+            failed = sum(1 for r in results.values() if r["error"])
+        else:
+            failed = 0
+            for email, public_key, password_hash in entries:
+                try:
+                    if mode == "baseline":
+                        baseline_create_account(email, public_key, password)
+                    else:
+                        utils.create_server_account(email, public_key, password_hash)
+                except Exception:
+                    failed += 1
+        elapsed = time.perf_counter() - start
+        return {
+            "mode": mode,
+            "users": users,
+            "spawns": len(utils.command_runner.calls),
+            "seconds": round(elapsed, 4),
+            "failed": failed,
+        }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.005, help="模拟的单次进程启动耗时（秒）")
+    args = parser.parse_args()
+    runs = [run(args.users, args.latency, mode) for mode in ("baseline", "per-user", "bulk")]
+    baseline = runs[0]["seconds"]
+    for result in runs:
+        result["speedup_vs_baseline"] = round(baseline / result["seconds"], 1) if result["seconds"] else None
+    print(json.dumps(runs, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# 对账检查耗时：一次读取 passwd / shadow 索引并在内存中对照，与逐个启动 `id` 子进程的估算耗时对比
+# 在临时目录生成 passwd / shadow、主目录和数据库，并制造少量不一致；只检查不修复，不会读取或修改真实的系统账户
+#   python -m benchmarks.bench_reconcile --users 5000
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+def write_system(directory: str, users: int) -> tuple[str, str, dict]:
+    # 约 1% 的活跃账户不存在、2% 被锁定、1% 缺少公钥；约 10% 的账户在数据库中为不活跃，其中一半未禁用
+    passwd_path = os.path.join(directory, "passwd")
+    shadow_path = os.path.join(directory, "shadow")
+    statuses = {}
+    with open(passwd_path, "w") as passwd, open(shadow_path, "w") as shadow:
+        for i in range(users):
+            name = f"pstudent{i}"
+            inactive = i % 10 == 9
+            statuses[i] = '不活跃状态' if inactive else '活跃状态'
+            if i % 100 == 1:
+                continue
+            locked = (inactive and i % 20 == 19) or i % 50 == 3
+            shell = "/sbin/nologin" if inactive and i % 20 == 19 else "/bin/bash"
+            passwd.write(f"{name}:x:{10000 + i}:{10000 + i}:,,,:{os.path.join(directory, name)}:{shell}\n")
+            shadow.write(f"{name}:{'!' if locked else ''}$6$salt$hash:19000:0:99999:7:::\n")
+            if i % 100 != 7:
+                ssh_dir = os.path.join(directory, name, ".ssh")
+                os.makedirs(ssh_dir)
+                with open(os.path.join(ssh_dir, "authorized_keys"), "w") as f:
+                    f.write(f"ssh-ed25519 AAAA{i}\n")
+    return passwd_path, shadow_path, statuses
+
+def populate(database_path: str, statuses: dict):
+    import sqlite3
+    with sqlite3.connect(database_path) as conn:
+        conn.executemany(
+            "INSERT INTO accounts (id, email, status) VALUES (?, ?, ?)",
+            ((i + 1, f"student{i}@example.com", status) for i, status in statuses.items()),
+        )
+        conn.executemany(
+            "INSERT INTO applications (account_id, public_key, application_reason, status, is_first_application, application_time) "
+            "VALUES (?, ?, '', '同意', 1, datetime('now'))",
+            ((i + 1, f"ssh-ed25519 AAAA{i}") for i in statuses),
+        )
+
+async def measure(repeat: int) -> list[dict]:
+    from src.database import async_engine
+    from src.reconcile import reconcile
+    reports = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        report = await reconcile(fix=False)
+        reports.append({"seconds": round(time.perf_counter() - started, 3), "total": report["total"], "counts": report["counts"]})
+    await async_engine.dispose()
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--spawns", type=int, default=200, help="用于估算逐个查询耗时的子进程数")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    for i in range(args.spawns):
+        subprocess.run(["id", f"pstudent{i}"], capture_output=True)
+    spawn_seconds = (time.perf_counter() - start) / args.spawns
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["LOG_FILE"] = os.path.join(tmp, "bench.log")
+        os.environ.pop("PROVISION_HOSTS", None)
+        os.environ.pop("PROVISION_BACKEND", None)
+        from src import utils
+        from src.sysaccounts import SystemAccountIndex
+        from src.database import init_db
+        passwd_path, shadow_path, statuses = write_system(tmp, args.users)
+        utils.HOME_ROOT = tmp
+        utils.system_accounts = SystemAccountIndex(passwd_path, shadow_path)
+        init_db()
+        populate(os.environ["DATABASE_PATH"], statuses)
+        runs = asyncio.run(measure(args.repeat))
+
+    print(json.dumps({
+        "users": args.users,
+        # 逐个查询每个账户至少需要一次 id 和一次 passwd -S
+        "per_user_spawn_estimate_seconds": round(spawn_seconds * args.users * 2, 2),
+        "runs": runs,
+    }, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
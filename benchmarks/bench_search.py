@@ -0,0 +1,117 @@
+# 申请搜索：FTS5（trigram）与 LIKE '%...%' 全表扫描对比
+# 在临时数据库中生成申请（写入时由触发器同步索引），每个查询取多次执行的中位数
+#   python -m benchmarks.bench_search --rows 100000
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚"
+COURSES = ["深度学习", "计算机视觉", "自然语言处理", "并行计算", "操作系统", "数据库系统", "强化学习", "图形学"]
+MAJORS = ["计算机科学与技术", "人工智能", "统计学", "软件工程", "信息管理"]
+FILLER = [
+    "需要使用 GPU 完成课程大作业。",
+    "已阅读服务器使用规范，并承担相应安全责任。",
+    "实验需要较大的显存，本地设备无法满足。",
+    "课程项目需要长时间训练模型。",
+]
+
+def reason(rng: random.Random, i: int) -> str:
+    name = rng.choice(SURNAMES) + rng.choice(GIVEN) + rng.choice(GIVEN)
+    return (
+        f"1. {name}，学号 20{rng.randint(18, 24)}{i:06d}，{rng.choice(MAJORS)}专业 {rng.randint(1, 9)} 班\n"
+        f"2. 申请《{rng.choice(COURSES)}》课程，{rng.choice(FILLER)}\n"
+        f"3. {rng.choice(FILLER)}"
+    )
+
+def populate(database_path: str, rows: int, seed: int) -> float:
+    rng = random.Random(seed)
+    now = datetime.datetime(2024, 9, 1)
+    started = time.perf_counter()
+    with sqlite3.connect(database_path) as conn:
+        conn.executemany(
+            "INSERT INTO accounts (id, email, status) VALUES (?, ?, '活跃状态')",
+            ((i + 1, f"student{i}@example.com") for i in range(rows)),
+        )
+        conn.executemany(
+            "INSERT INTO applications (account_id, public_key, application_reason, status, is_first_application, application_time) "
+            "VALUES (?, 'ssh-ed25519 AAAA', ?, '同意', 1, ?)",
+            ((i + 1, reason(rng, i), now + datetime.timedelta(seconds=i)) for i in range(rows)),
+        )
+    return time.perf_counter() - started
+
+LIKE_COUNT = (
+    "SELECT COUNT(*) FROM applications JOIN accounts ON accounts.id = applications.account_id "
+    "WHERE applications.application_reason LIKE :pattern OR accounts.email LIKE :pattern"
+)
+LIKE_PAGE = (
+    "SELECT applications.id, accounts.email, applications.application_reason "
+    "FROM applications JOIN accounts ON accounts.id = applications.account_id "
+    "WHERE applications.application_reason LIKE :pattern OR accounts.email LIKE :pattern "
+    "ORDER BY applications.id DESC LIMIT 50"
+)
+
+async def measure(queries: list[str], repeat: int) -> dict:
+    from sqlalchemy import text
+    from src.database import AsyncSessionLocal, async_engine
+    from src.search import search_applications
+
+    results = {}
+    async with AsyncSessionLocal() as db:
+        for query in queries:
+            like_times, fts_times = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                like_total = (await db.execute(text(LIKE_COUNT), {"pattern": f"%{query}%"})).scalar_one()
+                (await db.execute(text(LIKE_PAGE), {"pattern": f"%{query}%"})).all()
+                like_times.append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                fts_total, _ = await search_applications(db, query, 50, 0)
+                fts_times.append(time.perf_counter() - started)
+            like_ms = statistics.median(like_times) * 1000
+            fts_ms = statistics.median(fts_times) * 1000
+            results[query] = {
+                "matches_like": like_total,
+                "matches_fts": fts_total,
+                "like_ms": round(like_ms, 2),
+                "fts_ms": round(fts_ms, 2),
+                "speedup": round(like_ms / fts_ms, 1) if fts_ms else None,
+            }
+    await async_engine.dispose()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--query", action="append", help="要测试的搜索词，可以重复指定")
+    args = parser.parse_args()
+    # 课程名（大量命中）、学号后六位（唯一命中）、邮箱片段、两个字的姓名（回退为 LIKE）、不存在的词
+    queries = args.query or ["深度学习", f"{args.rows // 2:06d}", "student4242", "王伟", "量子计算"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_path = os.path.join(tmp, "bench.db")
+        os.environ["DATABASE_PATH"] = database_path
+        os.environ["LOG_FILE"] = os.path.join(tmp, "bench.log")
+        from src.database import init_db
+        init_db()
+        populate_seconds = populate(database_path, args.rows, args.seed)
+        result = {
+            "rows": args.rows,
+            "populate_seconds": round(populate_seconds, 2),
+            "database_mb": round(os.path.getsize(database_path) / 1e6, 1),
+            "queries": asyncio.run(measure(queries, args.repeat)),
+        }
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
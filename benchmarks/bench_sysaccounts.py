@@ -0,0 +1,59 @@
+# 对比逐个启动 `id` 子进程与进程内系统账户索引的查询开销
+# 在临时目录生成包含大量用户的 passwd / shadow 文件，不会读取或修改真实的系统账户
+#   python -m benchmarks.bench_sysaccounts --users 5000 --lookups 200
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from src.sysaccounts import SystemAccountIndex
+
+def write_files(directory: str, users: int) -> tuple[str, str]:
+    passwd_path = os.path.join(directory, "passwd")
+    shadow_path = os.path.join(directory, "shadow")
+    with open(passwd_path, "w") as passwd, open(shadow_path, "w") as shadow:
+        for i in range(users):
+            name = f"pstudent{i}"
+            passwd.write(f"{name}:x:{10000 + i}:{10000 + i}:,,,:/home/{name}:/bin/bash\n")
+            shadow.write(f"{name}:{'!' if i % 10 == 0 else ''}$6$salt$hash:19000:0:99999:7:::\n")
+    return passwd_path, shadow_path
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=200, help="子进程方式的查询次数")
+    args = parser.parse_args()
+
+    names = [f"pstudent{i}" for i in range(args.users)]
+    sample = random.sample(names, min(args.lookups, len(names)))
+
+    start = time.perf_counter()
+    for name in sample:
+        subprocess.run(["id", name], capture_output=True)
+    subprocess_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SystemAccountIndex(*write_files(tmp, args.users))
+        start = time.perf_counter()
+        index.refresh()
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        locked = sum(1 for name in names if index.get(name).locked)
+        index_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "users": args.users,
+        "locked": locked,
+        "subprocess_lookups": len(sample),
+        "subprocess_us_per_lookup": round(subprocess_seconds / len(sample) * 1e6, 1),
+        "index_load_ms": round(load_seconds * 1000, 2),
+        "index_lookups": len(names),
+        "index_us_per_lookup": round(index_seconds / len(names) * 1e6, 2),
+        "index_reloads": index.reloads,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# 开学高峰负载测试：学生并发 申请 → 收验证邮件 → 验证，管理员同时刷新面板并批准
+# 在临时数据库上启动 uvicorn，账户命令使用 FakeCommandRunner，邮件发送到进程内 SMTP 服务器
+# 输出各路由的吞吐量和 p50/p95/p99 延迟（JSON），可以用 --app-dir 对比不同提交：
+#   git worktree add /tmp/panel-old <commit>
+#   python -m benchmarks.loadtest --app-dir /tmp/panel-old > old.json
+#   python -m benchmarks.loadtest > new.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+import httpx
+from benchmarks.bench_apply import free_port, percentile, wait_ready
+from src.smtp_stub import LocalSMTPServer
+
+ADMIN_PASSWORD = "loadtest"
+VERIFY_LINK = re.compile(r"/verify/([0-9a-f]+)")
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.counts: dict[str, int] = defaultdict(int)
+
+    async def request(self, client: httpx.AsyncClient, route: str, method: str, url: str, ok=(200,), **kwargs):
+        self.counts[route] += 1
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - started)
+        if response.status_code not in ok:
+            self.errors[route] += 1
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route in sorted(self.counts):
+            values = self.latencies[route]
+            routes[route] = {
+                "requests": self.counts[route],
+                "errors": self.errors[route],
+                "requests_per_second": round(len(values) / elapsed, 1),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+        return routes
+
+class Mailbox:
+    # 从 SMTP 服务器收到的邮件中取出每个收件人的验证代码
+    def __init__(self, server: LocalSMTPServer):
+        self.server = server
+        self.seen = 0
+        self.codes: dict[str, str] = {}
+
+    def poll(self):
+        with self.server.lock:
+            messages = self.server.messages[self.seen:]
+            self.seen += len(messages)
+        for item in messages:
+            body = item["message"].get_payload(decode=True).decode(errors="replace")
+            match = VERIFY_LINK.search(body)
+            if match:
+                self.codes[item["message"]["To"]] = match.group(1)
+
+    async def wait_code(self, email: str, timeout: float) -> str | None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.poll()
+            if email in self.codes:
+                return self.codes.pop(email)
+            await asyncio.sleep(0.05)
+        return None
+
+async def student(i: int, args, client: httpx.AsyncClient, recorder: Recorder, mailbox: Mailbox, semaphore: asyncio.Semaphore, mail_delays: list[float]):
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    email = f"student{i}@example.com"
+    async with semaphore:
+        await recorder.request(client, "GET /", "GET", "/")
+        response = await recorder.request(client, "POST /apply", "POST", "/apply", data={
+            "email": email,
+            "public_key": f"ssh-ed25519 AAAA{i} student{i}",
+            "application_reason": "loadtest",
+        })
+    if response is None or response.status_code != 200:
+        return False
+    sent = time.perf_counter()
+    code = await mailbox.wait_code(email, args.mail_timeout)
+    if code is None:
+        return False
+    mail_delays.append(time.perf_counter() - sent)
+    async with semaphore:
+        response = await recorder.request(client, "GET /verify/{code}", "GET", f"/verify/{code}")
+    return response is not None and response.status_code == 200
+
+async def admin(args, base_url: str, recorder: Recorder, done: asyncio.Event) -> set[int]:
+    # 多个管理员可能同时批准同一个申请，按申请 id 去重
+    approved = set()
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await client.post("/admin/login", data={"password": ADMIN_PASSWORD})
+        while True:
+            finished = done.is_set()
+            await recorder.request(client, "GET /admin", "GET", "/admin")
+            response = await recorder.request(
+                client, "GET /admin/api/applications", "GET", "/admin/api/applications",
+                params={"status": "等待管理员同意", "limit": 50},
+            )
+            pending = [] if response is None else [
+                item["id"] for item in response.json()["items"]
+                if item["is_latest_pending"] and item["job_status"] is None
+            ]
+            for application_id in pending:
+                response = await recorder.request(
+                    client, "POST /admin/approve/{id}", "POST", f"/admin/approve/{application_id}", ok=(303, 400),
+                )
+                if response is not None and response.status_code == 303:
+                    approved.add(application_id)
+            # 学生全部结束后再扫一遍，直到没有待批准的申请
+            if finished and not pending:
+                return approved
+            await asyncio.sleep(args.admin_interval)
+
+def count_active(database_path: str) -> int:
+    with sqlite3.connect(database_path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM accounts WHERE status = '活跃状态'").fetchone()[0]
+
+async def drive(args, base_url: str, mailbox: Mailbox, database_path: str) -> dict:
+    recorder = Recorder()
+    mail_delays: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await wait_ready(client)
+        started = time.perf_counter()
+        admins = [asyncio.create_task(admin(args, base_url, recorder, done)) for _ in range(args.admins)]
+        verified = await asyncio.gather(*(
+            student(i, args, client, recorder, mailbox, semaphore, mail_delays) for i in range(args.students)
+        ))
+        done.set()
+        approved = len(set().union(*await asyncio.gather(*admins)))
+        elapsed = time.perf_counter() - started
+
+    # 等待后台任务把批准的申请全部创建完成
+    drain_started = time.perf_counter()
+    active = count_active(database_path)
+    while active < approved and time.perf_counter() - drain_started < args.drain_timeout:
+        await asyncio.sleep(0.1)
+        active = count_active(database_path)
+
+    return {
+        "seconds": round(elapsed, 3),
+        "routes": recorder.report(elapsed),
+        "pipeline": {
+            "students": args.students,
+            "verified": sum(verified),
+            "approved": approved,
+            "active_accounts": active,
+            "drain_seconds": round(time.perf_counter() - drain_started, 3),
+            "mail_p50_ms": round(percentile(mail_delays, 50) * 1000, 2),
+            "mail_p95_ms": round(percentile(mail_delays, 95) * 1000, 2),
+        },
+    }
+
+def git_revision(app_dir: str) -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=app_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50, help="同时进行中的学生请求数")
+    parser.add_argument("--ramp", type=float, default=10, help="学生到达时间均匀分布在前 N 秒内")
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--admin-interval", type=float, default=0.5, help="管理员两次刷新之间的间隔（秒）")
+    parser.add_argument("--command-latency", type=float, default=0.005, help="模拟的单次账户命令耗时（秒）")
+    parser.add_argument("--smtp-latency", type=float, default=0.01, help="模拟的单封邮件发送耗时（秒）")
+    parser.add_argument("--mail-timeout", type=float, default=60)
+    parser.add_argument("--drain-timeout", type=float, default=60)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn 进程数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--app-dir", default=os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp, LocalSMTPServer(latency=args.smtp_latency) as smtp:
+        database_path = os.path.join(tmp, "loadtest.db")
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_PATH": database_path,
+            "PROVISION_BACKEND": "fake",
+            # 所有请求都来自本机，关闭按 IP 限流
+            "APPLY_IP_BURST": "0",
+            "FAKE_COMMAND_LATENCY": str(args.command_latency),
+            "PROVISION_HOME_ROOT": tmp,
+            "SMTP_HOST": "127.0.0.1",
+            "SMTP_PORT": str(smtp.port),
+            "SMTP_USER": "panel@example.com",
+            "SMTP_PASSWORD": "loadtest",
+            "SMTP_STARTTLS": "false",
+            "MAIL_RATE_PER_MINUTE": "100000",
+            "MAIL_POLL_INTERVAL": "0.2",
+            "ADMIN_PASSWORDS": ADMIN_PASSWORD,
+            "AUTH_TOKEN": "loadtest-token",
+            "WEBSITE_URL": "http://panel.example.com",
+        })
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            cwd=args.app_dir, env=env,
+        )
+        try:
+            result = asyncio.run(drive(args, f"http://127.0.0.1:{port}", Mailbox(smtp), database_path))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        result["mail"] = {"messages": len(smtp.messages), "connections": smtp.connections, "logins": smtp.logins}
+
+    result["app_dir"] = args.app_dir
+    result["revision"] = git_revision(args.app_dir)
+    result["config"] = {k: v for k, v in vars(args).items() if k != "app_dir"}
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
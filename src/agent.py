@@ -0,0 +1,80 @@
+# 账户代理：在每台计算节点上以 root 运行，执行面板发来的创建/解锁、禁用、更新公钥和对账检查操作
+#   PROVISION_AGENT_TOKEN=<令牌> LOG_FILE=/var/log/panel-agent.log uvicorn src.agent:app --host 0.0.0.0 --port 9100
+#   或监听 Unix socket：uvicorn src.agent:app --uds /run/panel-agent.sock
+# 面板的 PROVISION_HOSTS 填写 http://<节点>:9100 或 unix:/run/panel-agent.sock，两边的 PROVISION_AGENT_TOKEN 需一致
+# 未设置 PROVISION_AGENT_TOKEN 时代理拒绝启动
+# 邮箱和密码哈希在 src.utils 中逐条校验，无效的条目只在结果中记为失败，不影响同一批次的其他账户
+# 本地测试时设置 PROVISION_BACKEND=fake，在同一台机器上用不同端口启动多个代理
+import os
+import hmac
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request, status
+from pydantic import BaseModel
+from src.utils import create_server_accounts, ban_server_accounts, update_public_keys, inspect_server_accounts, command_runner
+
+PROVISION_AGENT_TOKEN = os.getenv("PROVISION_AGENT_TOKEN", "")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not PROVISION_AGENT_TOKEN:
+        raise RuntimeError("未设置 PROVISION_AGENT_TOKEN，拒绝启动")
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+# useradd / usermod 会锁定 /etc/passwd，同一台服务器上的操作依次执行
+_lock = asyncio.Lock()
+
+class CreateEntry(BaseModel):
+    email: str
+    public_key: str | None = None
+    password_hash: str
+
+class CreateRequest(BaseModel):
+    accounts: list[CreateEntry]
+
+class LockRequest(BaseModel):
+    emails: list[str]
+
+class KeyEntry(BaseModel):
+    email: str
+    public_key: str
+
+class KeysRequest(BaseModel):
+    accounts: list[KeyEntry]
+
+def check_token(request: Request):
+    authorization = request.headers.get("authorization", "")
+    token = authorization[7:].strip() if authorization.lower().startswith("bearer ") else ""
+    if not PROVISION_AGENT_TOKEN or not hmac.compare_digest(token.encode(), PROVISION_AGENT_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="令牌无效")
+
+def as_results(errors: dict[str, str | None]) -> dict:
+    return {"results": {email: {"created": False, "error": error} for email, error in errors.items()}}
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "accounts": len(command_runner.existing_usernames())}
+
+@app.post("/accounts/create", dependencies=[Depends(check_token)])
+async def create_accounts(body: CreateRequest):
+    entries = [(entry.email, entry.public_key, entry.password_hash) for entry in body.accounts]
+    async with _lock:
+        return {"results": await asyncio.to_thread(create_server_accounts, entries)}
+
+@app.post("/accounts/lock", dependencies=[Depends(check_token)])
+async def lock_accounts(body: LockRequest):
+    async with _lock:
+        return as_results(await asyncio.to_thread(ban_server_accounts, body.emails))
+
+@app.post("/accounts/keys", dependencies=[Depends(check_token)])
+async def update_keys(body: KeysRequest):
+    entries = [(entry.email, entry.public_key) for entry in body.accounts]
+    async with _lock:
+        return as_results(await asyncio.to_thread(update_public_keys, entries))
+
+@app.post("/accounts/inspect", dependencies=[Depends(check_token)])
+async def inspect_accounts(body: LockRequest):
+    # 只读，不需要等待其他操作
+    return {"results": await asyncio.to_thread(inspect_server_accounts, body.emails)}
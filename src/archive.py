@@ -0,0 +1,193 @@
+# 申请归档：把早于保留期限的已处理申请（同意 / 拒绝）和过期未验证的申请移到 application_archive，保持 applications 表较小
+# 保留期限为设置中的 archive_after_days，0 表示不归档；后台每 ARCHIVE_INTERVAL 秒检查一次，每批一个事务
+# 账户的最新申请（latest_application_id）、最近一次通过的申请和仍有未完成任务的申请不会被归档，最新申请、待审批队列和批准时间都不受影响
+# 最近一次通过的申请保存着账户当前使用的公钥，对账时需要读取
+# 归档后的申请不再出现在申请列表和搜索中，可以通过 /admin/api/archive 查询
+#   python -m src.archive    # 按当前设置立即归档一次
+import os
+import json
+import zlib
+import asyncio
+import logging
+import datetime
+from sqlalchemy import select, delete, insert, exists, or_, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from src.database import AsyncSessionLocal
+from src.models import Account, Application, ApplicationArchive, ProvisionJob
+from src.settings_cache import get_settings
+
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 3600))
+# 两批之间让出写锁的时间（秒）
+ARCHIVE_BATCH_PAUSE = float(os.getenv("ARCHIVE_BATCH_PAUSE", 0.05))
+ARCHIVE_COMPRESS_LEVEL = 6
+# 单条申请只有几百字节，直接压缩几乎没有收益；预置字典包含 JSON 键、常见公钥前缀和申请理由模板中的常用词
+# 字典的 adler32 记录在每条压缩数据的头部，修改字典后已归档的数据将无法解压，只能追加新字典并按头部选择
+ARCHIVE_ZDICT = (
+    '{"public_key": "ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABgQ ecdsa-sha2-nistp256 AAAAE2VjZHNhLXNoYTItbmlzdHAyNTYAAAAIbmlzdHAyNTYAAABBB'
+    ' ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAI", "application_reason": "'
+    '姓名：学号：专业：班级：年级：实验室：导师：课程：需要使用 GPU 服务器进行深度学习模型训练，完成课程大作业、实验和科研项目。'
+    '1.您的姓名、学号、专业、班级等信息\n2.申请的课程和理由\n3.是否了解服务器使用规范，并能承担相应安全责任'
+).encode()
+
+ARCHIVABLE_STATUSES = ('同意', '拒绝', '等待验证')
+
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+
+def compress(public_key: str | None, application_reason: str | None) -> bytes:
+    payload = json.dumps({"public_key": public_key, "application_reason": application_reason}, ensure_ascii=False)
+    compressor = zlib.compressobj(ARCHIVE_COMPRESS_LEVEL, zdict=ARCHIVE_ZDICT)
+    return compressor.compress(payload.encode()) + compressor.flush()
+
+def decompress(payload: bytes) -> dict:
+    decompressor = zlib.decompressobj(zdict=ARCHIVE_ZDICT)
+    return json.loads(decompressor.decompress(payload) + decompressor.flush())
+
+def archivable(threshold: datetime.datetime):
+    # 最新申请通过 ix_accounts_latest_application_id 逐行判断；NOT IN 的子查询中不能有 NULL，否则条件恒不成立
+    # 通过的申请只有在同一账户之后还有通过的申请时才能归档（与对账取 max(id) 的规则一致），通过 ix_applications_account_time 查找
+    busy = select(ProvisionJob.application_id).where(
+        ProvisionJob.status.in_(('queued', 'running')), ProvisionJob.application_id.is_not(None)
+    )
+    newer = aliased(Application)
+    return (
+        Application.status.in_(ARCHIVABLE_STATUSES),
+        Application.application_time < threshold,
+        ~exists().where(Account.latest_application_id == Application.id),
+        Application.id.not_in(busy),
+        or_(
+            Application.status != '同意',
+            exists().where(newer.account_id == Application.account_id, newer.status == '同意', newer.id > Application.id),
+        ),
+    )
+
+async def archive_batch(db: AsyncSession, threshold: datetime.datetime, after: tuple | None) -> tuple[int, tuple] | None:
+    # 按 (application_time, id) 键集分页，不必每批重新扫描前面不能归档的申请（如长期有效账户的最新申请）；没有可归档的申请时返回 None
+    # 删除时再判断一次条件：与验证、审批等写入并发时，删除语句持有写锁，只会移走仍然满足条件的申请
+    query = select(Application.id).where(*archivable(threshold))
+    if after is not None:
+        query = query.where(tuple_(Application.application_time, Application.id) > tuple_(*after))
+    batch = query.order_by(Application.application_time, Application.id).limit(ARCHIVE_BATCH_SIZE)
+    rows = (await db.execute(
+        delete(Application)
+        .where(Application.id.in_(batch))
+        .returning(
+            Application.id, Application.account_id, Application.status, Application.is_first_application,
+            Application.application_time, Application.public_key, Application.application_reason,
+        )
+        .execution_options(synchronize_session=False)
+    )).all()
+    if not rows:
+        await db.commit()
+        return None
+    now = datetime.datetime.utcnow()
+    await db.execute(insert(ApplicationArchive), [
+        dict(
+            id=row.id,
+            account_id=row.account_id,
+            status=row.status,
+            is_first_application=row.is_first_application,
+            application_time=row.application_time,
+            archived_at=now,
+            payload=compress(row.public_key, row.application_reason),
+        )
+        for row in rows
+    ])
+    await db.commit()
+    last = max(rows, key=lambda row: (row.application_time, row.id))
+    return len(rows), (last.application_time, last.id)
+
+async def archive_applications(archive_after_days: int) -> int:
+    threshold = datetime.datetime.utcnow() - datetime.timedelta(days=archive_after_days)
+    total, after = 0, None
+    async with AsyncSessionLocal() as db:
+        while (result := await archive_batch(db, threshold, after)) is not None:
+            count, after = result
+            total += count
+            if count < ARCHIVE_BATCH_SIZE:
+                break
+            await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+    if total:
+        logging.info(f"已归档 {total} 条早于 {archive_after_days} 天的申请")
+    return total
+
+async def list_archived(db: AsyncSession, account_id: int | None, before_id: int | None, limit: int) -> list[dict]:
+    # 只读，按原申请 id 倒序（即申请时间倒序）分页
+    query = select(ApplicationArchive, Account.email).outerjoin(Account, Account.id == ApplicationArchive.account_id)
+    if account_id is not None:
+        query = query.where(ApplicationArchive.account_id == account_id)
+    if before_id is not None:
+        query = query.where(ApplicationArchive.id < before_id)
+    rows = (await db.execute(query.order_by(ApplicationArchive.id.desc()).limit(limit))).all()
+    return [
+        {
+            "id": archived.id,
+            "account_id": archived.account_id,
+            "email": email,
+            "status": archived.status,
+            "is_first_application": bool(archived.is_first_application),
+            "application_time": archived.application_time.isoformat(),
+            "archived_at": archived.archived_at.isoformat(),
+            **decompress(archived.payload),
+        }
+        for archived, email in rows
+    ]
+
+def wake_archiver():
+    # 保留期限修改后立即按新设置检查一次
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def archiver_loop():
+    while True:
+        try:
+            _wakeup.clear()
+            archive_after_days = (await get_settings()).archive_after_days
+            if archive_after_days > 0:
+                await archive_applications(archive_after_days)
+            try:
+                await asyncio.wait_for(_wakeup.wait(), ARCHIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"申请归档出错: {str(e)}")
+            await asyncio.sleep(60)
+
+def start_archiver():
+    global _wakeup, _task
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(archiver_loop())
+    logging.info("已启动申请归档任务")
+
+async def stop_archiver():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+def main():
+    from src.database import async_engine, init_db
+    init_db()
+
+    async def run() -> tuple[int, int]:
+        try:
+            archive_after_days = (await get_settings()).archive_after_days
+            if archive_after_days <= 0:
+                return archive_after_days, 0
+            return archive_after_days, await archive_applications(archive_after_days)
+        finally:
+            await async_engine.dispose()
+
+    archive_after_days, total = asyncio.run(run())
+    if archive_after_days <= 0:
+        print("未设置归档期限（archive_after_days），不归档")
+    else:
+        print(f"已归档 {total} 条早于 {archive_after_days} 天的申请")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,14 @@
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import HTTPException, status, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 
 def get_current_user(request: Request):
     token = request.cookies.get("auth_token")
+    # 监控系统等非浏览器客户端可以使用 Authorization: Bearer <AUTH_TOKEN>
+    authorization = request.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
     if not token or token != os.getenv("AUTH_TOKEN", "admin123"):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -15,7 +21,7 @@ def authenticate_admin_password(password: str) -> bool:
     valid_passwords = os.getenv("ADMIN_PASSWORDS", "admin123").split(",")
     return password in valid_passwords
 
-def authenticate_user(email: str, db: Depends) -> bool:
+async def authenticate_user(email: str, db: AsyncSession) -> bool:
     from src.models import Account
-    account = db.query(Account).filter(Account.email == email).first()
-    return account is not None
\ No newline at end of file
+    account_id = (await db.execute(select(Account.id).where(Account.email == email))).scalar_one_or_none()
+    return account_id is not None
\ No newline at end of file
@@ -1,21 +1,51 @@
 import os
 import logging
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from src.metrics import instrument_engine
+from src.logconfig import setup_logging
 
-logging.basicConfig(filename='user-panel.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, '..', 'user-panel.db')}"
+DATABASE_PATH = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, '..', 'user-panel.db'))
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DATABASE_PATH}"
 
+# 每个连接建立时设置：WAL 允许读写并发，NORMAL 在 WAL 下足够安全
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+}
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+# 同步引擎只用于启动时初始化数据库和命令行工具，请求处理使用异步引擎
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False}
 )
+event.listen(engine, "connect", set_sqlite_pragmas)
+
+# SQLite 同一时刻只有一个写入者，连接数过多只会增加锁等待
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=int(os.getenv("SQLITE_POOL_SIZE", 4)),
+    max_overflow=0
+)
+event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+instrument_engine(async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -24,6 +54,10 @@ def init_db():
         from src.models import Settings
         logging.info("正在初始化数据库...")
         Base.metadata.create_all(bind=engine)
+        # create_all 不会修改已存在的表，索引和新增列由迁移补齐
+        from src.migrations import run_migrations
+        version = run_migrations(engine)
+        logging.info(f"数据库版本：{version}")
         db = SessionLocal()
         settings = db.query(Settings).first()
         if not settings:
@@ -35,4 +69,4 @@ def init_db():
             logging.info("设置已存在")
     except Exception as e:
         logging.error(f"数据库初始化失败: {str(e)}")
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,67 @@
+# 进程内发布订阅，用于通过 SSE 向用户面板和管理面板推送申请状态变化
+# 只在当前进程内广播：多个 uvicorn 进程时，浏览器重连到其他进程后仍会先收到一次完整状态
+import os
+import json
+import asyncio
+from contextlib import contextmanager
+
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", 500))
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+# 单个连接积压的事件数上限，超过后丢弃最旧的事件
+SSE_QUEUE_SIZE = 100
+
+ADMIN_TOPIC = "admin"
+
+_subscribers: dict[str, set[asyncio.Queue]] = {}
+
+def user_topic(account_id: int) -> str:
+    return f"user:{account_id}"
+
+def client_count() -> int:
+    return sum(len(queues) for queues in _subscribers.values())
+
+def accepting_clients() -> bool:
+    return client_count() < SSE_MAX_CLIENTS
+
+@contextmanager
+def subscribe(topic: str):
+    queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+    _subscribers.setdefault(topic, set()).add(queue)
+    try:
+        yield queue
+    finally:
+        queues = _subscribers.get(topic)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del _subscribers[topic]
+
+def publish(topic: str, event: str, data: dict):
+    for queue in _subscribers.get(topic, ()):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait((event, data))
+
+def application_changed(account_id: int, application_id: int | None, **fields):
+    # fields: application_status / account_status / job_status / email
+    data = {"application_id": application_id, **fields}
+    publish(user_topic(account_id), "application", data)
+    if application_id is not None:
+        publish(ADMIN_TOPIC, "application", data)
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream(request, topic: str, snapshot):
+    # 先订阅再读取当前状态，避免两者之间的变化被漏掉；之后只在有变化时推送，空闲时定期发送注释保持连接
+    with subscribe(topic) as queue:
+        yield "retry: 5000\n\n"
+        for event, data in await snapshot():
+            yield format_event(event, data)
+        while not await request.is_disconnected():
+            try:
+                event, data = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event, data)
@@ -0,0 +1,117 @@
+# 账户过期调度：根据最早的批准时间计算下一次到期时间，只在有账户到期时醒来
+# 到期账户按批提交禁用任务，由任务 worker 在线程中执行 usermod
+import os
+import asyncio
+import logging
+import datetime
+from sqlalchemy import select, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import AsyncSessionLocal
+from src.models import Account
+from src.jobs import enqueue_jobs, notify_workers
+from src.settings_cache import get_settings
+
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", 100))
+# 最长睡眠时间，其他进程修改有效期后最迟在这段时间内生效
+EXPIRY_MAX_SLEEP = float(os.getenv("EXPIRY_MAX_SLEEP", 3600))
+
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+
+def expiry_threshold(expiry_days: int, now: datetime.datetime | None = None) -> datetime.datetime:
+    # 批准时间早于该时刻的活跃账户已过期
+    return (now or datetime.datetime.utcnow()) - datetime.timedelta(days=expiry_days)
+
+async def next_due_time(db: AsyncSession, expiry_days: int) -> datetime.datetime | None:
+    earliest = (await db.execute(
+        select(func.min(Account.latest_approval_time))
+        .where(Account.status == '活跃状态', Account.latest_approval_time >= expiry_threshold(expiry_days))
+    )).scalar()
+    return earliest + datetime.timedelta(days=expiry_days) if earliest else None
+
+async def expire_batch(db: AsyncSession, threshold: datetime.datetime, after: tuple | None) -> tuple | None:
+    # 按 (latest_approval_time, id) 键集分页，每批提交一次
+    query = select(Account).where(Account.status == '活跃状态', Account.latest_approval_time < threshold)
+    if after is not None:
+        query = query.where(tuple_(Account.latest_approval_time, Account.id) > tuple_(*after))
+    accounts = (await db.execute(
+        query.order_by(Account.latest_approval_time, Account.id).limit(EXPIRY_BATCH_SIZE)
+    )).scalars().all()
+    if not accounts:
+        return None
+
+    # 幂等键包含批准时间，已提交过的禁用任务不会重复插入
+    await enqueue_jobs(db, 'ban', [(account, None) for account in accounts])
+    logging.info(f"已提交 {len(accounts)} 个过期账户禁用任务")
+    last = accounts[-1]
+    return (last.latest_approval_time, last.id)
+
+async def expire_accounts(expiry_days: int) -> int:
+    threshold = expiry_threshold(expiry_days)
+    batches, after = 0, None
+    async with AsyncSessionLocal() as db:
+        while (after := await expire_batch(db, threshold, after)) is not None:
+            batches += 1
+            notify_workers()
+    return batches
+
+async def preview_expiring(db: AsyncSession, days: int, limit: int) -> tuple[int, list[dict]]:
+    # 不做任何修改，列出未来 days 天内（含已过期未禁用）将会过期的账户
+    expiry_days = (await get_settings()).account_expiry_days
+    threshold = expiry_threshold(expiry_days, datetime.datetime.utcnow() + datetime.timedelta(days=days))
+    condition = (Account.status == '活跃状态', Account.latest_approval_time < threshold)
+    total = (await db.execute(select(func.count()).select_from(Account).where(*condition))).scalar()
+    accounts = (await db.execute(
+        select(Account.email, Account.latest_approval_time)
+        .where(*condition)
+        .order_by(Account.latest_approval_time, Account.id)
+        .limit(limit)
+    )).all()
+    return total, [
+        {
+            "email": email,
+            "latest_approval_time": approval_time.isoformat(),
+            "expires_at": (approval_time + datetime.timedelta(days=expiry_days)).isoformat(),
+        }
+        for email, approval_time in accounts
+    ]
+
+def reschedule():
+    # 有效期修改后立即重新计算下一次到期时间
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def scheduler_loop():
+    while True:
+        try:
+            _wakeup.clear()
+            expiry_days = (await get_settings()).account_expiry_days
+            await expire_accounts(expiry_days)
+            async with AsyncSessionLocal() as db:
+                due = await next_due_time(db, expiry_days)
+            delay = EXPIRY_MAX_SLEEP
+            if due is not None:
+                delay = min(delay, max(0.0, (due - datetime.datetime.utcnow()).total_seconds()))
+                logging.info(f"下一个账户将于 {due.isoformat()} 过期")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"账户过期检查出错: {str(e)}")
+            await asyncio.sleep(60)
+
+def start_scheduler():
+    global _wakeup, _task
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(scheduler_loop())
+    logging.info("已启动账户过期调度")
+
+async def stop_scheduler():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
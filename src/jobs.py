@@ -0,0 +1,337 @@
+import os
+import asyncio
+import logging
+import datetime
+from sqlalchemy import select, or_, and_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from src.database import AsyncSessionLocal
+from src.models import Account, Application, ProvisionJob
+from src.pending import clear_pending
+from src.metrics import job_results
+from src import events
+from src.utils import generate_password, hash_password, send_account_details
+from src.provision import backend, configured_hosts, fan_out, remaining_hosts, record_host_results
+
+PROVISION_WORKERS = int(os.getenv("PROVISION_WORKERS", 4))
+PROVISION_MAX_ATTEMPTS = int(os.getenv("PROVISION_MAX_ATTEMPTS", 3))
+PROVISION_RETRY_DELAY = float(os.getenv("PROVISION_RETRY_DELAY", 10))
+# 每次最多领取的任务数，多个创建任务会合并为一次批量创建
+PROVISION_BATCH_SIZE = int(os.getenv("PROVISION_BATCH_SIZE", 50))
+PROVISION_POLL_INTERVAL = float(os.getenv("PROVISION_POLL_INTERVAL", 5))
+# 超过该时间仍处于 running 的任务视为所在进程已退出，允许重新领取
+PROVISION_STALE_SECONDS = int(os.getenv("PROVISION_STALE_SECONDS", 600))
+
+_wakeup: asyncio.Event | None = None
+_workers: list[asyncio.Task] = []
+
+def job_key(kind: str, account: Account, application: Application | None = None) -> str:
+    if kind == 'create':
+        return f"create:{application.id}"
+    return f"ban:{account.id}:{account.latest_approval_time.isoformat() if account.latest_approval_time else ''}"
+
+async def get_job_by_key(db: AsyncSession, key: str) -> ProvisionJob | None:
+    return (await db.execute(select(ProvisionJob).where(ProvisionJob.idempotency_key == key))).scalar_one_or_none()
+
+async def enqueue_job(db: AsyncSession, kind: str, account: Account, application: Application | None = None, notify: bool = True) -> ProvisionJob:
+    key = job_key(kind, account, application)
+    job = await get_job_by_key(db, key)
+    if job is None:
+        now = datetime.datetime.utcnow()
+        # 并发请求可能同时提交同一个任务，以幂等键去重
+        result = await db.execute(
+            sqlite_insert(ProvisionJob)
+            .values(
+                idempotency_key=key,
+                kind=kind,
+                account_id=account.id,
+                application_id=application.id if application else None,
+                status='queued',
+                attempts=0,
+                run_after=now,
+                created_at=now,
+                updated_at=now,
+            )
+            .on_conflict_do_nothing(index_elements=[ProvisionJob.idempotency_key])
+        )
+        await db.commit()
+        job = await get_job_by_key(db, key)
+        if result.rowcount != 1:
+            return job
+    elif job.status == 'failed':
+        # 重新提交失败的任务
+        now = datetime.datetime.utcnow()
+        job.status = 'queued'
+        job.attempts = 0
+        job.last_error = None
+        job.run_after = now
+        job.updated_at = now
+        await db.commit()
+    else:
+        return job
+
+    logging.info(f"已提交任务 {job.idempotency_key}")
+    if notify:
+        notify_workers()
+    return job
+
+async def enqueue_jobs(db: AsyncSession, kind: str, targets: list[tuple[Account, Application | None]]) -> dict[str, str]:
+    # 批量提交任务并在一个事务中提交，返回 {幂等键: 状态}；新提交或重新提交的任务为 queued
+    # 不唤醒 worker，由调用方在全部批次提交后调用 notify_workers
+    if not targets:
+        return {}
+    now = datetime.datetime.utcnow()
+    keys = [job_key(kind, account, application) for account, application in targets]
+    existing = dict((await db.execute(
+        select(ProvisionJob.idempotency_key, ProvisionJob.status).where(ProvisionJob.idempotency_key.in_(keys))
+    )).all())
+    await db.execute(
+        sqlite_insert(ProvisionJob)
+        .values([
+            dict(
+                idempotency_key=key,
+                kind=kind,
+                account_id=account.id,
+                application_id=application.id if application else None,
+                status='queued',
+                attempts=0,
+                run_after=now,
+                created_at=now,
+                updated_at=now,
+            )
+            for key, (account, application) in zip(keys, targets)
+        ])
+        .on_conflict_do_nothing(index_elements=[ProvisionJob.idempotency_key])
+    )
+    # 之前执行失败的任务重新排队
+    await db.execute(
+        update(ProvisionJob)
+        .where(ProvisionJob.idempotency_key.in_(keys), ProvisionJob.status == 'failed')
+        .values(status='queued', attempts=0, last_error=None, run_after=now, updated_at=now)
+    )
+    await db.commit()
+    return {key: 'queued' if existing.get(key, 'failed') == 'failed' else existing[key] for key in keys}
+
+def notify_workers():
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def claim_jobs(db: AsyncSession, limit: int) -> list[int]:
+    now = datetime.datetime.utcnow()
+    stale = now - datetime.timedelta(seconds=PROVISION_STALE_SECONDS)
+    claimable = or_(
+        and_(ProvisionJob.status == 'queued', ProvisionJob.run_after <= now),
+        and_(ProvisionJob.status == 'running', ProvisionJob.updated_at < stale),
+    )
+    candidates = (await db.execute(
+        select(ProvisionJob.id).where(claimable).order_by(ProvisionJob.id).limit(limit)
+    )).scalars().all()
+    claimed = []
+    for job_id in candidates:
+        # 多个 worker（或多个 uvicorn 进程）竞争时只有一个能更新成功
+        result = await db.execute(
+            update(ProvisionJob)
+            .where(ProvisionJob.id == job_id, claimable)
+            .values(status='running', attempts=ProvisionJob.attempts + 1, updated_at=now)
+        )
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    await db.commit()
+    return claimed
+
+async def finish_job(db: AsyncSession, job: ProvisionJob):
+    now = datetime.datetime.utcnow()
+    account = job.account
+    if job.kind == 'create':
+        account.status = '活跃状态'
+        account.latest_approval_time = now
+        job.application.status = '同意'
+        await clear_pending(db, job.application)
+    else:
+        account.status = '不活跃状态'
+    job.status = 'done'
+    job.last_error = None
+    job.updated_at = now
+    await db.commit()
+    job_results.inc(job.kind, 'done')
+    if job.kind == 'create':
+        events.application_changed(
+            account.id, job.application_id,
+            application_status='同意', account_status='活跃状态', job_status='done', email=account.email,
+        )
+    else:
+        events.application_changed(account.id, None, account_status='不活跃状态')
+
+def ban_is_stale(job: ProvisionJob) -> bool:
+    # 幂等键记录了提交时的批准时间；之后账户被重新批准（或已不是活跃状态）时，这个禁用任务已经过时
+    account = job.account
+    return account.status != '活跃状态' or job.idempotency_key != job_key('ban', account)
+
+async def skip_job(db: AsyncSession, job: ProvisionJob):
+    # 过时的禁用任务不再执行，直接标记为完成，不修改账户状态
+    job.status = 'done'
+    job.last_error = None
+    job.updated_at = datetime.datetime.utcnow()
+    await db.commit()
+    job_results.inc(job.kind, 'skipped')
+    logging.info(f"任务 {job.idempotency_key} 已过时，跳过：{job.account.email}")
+
+async def defer_job(db: AsyncSession, job: ProvisionJob, run_after: datetime.datetime):
+    # 放回队列且不计入重试次数
+    job.status = 'queued'
+    job.attempts -= 1
+    job.run_after = run_after
+    job.updated_at = datetime.datetime.utcnow()
+    await db.commit()
+    logging.info(f"任务 {job.idempotency_key} 等待同一账户的创建任务重试后再执行：{job.account.email}")
+
+async def fail_job(db: AsyncSession, job: ProvisionJob, error: str):
+    now = datetime.datetime.utcnow()
+    job.last_error = error
+    job.updated_at = now
+    if job.attempts < PROVISION_MAX_ATTEMPTS:
+        job.status = 'queued'
+        job.run_after = now + datetime.timedelta(seconds=PROVISION_RETRY_DELAY * 2 ** (job.attempts - 1))
+        logging.warning(f"任务 {job.idempotency_key} 第 {job.attempts} 次执行失败，稍后重试: {error}")
+    else:
+        job.status = 'failed'
+        logging.error(f"任务 {job.idempotency_key} 执行失败: {error}")
+    await db.commit()
+    job_results.inc(job.kind, 'retry' if job.status == 'queued' else 'failed')
+    if job.kind == 'create' and job.status == 'failed':
+        events.application_changed(job.account_id, job.application_id, job_status='failed', email=job.account.email)
+
+async def send_details(email: str, password: str):
+    try:
+        await send_account_details(email, password)
+    except Exception as e:
+        logging.error(f"发送账户信息至 {email} 失败: {str(e)}")
+
+async def run_creates(db: AsyncSession, jobs: list[ProvisionJob], remaining: dict[int, list[str]]) -> list[tuple]:
+    # 首次新建账户时生成密码并保存哈希，之后重试的服务器使用同一个哈希；明文密码只在本次执行中用于发送邮件
+    passwords = {job.id: generate_password() for job in jobs if job.password_hash is None}
+    generated = await asyncio.to_thread(lambda: {job_id: hash_password(p) for job_id, p in passwords.items()})
+    hashes = {job.id: job.password_hash or generated[job.id] for job in jobs}
+
+    host_entries = {host: [] for host in configured_hosts()}
+    for job in jobs:
+        for host in remaining[job.id]:
+            host_entries[host].append((job.account.email, job.application.public_key, hashes[job.id]))
+    results = await fan_out('create', host_entries)
+    await record_host_results(db, 'create', {job.account.email: job.account_id for job in jobs}, results)
+
+    outcomes = []
+    for job in jobs:
+        email = job.account.email
+        host_results = {host: results[host][email] for host in remaining[job.id]}
+        password = None
+        if job.password_hash is None and any(result["created"] for result in host_results.values()):
+            job.password_hash = hashes[job.id]
+            password = passwords[job.id]
+        errors = [f"{host}: {result['error']}" for host, result in host_results.items() if result["error"]]
+        outcomes.append((job, password, "; ".join(errors) or None))
+    await db.commit()
+    return outcomes
+
+async def run_bans(db: AsyncSession, jobs: list[ProvisionJob], remaining: dict[int, list[str]]) -> list[tuple]:
+    host_entries = {host: [] for host in configured_hosts()}
+    for job in jobs:
+        for host in remaining[job.id]:
+            host_entries[host].append(job.account.email)
+    results = await fan_out('lock', host_entries)
+    await record_host_results(db, 'ban', {job.account.email: job.account_id for job in jobs}, results)
+    await db.commit()
+    outcomes = []
+    for job in jobs:
+        errors = [
+            f"{host}: {results[host][job.account.email]['error']}"
+            for host in remaining[job.id] if results[host][job.account.email]["error"]
+        ]
+        outcomes.append((job, None, "; ".join(errors) or None))
+    return outcomes
+
+async def run_jobs(job_ids: list[int]):
+    async with AsyncSessionLocal() as db:
+        jobs = (await db.execute(
+            select(ProvisionJob)
+            .where(ProvisionJob.id.in_(job_ids))
+            .options(selectinload(ProvisionJob.account), selectinload(ProvisionJob.application))
+        )).scalars().all()
+        remaining = await remaining_hosts(db, jobs)
+        # 结束读事务，避免在执行系统命令期间占用数据库连接
+        await db.commit()
+        creates = [job for job in jobs if job.kind == 'create']
+        bans = [job for job in jobs if job.kind != 'create']
+
+        # 同一批次的创建任务在每台服务器上合并为一次批量创建，各服务器并发执行
+        if creates:
+            await finish_outcomes(db, await run_creates(db, creates, remaining))
+
+        # 创建任务结束后再判断禁用任务是否过时：重新批准成功的账户批准时间已更新，禁用任务跳过；
+        # 创建任务仍在等待重试的账户，禁用任务推迟到重试之后再判断；创建最终失败的账户照常禁用
+        retrying = {job.account_id: job.run_after for job in creates if job.status == 'queued'}
+        deferred = [job for job in bans if job.account_id in retrying]
+        stale = [job for job in bans if job.account_id not in retrying and ban_is_stale(job)]
+        bans = [job for job in bans if job not in deferred and job not in stale]
+        for job in deferred:
+            await defer_job(db, job, retrying[job.account_id])
+        for job in stale:
+            await skip_job(db, job)
+        if bans:
+            await finish_outcomes(db, await run_bans(db, bans, remaining))
+
+async def finish_outcomes(db: AsyncSession, outcomes: list[tuple]):
+    for job, password, error in outcomes:
+        if password is not None:
+            # 账户已在部分服务器上创建，无论其余服务器是否成功都要把密码告诉用户
+            await send_details(job.account.email, password)
+        if error is not None:
+            await fail_job(db, job, error)
+            continue
+        await finish_job(db, job)
+        logging.info(f"任务 {job.idempotency_key} 已完成：{job.account.email}")
+        if job.kind == 'create' and job.password_hash is None:
+            # 所有服务器上账户都已存在，只解锁
+            await send_details(job.account.email, "未修改")
+
+async def worker_loop(worker_id: int):
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                job_ids = await claim_jobs(db, PROVISION_BATCH_SIZE)
+            if not job_ids:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), PROVISION_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                _wakeup.clear()
+                continue
+            await run_jobs(job_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"任务 worker {worker_id} 出错: {str(e)}")
+            await asyncio.sleep(PROVISION_POLL_INTERVAL)
+
+def start_workers():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    for i in range(PROVISION_WORKERS):
+        _workers.append(asyncio.create_task(worker_loop(i)))
+    logging.info(f"已启动 {PROVISION_WORKERS} 个账户任务 worker")
+
+async def stop_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    await backend.close()
+
+async def job_statuses(db: AsyncSession, application_ids) -> dict[int, str]:
+    if not application_ids:
+        return {}
+    return dict((await db.execute(
+        select(ProvisionJob.application_id, ProvisionJob.status)
+        .where(ProvisionJob.application_id.in_(application_ids))
+    )).all())
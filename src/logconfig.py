@@ -0,0 +1,166 @@
+# 统一的日志配置：调用方只把日志放入队列，由后台线程写入文件，不阻塞事件循环
+# 每行一个 JSON 对象，包含请求 ID；结构化字段中的密码、验证码等会被替换为 ***
+# 文件按大小（LOG_MAX_BYTES）或时间（LOG_ROTATE_WHEN，如 midnight）轮转，旧文件压缩为 .gz
+# 轮转只在单进程中安全：多个 worker 各自判断并重命名同一个文件会互相覆盖、丢失日志
+# 多进程运行（uvicorn --workers、多个实例）时设置 LOG_ROTATE_EXTERNAL=true，各进程只追加写入，由 logrotate 轮转：
+#   /var/log/user-panel.log { daily rotate 10 compress missingok notifempty }
+# 此时使用 WatchedFileHandler，发现文件被移走后重新打开，logrotate 不需要 copytruncate 或通知进程
+import os
+import gzip
+import json
+import time
+import uuid
+import queue
+import atexit
+import shutil
+import logging
+import datetime
+import logging.handlers
+from contextvars import ContextVar
+
+LOG_FILE = os.getenv("LOG_FILE", "user-panel.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 10))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_ROTATE_EXTERNAL = os.getenv("LOG_ROTATE_EXTERNAL", "false").lower() == "true"
+
+REDACTED = "***"
+# 字段名包含这些词时整体替换（server_password、auth_token 等）
+SECRET_WORDS = ("password", "passwd", "secret", "token", "authorization", "cookie")
+# 验证码和邮件正文
+SECRET_FIELDS = {"code", "verification_code", "body", "content"}
+
+# LogRecord 自带的属性，其余属性来自 extra，作为结构化字段输出
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+def redact(value, key: str = ""):
+    key = key.lower()
+    if key in SECRET_FIELDS or any(word in key for word in SECRET_WORDS):
+        return REDACTED
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        rid = getattr(record, "request_id", None)
+        if rid:
+            entry["request_id"] = rid
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key != "request_id":
+                entry[key] = redact(value, key)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    # 在调用方线程中记下请求 ID，格式化和写文件都交给后台线程
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id.get()
+        return record
+
+def gzip_rotator(source: str, dest: str):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def build_file_handler() -> logging.Handler:
+    if LOG_ROTATE_EXTERNAL:
+        handler = logging.handlers.WatchedFileHandler(LOG_FILE, encoding="utf-8")
+        handler.setFormatter(JSONFormatter())
+        return handler
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8",
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8",
+        )
+    handler.namer = lambda name: name + ".gz"
+    handler.rotator = gzip_rotator
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+_listener: logging.handlers.QueueListener | None = None
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(ContextQueueHandler(log_queue))
+    # httpx 在 INFO 级别记录完整的请求 URL（可能包含验证码等路径参数），只保留警告和错误
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+    _listener = logging.handlers.QueueListener(log_queue, build_file_handler(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+def stop_logging():
+    # 写完队列中剩余的日志
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def redact_path(scope) -> str:
+    # 路径参数按字段名脱敏，如 /verify/{code} 记为 /verify/***，其余参数（任务 id 等）保留
+    path = scope["path"]
+    for key, value in (scope.get("path_params") or {}).items():
+        if value and redact(value, key) == REDACTED:
+            path = path.replace(str(value), REDACTED)
+    return path
+
+class RequestLogMiddleware:
+    # 纯 ASGI 中间件：为每个请求分配 ID（或沿用 X-Request-ID），记录状态码和耗时
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        rid = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        token = request_id.set(rid)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get("route")
+            logging.getLogger("access").info(
+                "请求完成",
+                extra={
+                    "method": scope["method"],
+                    "path": redact_path(scope),
+                    "route": route.path if route is not None else None,
+                    "status": status_code,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                },
+            )
+            request_id.reset(token)
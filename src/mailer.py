@@ -0,0 +1,213 @@
+import os
+import time
+import asyncio
+import logging
+import smtplib
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from sqlalchemy import select, or_, and_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import AsyncSessionLocal
+from src.models import MailOutbox
+from src.metrics import timed, mail_seconds
+
+MAIL_RATE_PER_MINUTE = float(os.getenv("MAIL_RATE_PER_MINUTE", 60))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 20))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 5))
+MAIL_RETRY_DELAY = float(os.getenv("MAIL_RETRY_DELAY", 30))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", 5))
+MAIL_STALE_SECONDS = int(os.getenv("MAIL_STALE_SECONDS", 600))
+# 连接空闲超过该时间后主动断开，下次发送时重新登录
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", 60))
+
+def smtp_configured() -> bool:
+    return os.getenv('SMTP_PASSWORD') != 'your-smtp-password'
+
+class SMTPConnection:
+    # 长连接，只在发送线程中使用
+    def __init__(self):
+        self.server: smtplib.SMTP | None = None
+        self.last_used = 0.0
+
+    def connect(self):
+        with timed(mail_seconds, "mail", "connect"):
+            server = smtplib.SMTP(os.getenv('SMTP_HOST'), int(os.getenv('SMTP_PORT', 587)), timeout=30)
+            if os.getenv('SMTP_STARTTLS', 'true').lower() != 'false':
+                server.starttls()
+            if os.getenv('SMTP_USER') and os.getenv('SMTP_PASSWORD'):
+                server.login(os.getenv('SMTP_USER'), os.getenv('SMTP_PASSWORD'))
+        self.server = server
+        logging.info("已连接 SMTP 服务器")
+
+    def send(self, msg: MIMEText):
+        if self.server is None:
+            self.connect()
+        try:
+            with timed(mail_seconds, "mail", "send"):
+                self.server.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # 服务器断开了空闲连接，重连后再试一次
+            self.close()
+            self.connect()
+            with timed(mail_seconds, "mail", "send"):
+                self.server.send_message(msg)
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self.server is not None and time.monotonic() - self.last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass
+        self.server = None
+
+_connection = SMTPConnection()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smtp")
+_wakeup: asyncio.Event | None = None
+_sender: asyncio.Task | None = None
+
+def build_message(mail: MailOutbox) -> MIMEText:
+    msg = MIMEText(mail.body)
+    msg['Subject'] = mail.subject
+    msg["From"] = os.getenv('SMTP_USER')
+    msg["To"] = mail.recipient
+    return msg
+
+async def enqueue_mail(email: str, subject: str, content: str) -> int:
+    async with AsyncSessionLocal() as db:
+        mail = MailOutbox(recipient=email, subject=subject, body=content, status='queued')
+        db.add(mail)
+        await db.commit()
+    notify_sender()
+    return mail.id
+
+def notify_sender():
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def claim_mails(db: AsyncSession, limit: int) -> list[int]:
+    now = datetime.datetime.utcnow()
+    stale = now - datetime.timedelta(seconds=MAIL_STALE_SECONDS)
+    claimable = or_(
+        and_(MailOutbox.status == 'queued', MailOutbox.run_after <= now),
+        and_(MailOutbox.status == 'sending', MailOutbox.updated_at < stale),
+    )
+    candidates = (await db.execute(
+        select(MailOutbox.id).where(claimable).order_by(MailOutbox.id).limit(limit)
+    )).scalars().all()
+    claimed = []
+    for mail_id in candidates:
+        result = await db.execute(
+            update(MailOutbox)
+            .where(MailOutbox.id == mail_id, claimable)
+            .values(status='sending', attempts=MailOutbox.attempts + 1, updated_at=now)
+        )
+        if result.rowcount == 1:
+            claimed.append(mail_id)
+    await db.commit()
+    return claimed
+
+async def release_mails(db: AsyncSession, mail_ids: list[int]):
+    if not mail_ids:
+        return
+    await db.rollback()
+    await db.execute(
+        update(MailOutbox)
+        .where(MailOutbox.id.in_(mail_ids), MailOutbox.status == 'sending')
+        .values(status='queued', attempts=MailOutbox.attempts - 1)
+    )
+    await db.commit()
+
+async def mark_failed(db: AsyncSession, mail: MailOutbox, error: str):
+    now = datetime.datetime.utcnow()
+    mail.last_error = error
+    mail.updated_at = now
+    if mail.attempts < MAIL_MAX_ATTEMPTS:
+        mail.status = 'queued'
+        mail.run_after = now + datetime.timedelta(seconds=MAIL_RETRY_DELAY * 2 ** (mail.attempts - 1))
+        logging.warning(f"发送邮件至 {mail.recipient} 第 {mail.attempts} 次失败，稍后重试: {error}")
+    else:
+        mail.status = 'failed'
+        # 正文可能包含密码和验证码，不再重试的邮件不保留正文
+        mail.body = None
+        logging.error(f"发送邮件至 {mail.recipient} 失败: {error}")
+    await db.commit()
+
+async def deliver(db: AsyncSession, mail_id: int):
+    loop = asyncio.get_running_loop()
+    mail = await db.get(MailOutbox, mail_id)
+    # 结束读事务，避免在等待 SMTP 期间占用数据库连接
+    await db.commit()
+    if not smtp_configured():
+        logging.info("SMTP 未设置，跳过发送邮件")
+        mail.status = 'skipped'
+        mail.body = None
+        mail.updated_at = datetime.datetime.utcnow()
+        await db.commit()
+        return
+    try:
+        await loop.run_in_executor(_executor, _connection.send, build_message(mail))
+    except Exception as e:
+        await loop.run_in_executor(_executor, _connection.close)
+        await mark_failed(db, mail, str(e))
+        return
+    now = datetime.datetime.utcnow()
+    mail.status = 'sent'
+    mail.body = None
+    mail.last_error = None
+    mail.sent_at = now
+    mail.updated_at = now
+    await db.commit()
+    logging.info(f"已发送邮件至 {mail.recipient}")
+
+async def sender_loop():
+    loop = asyncio.get_running_loop()
+    interval = 60 / MAIL_RATE_PER_MINUTE if MAIL_RATE_PER_MINUTE > 0 else 0
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                mail_ids = await claim_mails(db, MAIL_BATCH_SIZE)
+                remaining = list(mail_ids)
+                try:
+                    while remaining:
+                        started = time.monotonic()
+                        await deliver(db, remaining[0])
+                        remaining.pop(0)
+                        # 按配置的速率限速
+                        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+                except asyncio.CancelledError:
+                    # 关闭时把已领取但未发送的邮件放回队列
+                    await release_mails(db, remaining)
+                    raise
+            if not mail_ids:
+                await loop.run_in_executor(_executor, _connection.close_if_idle)
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), MAIL_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                _wakeup.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"邮件发送任务出错: {str(e)}")
+            await asyncio.sleep(MAIL_POLL_INTERVAL)
+
+def start_sender():
+    global _wakeup, _sender
+    _wakeup = asyncio.Event()
+    _sender = asyncio.create_task(sender_loop())
+    logging.info("已启动邮件发送任务")
+
+async def stop_sender():
+    global _sender
+    if _sender is not None:
+        _sender.cancel()
+        await asyncio.gather(_sender, return_exceptions=True)
+        _sender = None
+    await asyncio.get_running_loop().run_in_executor(_executor, _connection.close)
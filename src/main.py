@@ -1,52 +1,77 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from src.database import SessionLocal, init_db
-from src.models import Account, Application, Whitelist, Settings
-from src.utils import send_verification_email, create_server_account, send_account_details, ban_server_account, send_rejection_email
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from src.database import AsyncSessionLocal, async_engine, init_db
+from src.models import Account, Application, ProvisionJob, MailOutbox, PendingApplication
+from src.utils import send_verification_email, send_rejection_email, get_username_from_email
+from src.jobs import job_key, enqueue_job, enqueue_jobs, notify_workers, start_workers, stop_workers, job_statuses
+from src.mailer import start_sender, stop_sender
+from src.expiry import start_scheduler, stop_scheduler, reschedule, preview_expiring
+from src.settings_cache import get_settings, update_settings
+from src.provision import host_statuses
+from src.policy import get_policy, import_csv, export_csv
+from src.search import search_applications
+from src.reconcile import reconcile
+from src.archive import start_archiver, stop_archiver, wake_archiver, list_archived
+from src.pending import record_application, mark_pending, clear_pending, clear_pending_ids, is_pending, pending_ids, list_pending
 from src.auth import get_current_user, authenticate_admin_password, authenticate_user
-from pydantic import EmailStr
+from src import metrics, ratelimit, events
+from src.logconfig import RequestLogMiddleware
+from pydantic import BaseModel, EmailStr
+from typing import Literal
 import os
 import datetime
 import logging
-import asyncio
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from sqlalchemy import func, desc
+from sqlalchemy import select, func, tuple_
 
 load_dotenv()
 
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 50))
+ADMIN_MAX_PAGE_SIZE = 200
+# 批量审批一次最多处理的申请数，以及每个事务提交的申请数
+ADMIN_BULK_MAX = int(os.getenv("ADMIN_BULK_MAX", 1000))
+ADMIN_BULK_BATCH_SIZE = int(os.getenv("ADMIN_BULK_BATCH_SIZE", 100))
+# 该时间内重复提交申请时复用尚未验证的申请，重新发送同一个验证码
+APPLY_COALESCE_MINUTES = float(os.getenv("APPLY_COALESCE_MINUTES", 30))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
         init_db()
-        # logging.info("启动过期账户检查任务...")
-        # asyncio.create_task(check_expired_accounts())
+        start_workers()
+        start_sender()
+        start_scheduler()
+        start_archiver()
     except Exception as e:
         logging.error(f"启动失败: {str(e)}")
         raise
     yield
+    await stop_archiver()
+    await stop_scheduler()
+    await stop_workers()
+    await stop_sender()
+    await async_engine.dispose()
     logging.info("应用正在关闭。")
 
 app = FastAPI(lifespan=lifespan)
+app.middleware("http")(metrics.metrics_middleware)
+app.add_middleware(RequestLogMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+metrics.instrument_templates(templates)
 
-logging.basicConfig(filename='account_management.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
-
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @app.get("/", response_class=HTMLResponse)
-async def index(request: Request, db: Session = Depends(get_db)):
-    settings = db.query(Settings).first()
+async def index(request: Request):
+    settings = await get_settings()
     return templates.TemplateResponse("index.html", {
         "request": request,
         "title": os.getenv("APP_TITLE", "服务器账户申请"),
@@ -54,11 +79,14 @@ async def index(request: Request, db: Session = Depends(get_db)):
         "homepage_message": settings.homepage_message
     })
 
-def valid_email(email: str) -> bool:
-    domains = os.getenv("ALLOWED_EMAIL_DOMAINS", "").split(",")
-    if len(domains) == 0 and domains[0] == "":
-        return True
-    return any(email.endswith(domain) for domain in domains)
+async def get_recent_unverified(db: AsyncSession, account: Account) -> Application | None:
+    if APPLY_COALESCE_MINUTES <= 0 or account.latest_application_id is None:
+        return None
+    application = await db.get(Application, account.latest_application_id)
+    window_start = datetime.datetime.utcnow() - datetime.timedelta(minutes=APPLY_COALESCE_MINUTES)
+    if application.status == '等待验证' and application.verification_code and application.application_time >= window_start:
+        return application
+    return None
 
 @app.post("/apply", response_class=HTMLResponse)
 async def apply_account(
@@ -66,198 +94,369 @@ async def apply_account(
     email: EmailStr = Form(...),
     public_key: str = Form(None),
     application_reason: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    if not valid_email(email):
-            raise HTTPException(status_code=400, detail="无效的邮箱域名")
-
-    account = db.query(Account).filter(Account.email == email).first()
+    reason = (await get_policy()).check(email)
+    if reason is not None:
+        raise HTTPException(status_code=400, detail=reason)
+    try:
+        # 用户名由邮箱前缀生成，不能生成有效用户名的邮箱无法创建系统账户，不进入任务队列
+        get_username_from_email(email)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="邮箱前缀只能包含字母、数字、下划线、点和连字符，且不超过 31 个字符")
+
+    for limit, identity in ((ratelimit.APPLY_IP_LIMIT, ratelimit.client_ip(request)), (ratelimit.APPLY_EMAIL_LIMIT, email)):
+        retry_after = await ratelimit.check(limit, identity)
+        if retry_after > 0:
+            metrics.rate_limited.inc(limit.scope)
+            logging.warning(f"申请过于频繁（{limit.scope}）：{identity}")
+            raise HTTPException(
+                status_code=429,
+                detail=f"请求过于频繁，请 {int(retry_after) + 1} 秒后再试",
+                headers={"Retry-After": str(int(retry_after) + 1)},
+            )
+
+    account = (await db.execute(select(Account).where(Account.email == email))).scalar_one_or_none()
     if not account:
         account = Account(email=email, status='未创建')
         db.add(account)
-        db.commit()
-
-    verification_code = os.urandom(16).hex()
-    application = Application(
-        account_id=account.id,
-        public_key=public_key,
-        application_reason=application_reason,
-        verification_code=verification_code,
-        status='等待验证',
-        is_first_application=(account.status == '未创建'),
-        application_time=datetime.datetime.utcnow()
-    )
-    db.add(application)
-    db.commit()
-
-    send_verification_email(email, verification_code)
+        await db.flush()
+
+    application = await get_recent_unverified(db, account)
+    if application is not None:
+        # 重复提交：更新申请内容，沿用原来的验证码
+        application.public_key = public_key
+        application.application_reason = application_reason
+        verification_code = application.verification_code
+        await db.commit()
+        metrics.coalesced_applications.inc()
+        logging.info(f"合并重复申请：{email}")
+    else:
+        verification_code = os.urandom(16).hex()
+        application = Application(
+            account_id=account.id,
+            public_key=public_key,
+            application_reason=application_reason,
+            verification_code=verification_code,
+            status='等待验证',
+            is_first_application=(account.status == '未创建'),
+            application_time=datetime.datetime.utcnow()
+        )
+        db.add(application)
+        await record_application(db, account, application)
+        await db.commit()
+        events.application_changed(account.id, application.id, application_status='等待验证', email=email)
+
+    await send_verification_email(email, verification_code)
     return templates.TemplateResponse("message.html", {
         "request": request,
         "message": "已发送验证邮件，请检查您的邮箱。"
     })
 
 @app.get("/verify/{code}", response_class=HTMLResponse)
-async def verify_email(code: str, request: Request, db: Session = Depends(get_db)):
-    application = db.query(Application).filter(Application.verification_code == code).first()
+async def verify_email(code: str, request: Request, db: AsyncSession = Depends(get_db)):
+    application = (await db.execute(
+        select(Application)
+        .where(Application.verification_code == code)
+        .options(selectinload(Application.account))
+    )).scalar_one_or_none()
     if not application:
         raise HTTPException(status_code=404, detail="无效的验证代码")
 
     application.status = '等待管理员同意'
     application.verification_code = None
-    db.commit()
-
-    settings = db.query(Settings).first()
-    if settings.auto_approve:
-        try:
-            account = db.query(Account).filter(Account.id == application.account_id).first()
-            password = create_server_account(account.email, application.public_key)
-            account.status = '活跃状态'
-            account.latest_approval_time = datetime.datetime.utcnow()
-            application.status = '同意'
-            db.commit()
-            send_account_details(account.email, password)
-            logging.info(f"自动批准账户：{account.email}")
-            return templates.TemplateResponse("message.html", {
-                "request": request,
-                "message": "账户已自动创建，请检查您的邮箱获取详细信息。"
-            })
-        except Exception as e:
-            logging.error(f"自动批准失败：{account.email}: {str(e)}")
-            application.status = '等待管理员同意'
-            db.commit()
+    await mark_pending(db, application.account, application)
+    await db.commit()
+    email = application.account.email
+    events.application_changed(application.account_id, application.id, application_status='等待管理员同意', email=email)
+
+    if (await get_settings()).auto_approve:
+        job = await enqueue_job(db, 'create', application.account, application)
+        events.application_changed(application.account_id, application.id, job_status=job.status, email=email)
+        logging.info(f"自动批准账户：{email}")
+        # 点击验证链接即证明拥有该邮箱，设置与用户登录相同的 Cookie，进度页只对本人可见
+        response = RedirectResponse(url=f"/progress/{job.id}", status_code=status.HTTP_303_SEE_OTHER)
+        response.set_cookie(key="user_email", value=email, httponly=True)
+        return response
 
     return templates.TemplateResponse("message.html", {
         "request": request,
         "message": "邮箱已验证，等待管理员审批。"
     })
 
-def get_latest_pendings(db: Session):
-    subquery = ( 
-        db.query( 
-            Application.account_id, 
-            func.max(Application.application_time).label('max_time') 
-        ) 
-        .group_by(Application.account_id)
-        .subquery()
-    )
+async def get_latest_pendings(db: AsyncSession):
+    return await list_pending(db)
 
-    latest_pendings = ( 
-        db.query(Application) 
-        .join( 
-            subquery, 
-            (Application.account_id == subquery.c.account_id) 
-            & (Application.application_time == subquery.c.max_time) 
-            & (Application.status == '等待管理员同意')
-        ) 
-        .all() 
-    )
-    return latest_pendings
+def parse_date(value: str | None) -> datetime.date | None:
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无效的日期：{value}")
+
+def encode_cursor(application: Application) -> str:
+    return f"{application.application_time.isoformat()}_{application.id}"
+
+def decode_cursor(cursor: str) -> tuple[datetime.datetime, int]:
+    try:
+        time_str, id_str = cursor.rsplit("_", 1)
+        return datetime.datetime.fromisoformat(time_str), int(id_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+def application_filters(
+    status: str | None = None,
+    first: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    cursor: str | None = None,
+    limit: int = ADMIN_PAGE_SIZE,
+) -> dict:
+    if first not in (None, "", "true", "false"):
+        raise HTTPException(status_code=400, detail="first 只能为 true 或 false")
+    return {
+        "status": status or None,
+        "first": None if not first else first == "true",
+        "date_from": parse_date(date_from),
+        "date_to": parse_date(date_to),
+        "cursor": cursor or None,
+        "limit": max(1, min(limit, ADMIN_MAX_PAGE_SIZE)),
+    }
+
+async def list_applications(db: AsyncSession, filters: dict) -> tuple[list[Application], str | None]:
+    # 按 (application_time, id) 倒序做键集分页，并在同一查询中带出账户邮箱
+    query = select(Application).options(joinedload(Application.account))
+    if filters["status"]:
+        query = query.where(Application.status == filters["status"])
+    if filters["first"] is not None:
+        query = query.where(Application.is_first_application == filters["first"])
+    if filters["date_from"]:
+        query = query.where(Application.application_time >= datetime.datetime.combine(filters["date_from"], datetime.time.min))
+    if filters["date_to"]:
+        query = query.where(Application.application_time < datetime.datetime.combine(filters["date_to"] + datetime.timedelta(days=1), datetime.time.min))
+    if filters["cursor"]:
+        query = query.where(tuple_(Application.application_time, Application.id) < tuple_(*decode_cursor(filters["cursor"])))
+
+    limit = filters["limit"]
+    applications = (await db.execute(
+        query.order_by(Application.application_time.desc(), Application.id.desc())
+        .limit(limit + 1)
+    )).scalars().all()
+    next_cursor = encode_cursor(applications[limit - 1]) if len(applications) > limit else None
+    return applications[:limit], next_cursor
+
+async def get_latest_pending_ids(db: AsyncSession, applications: list[Application]) -> set[int]:
+    # 待审批队列中只保存各账户最新且等待管理员同意的申请
+    return await pending_ids(db, [a.id for a in applications if a.status == '等待管理员同意'])
 
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_dashboard(request: Request, current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
-    applications = db.query(Application).all()
-    settings = db.query(Settings).first() # 使用子查询获取每个 account_id 的最大 application_time
-    latest_pendings = get_latest_pendings(db)
-    latest_pending_ids = {app.id for app in latest_pendings}
+async def admin_dashboard(request: Request, filters: dict = Depends(application_filters), current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    applications, next_cursor = await list_applications(db, filters)
+    settings = await get_settings()
+    latest_pending_ids = await get_latest_pending_ids(db, applications)
     return templates.TemplateResponse("admin.html", {
         "request": request,
         "applications": applications,
         "latest_pending_ids": latest_pending_ids,
+        "job_statuses": await job_statuses(db, [a.id for a in applications]),
+        "filters": filters,
+        "next_url": str(request.url.include_query_params(cursor=next_cursor)) if next_cursor else None,
+        "first_page_url": str(request.url.remove_query_params("cursor")),
         "auto_approve": settings.auto_approve,
         "account_expiry_days": settings.account_expiry_days,
+        "archive_after_days": settings.archive_after_days,
         "homepage_message": settings.homepage_message
     })
 
-@app.post("/admin/approve/{application_id}", response_class=RedirectResponse)
-async def approve_application(application_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    application = db.query(Application).filter(Application.id == application_id).first()
+@app.get("/admin/api/applications", response_class=JSONResponse)
+async def admin_applications_api(filters: dict = Depends(application_filters), current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    applications, next_cursor = await list_applications(db, filters)
+    latest_pending_ids = await get_latest_pending_ids(db, applications)
+    statuses = await job_statuses(db, [a.id for a in applications])
+    return {
+        "items": [
+            {
+                "id": application.id,
+                "email": application.account.email,
+                "application_reason": application.application_reason,
+                "status": application.status,
+                "is_first_application": application.is_first_application,
+                "application_time": application.application_time.isoformat(),
+                "is_latest_pending": application.id in latest_pending_ids,
+                "job_status": statuses.get(application.id),
+            }
+            for application in applications
+        ],
+        "next_cursor": next_cursor,
+    }
+
+@app.get("/admin/api/search", response_class=JSONResponse)
+async def admin_search(q: str = "", page: int = 1, limit: int = ADMIN_PAGE_SIZE, current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # 在申请理由和邮箱中搜索，按相关度排序；email_html / snippet_html 已转义，命中部分用 <mark> 标出
+    page = max(1, page)
+    limit = max(1, min(limit, ADMIN_MAX_PAGE_SIZE))
+    total, items = await search_applications(db, q[:200], limit, (page - 1) * limit)
+    return {
+        "q": q,
+        "page": page,
+        "total": total,
+        "items": items,
+        "next_page": page + 1 if page * limit < total else None,
+    }
+
+async def get_application_for_decision(db: AsyncSession, application_id: int, action: str) -> Application:
+    application = (await db.execute(
+        select(Application)
+        .where(Application.id == application_id)
+        .options(selectinload(Application.account))
+    )).scalar_one_or_none()
     if not application:
         raise HTTPException(status_code=404, detail="申请未找到")
 
-    latest_application = db.query(Application).filter(Application.account_id == application.account_id).order_by(Application.application_time.desc()).first()
-    if latest_application.id != application.id or application.status != '等待管理员同意':
-        raise HTTPException(status_code=400, detail="只能批准最新的等待管理员同意的申请")
-
-    try:
-        account = db.query(Account).filter(Account.id == application.account_id).first()
-        password = create_server_account(account.email, application.public_key)
-        account.status = '活跃状态'
-        account.latest_approval_time = datetime.datetime.utcnow()
-        application.status = '同意'
-        db.commit()
-        send_account_details(account.email, password)
-        logging.info(f"批准账户：{account.email}")
-    except Exception as e:
-        logging.error(f"批准失败：{account.email}: {str(e)}")
-        raise HTTPException(status_code=500, detail="创建服务器账户失败")
+    if not await is_pending(db, application.id):
+        raise HTTPException(status_code=400, detail=f"只能{action}最新的等待管理员同意的申请")
+    return application
 
+@app.post("/admin/approve/{application_id}", response_class=RedirectResponse)
+async def approve_application(application_id: int, db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    application = await get_application_for_decision(db, application_id, "批准")
+    email = application.account.email
+    job = await enqueue_job(db, 'create', application.account, application)
+    events.application_changed(application.account_id, application.id, job_status=job.status, email=email)
+    logging.info(f"批准账户：{email}")
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/admin/reject/{application_id}", response_class=RedirectResponse)
-async def reject_application(application_id: int, db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    application = db.query(Application).filter(Application.id == application_id).first()
-    if not application:
-        raise HTTPException(status_code=404, detail="申请未找到")
-
-    latest_application = db.query(Application).filter(Application.account_id == application.account_id).order_by(Application.application_time.desc()).first()
-    if latest_application.id != application.id or application.status != '等待管理员同意':
-        raise HTTPException(status_code=400, detail="只能拒绝最新的等待管理员同意的申请")
-
+async def reject_application(application_id: int, db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    application = await get_application_for_decision(db, application_id, "拒绝")
+    if (await job_statuses(db, [application.id])).get(application.id) in ('queued', 'running'):
+        raise HTTPException(status_code=400, detail="账户创建中，无法拒绝")
     application.status = '拒绝'
-    db.commit()
-    send_rejection_email(application.account.email)
+    await clear_pending(db, application)
+    await db.commit()
+    events.application_changed(application.account_id, application.id, application_status='拒绝', email=application.account.email)
+    await send_rejection_email(application.account.email)
     logging.info(f"拒绝账户：{application.account.email}")
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
-@app.post("/admin/toggle-auto-approve", response_class=RedirectResponse)
-async def toggle_auto_approve(db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    settings = db.query(Settings).first()
-    if not settings:
-        settings = Settings(auto_approve=False)
-        db.add(settings)
-
-    settings.auto_approve = not settings.auto_approve
-    db.commit()
+class BulkDecision(BaseModel):
+    action: Literal['approve', 'reject']
+    application_ids: list[int] = []
+    # 为 true 时忽略 application_ids，处理所有符合筛选条件的待审批申请
+    all_pending: bool = False
+    first: bool | None = None
+    date_from: datetime.date | None = None
+    date_to: datetime.date | None = None
+
+async def resolve_bulk_ids(db: AsyncSession, decision: BulkDecision) -> list[int]:
+    if not decision.all_pending:
+        application_ids = list(dict.fromkeys(decision.application_ids))
+        if len(application_ids) > ADMIN_BULK_MAX:
+            raise HTTPException(status_code=400, detail=f"一次最多处理 {ADMIN_BULK_MAX} 个申请")
+        return application_ids
+    query = select(PendingApplication.application_id).join(Application, Application.id == PendingApplication.application_id)
+    if decision.first is not None:
+        query = query.where(Application.is_first_application == decision.first)
+    if decision.date_from:
+        query = query.where(PendingApplication.application_time >= datetime.datetime.combine(decision.date_from, datetime.time.min))
+    if decision.date_to:
+        query = query.where(PendingApplication.application_time < datetime.datetime.combine(decision.date_to + datetime.timedelta(days=1), datetime.time.min))
+    return (await db.execute(query.order_by(PendingApplication.application_time).limit(ADMIN_BULK_MAX))).scalars().all()
+
+@app.post("/admin/api/bulk", response_class=JSONResponse)
+async def bulk_decide(decision: BulkDecision, db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    application_ids = await resolve_bulk_ids(db, decision)
+    # 一次查询同时取出申请和它是否在待审批队列中
+    rows = (await db.execute(
+        select(Application, PendingApplication.application_id)
+        .outerjoin(PendingApplication, PendingApplication.application_id == Application.id)
+        .where(Application.id.in_(application_ids))
+        .options(selectinload(Application.account))
+    )).all() if application_ids else []
+    found = {application.id: (application, pending_id is not None) for application, pending_id in rows}
+    statuses = await job_statuses(db, list(found)) if decision.action == 'reject' else {}
+
+    results, valid = {}, []
+    for application_id in application_ids:
+        application, pending = found.get(application_id, (None, False))
+        if application is None:
+            results[application_id] = {"result": "error", "detail": "申请未找到"}
+        elif not pending:
+            results[application_id] = {"result": "error", "detail": "只能处理最新的等待管理员同意的申请"}
+        elif statuses.get(application_id) in ('queued', 'running'):
+            results[application_id] = {"result": "error", "detail": "账户创建中，无法拒绝"}
+        else:
+            valid.append(application)
+
+    for start in range(0, len(valid), ADMIN_BULK_BATCH_SIZE):
+        batch = valid[start:start + ADMIN_BULK_BATCH_SIZE]
+        if decision.action == 'approve':
+            statuses = await enqueue_jobs(db, 'create', [(application.account, application) for application in batch])
+            for application in batch:
+                # 已在队列中或正在创建的申请不会重复提交
+                job_status = statuses[job_key('create', application.account, application)]
+                results[application.id] = {"result": job_status}
+                events.application_changed(application.account_id, application.id, job_status=job_status, email=application.account.email)
+        else:
+            for application in batch:
+                application.status = '拒绝'
+            await clear_pending_ids(db, [application.id for application in batch])
+            await db.commit()
+            for application in batch:
+                events.application_changed(application.account_id, application.id, application_status='拒绝', email=application.account.email)
+                await send_rejection_email(application.account.email)
+                results[application.id] = {"result": "rejected"}
+    if decision.action == 'approve' and valid:
+        notify_workers()
+    logging.info(f"批量{'批准' if decision.action == 'approve' else '拒绝'} {len(valid)} 个申请")
+
+    summary = {}
+    for result in results.values():
+        summary[result["result"]] = summary.get(result["result"], 0) + 1
+    return {
+        "action": decision.action,
+        "summary": summary,
+        "results": [
+            {"id": application_id, "email": found[application_id][0].account.email if application_id in found else None, **results[application_id]}
+            for application_id in application_ids
+        ],
+    }
 
+@app.post("/admin/toggle-auto-approve", response_class=RedirectResponse)
+async def toggle_auto_approve(db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    settings = await update_settings(db, auto_approve=not (await get_settings()).auto_approve)
     if settings.auto_approve:
-        latest_pendings = get_latest_pendings(db)
-        for application in latest_pendings:
-            try:
-                account = db.query(Account).filter(Account.id == application.account_id).first()
-                password = create_server_account(account.email, application.public_key)
-                account.status = '活跃状态'
-                account.latest_approval_time = datetime.datetime.utcnow()
-                application.status = '同意'
-                send_account_details(account.email, password)
-                logging.info(f"自动批准待处理的账户：{account.email}")
-            except Exception as e:
-                logging.error(f"自动批准失败：{account.email}: {str(e)}")
-                continue
-        db.commit()
+        latest_pendings = await get_latest_pendings(db)
+        # 与批量审批一样按 ADMIN_BULK_BATCH_SIZE 分批提交，避免超出 SQLite 的绑定参数上限；全部提交后再唤醒 worker，使这些任务合并为批量创建
+        for start in range(0, len(latest_pendings), ADMIN_BULK_BATCH_SIZE):
+            batch = latest_pendings[start:start + ADMIN_BULK_BATCH_SIZE]
+            statuses = await enqueue_jobs(db, 'create', [(application.account, application) for application in batch])
+            for application in batch:
+                job_status = statuses[job_key('create', application.account, application)]
+                events.application_changed(application.account_id, application.id, job_status=job_status, email=application.account.email)
+                logging.info(f"自动批准待处理的账户：{application.account.email}")
+        notify_workers()
 
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/admin/set-expiry-days", response_class=RedirectResponse)
-async def set_expiry_days(expiry_days: int = Form(...), db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    settings = db.query(Settings).first()
-    if not settings:
-        settings = Settings(account_expiry_days=365)
-        db.add(settings)
-
-    settings.account_expiry_days = expiry_days
-    db.commit()
+async def set_expiry_days(expiry_days: int = Form(...), db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    await update_settings(db, account_expiry_days=expiry_days)
+    reschedule()
     logging.info(f"设置账户有效期为 {expiry_days} 天")
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
+@app.post("/admin/set-archive-days", response_class=RedirectResponse)
+async def set_archive_days(archive_days: int = Form(...), db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    await update_settings(db, archive_after_days=max(0, archive_days))
+    wake_archiver()
+    logging.info(f"设置申请归档期限为 {max(0, archive_days)} 天")
+    return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
+
 @app.post("/admin/set-homepage-message", response_class=RedirectResponse)
-async def set_homepage_message(message: str = Form(...), db: Session = Depends(get_db), current_user: dict = Depends(get_current_user)):
-    settings = db.query(Settings).first()
-    if not settings:
-        settings = Settings(homepage_message="欢迎使用服务器账户申请系统。")
-        db.add(settings)
-
-    settings.homepage_message = message
-    db.commit()
+async def set_homepage_message(message: str = Form(...), db: AsyncSession = Depends(get_db), current_user: dict = Depends(get_current_user)):
+    await update_settings(db, homepage_message=message)
     logging.info("已更新首页消息")
     return RedirectResponse(url="/admin", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -290,54 +489,183 @@ async def user_login_page(request: Request):
     return templates.TemplateResponse("user_login.html", {"request": request})
 
 @app.post("/user/login", response_class=RedirectResponse)
-async def user_login(email: EmailStr = Form(...), db: Session = Depends(get_db)):
-    if authenticate_user(email, db):
+async def user_login(email: EmailStr = Form(...), db: AsyncSession = Depends(get_db)):
+    if await authenticate_user(email, db):
         response = RedirectResponse(url="/user", status_code=status.HTTP_303_SEE_OTHER)
         response.set_cookie(key="user_email", value=email, httponly=True)
         return response
     raise HTTPException(status_code=401, detail="邮箱未找到")
 
 @app.get("/user", response_class=HTMLResponse)
-async def user_dashboard(request: Request, db: Session = Depends(get_db)):
+async def user_dashboard(request: Request, db: AsyncSession = Depends(get_db)):
     email = request.cookies.get("user_email")
     if not email:
         return RedirectResponse(url="/user/login", status_code=status.HTTP_303_SEE_OTHER)
     
-    account = db.query(Account).filter(Account.email == email).first()
+    account = (await db.execute(select(Account).where(Account.email == email))).scalar_one_or_none()
     if not account:
         return RedirectResponse(url="/user/login", status_code=status.HTTP_303_SEE_OTHER)
     
-    latest_application = db.query(Application).filter(Application.account_id == account.id).order_by(Application.application_time.desc()).first()
+    latest_application = await db.get(Application, account.latest_application_id) if account.latest_application_id else None
     return templates.TemplateResponse("user_dashboard.html", {
         "request": request,
         "email": email,
         "account": account,
         "latest_application": latest_application
     })
-    
-async def check_expired_accounts():
-    while True:
-        db = SessionLocal()
-        try:
-            now = datetime.datetime.utcnow()
-            settings = db.query(Settings).first()
-            expiry_days = settings.account_expiry_days
-            expiry_threshold = now - datetime.timedelta(days=expiry_days)
-            expired = db.query(Account).filter(
-                Account.status == '活跃状态',
-                Account.latest_approval_time < expiry_threshold
-            ).all()
-            for account in expired:
-                try:
-                    ban_server_account(account.email)
-                    account.status = '不活跃状态'
-                    logging.info(f"已禁用过期账户：{account.email}")
-                except Exception as e:
-                    logging.error(f"禁用过期账户 {account.email} 失败: {str(e)}")
-            db.commit()
-        finally:
-            db.close()
-        await asyncio.sleep(86400)
+
+def event_stream(request: Request, topic: str, snapshot) -> StreamingResponse:
+    if not events.accepting_clients():
+        raise HTTPException(status_code=503, detail="实时连接数已满，请稍后刷新页面")
+    return StreamingResponse(
+        events.stream(request, topic, snapshot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/user/events")
+async def user_events(request: Request):
+    email = request.cookies.get("user_email")
+    async with AsyncSessionLocal() as db:
+        account = (await db.execute(select(Account).where(Account.email == email))).scalar_one_or_none() if email else None
+    if not account:
+        raise HTTPException(status_code=401, detail="未登录")
+    account_id = account.id
+
+    async def snapshot():
+        async with AsyncSessionLocal() as db:
+            account = await db.get(Account, account_id)
+            application = await db.get(Application, account.latest_application_id) if account.latest_application_id else None
+            statuses = await job_statuses(db, [application.id]) if application else {}
+        return [("application", {
+            "application_id": application.id if application else None,
+            "application_status": application.status if application else None,
+            "account_status": account.status,
+            "job_status": statuses.get(application.id) if application else None,
+        })]
+
+    return event_stream(request, events.user_topic(account_id), snapshot)
+
+@app.get("/admin/events")
+async def admin_events(request: Request, current_user: dict = Depends(get_current_user)):
+    async def snapshot():
+        async with AsyncSessionLocal() as db:
+            pending = (await db.execute(select(func.count()).select_from(PendingApplication))).scalar()
+        return [("queue", {"pending": pending})]
+
+    return event_stream(request, events.ADMIN_TOPIC, snapshot)
+
+@app.get("/admin/api/expiry-preview", response_class=JSONResponse)
+async def admin_expiry_preview(days: int = 7, limit: int = ADMIN_PAGE_SIZE, current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # 只读预览：未来 days 天内将被禁用的账户
+    total, items = await preview_expiring(db, max(0, days), max(1, min(limit, ADMIN_MAX_PAGE_SIZE)))
+    return {"days": days, "total": total, "items": items}
+
+@app.get("/admin/api/accounts/{account_id}/hosts", response_class=JSONResponse)
+async def admin_account_hosts(account_id: int, current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # 账户在每台服务器上最近一次任务的结果
+    account = await db.get(Account, account_id)
+    if account is None:
+        raise HTTPException(status_code=404, detail="账户不存在")
+    return {"account_id": account.id, "email": account.email, "status": account.status, "hosts": await host_statuses(db, account.id)}
+
+@app.get("/admin/api/archive", response_class=JSONResponse)
+async def admin_archive_api(email: str | None = None, before_id: int | None = None, limit: int = ADMIN_PAGE_SIZE, current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # 只读：查询已归档的申请，可按邮箱筛选，用 next_before_id 翻页
+    account_id = None
+    if email:
+        account_id = (await db.execute(select(Account.id).where(Account.email == email))).scalar_one_or_none()
+        if account_id is None:
+            raise HTTPException(status_code=404, detail="账户不存在")
+    limit = max(1, min(limit, ADMIN_MAX_PAGE_SIZE))
+    items = await list_archived(db, account_id, before_id, limit)
+    return {"items": items, "next_before_id": items[-1]["id"] if len(items) == limit else None}
+
+@app.get("/admin/api/reconcile", response_class=JSONResponse)
+async def admin_reconcile_report(current_user: dict = Depends(get_current_user)):
+    # 只检查账户表与各服务器上的系统账户是否一致，不做修改
+    return await reconcile(fix=False)
+
+@app.post("/admin/api/reconcile", response_class=JSONResponse)
+async def admin_reconcile_fix(current_user: dict = Depends(get_current_user)):
+    return await reconcile(fix=True)
+
+@app.post("/admin/api/whitelist/import", response_class=JSONResponse)
+async def admin_whitelist_import(request: Request, kind: Literal['allow', 'block', 'remove'] = 'allow', current_user: dict = Depends(get_current_user)):
+    # 请求体为 CSV 文件本身（不是表单），边接收边写入
+    summary = await import_csv(request.stream(), kind)
+    logging.info(f"导入邮箱名单：{summary['imported']} 条写入，{summary['removed']} 条删除，{summary['invalid']} 条无效")
+    return summary
+
+@app.get("/admin/api/whitelist/export")
+async def admin_whitelist_export(current_user: dict = Depends(get_current_user)):
+    return StreamingResponse(
+        export_csv(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": "attachment; filename=whitelist.csv"},
+    )
+
+@app.get("/admin/api/mail", response_class=JSONResponse)
+async def admin_mail_api(status: str | None = None, before_id: int | None = None, limit: int = ADMIN_PAGE_SIZE, current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    query = select(MailOutbox)
+    if status:
+        query = query.where(MailOutbox.status == status)
+    if before_id:
+        query = query.where(MailOutbox.id < before_id)
+    mails = (await db.execute(
+        query.order_by(MailOutbox.id.desc()).limit(max(1, min(limit, ADMIN_MAX_PAGE_SIZE)))
+    )).scalars().all()
+    return {
+        "items": [
+            {
+                "id": mail.id,
+                "recipient": mail.recipient,
+                "subject": mail.subject,
+                "status": mail.status,
+                "attempts": mail.attempts,
+                "last_error": mail.last_error,
+                "created_at": mail.created_at.isoformat(),
+                "sent_at": mail.sent_at.isoformat() if mail.sent_at else None,
+            }
+            for mail in mails
+        ]
+    }
+
+@app.get("/admin/metrics", response_class=PlainTextResponse)
+async def admin_metrics(current_user: dict = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # 队列深度在抓取时查询，其余指标为本进程自启动以来的累计值
+    job_counts = dict((await db.execute(select(ProvisionJob.status, func.count()).group_by(ProvisionJob.status))).all())
+    mail_counts = dict((await db.execute(select(MailOutbox.status, func.count()).group_by(MailOutbox.status))).all())
+    pending = (await db.execute(select(func.count()).select_from(PendingApplication))).scalar()
+    gauges = (
+        metrics.render_gauges("panel_provision_jobs", "账户任务数", "status", job_counts)
+        + metrics.render_gauges("panel_mail_outbox", "发件箱邮件数", "status", mail_counts)
+        + metrics.render_gauges("panel_pending_applications", "等待管理员处理的申请数", "queue", {"pending": pending})
+    )
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+async def get_own_job(job_id: int, request: Request, db: AsyncSession) -> ProvisionJob:
+    # 任务 id 是连续的，只允许账户本人（user_email Cookie）查看；不属于本人的任务与不存在的任务一样返回 404
+    job = await db.get(ProvisionJob, job_id, options=[selectinload(ProvisionJob.account)])
+    email = request.cookies.get("user_email")
+    if not job or not email or job.account is None or job.account.email != email:
+        raise HTTPException(status_code=404, detail="任务未找到")
+    return job
+
+@app.get("/jobs/{job_id}", response_class=JSONResponse)
+async def job_status(job_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    job = await get_own_job(job_id, request, db)
+    return {"id": job.id, "status": job.status, "attempts": job.attempts}
+
+@app.get("/progress/{job_id}", response_class=HTMLResponse)
+async def job_progress(job_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    job = await get_own_job(job_id, request, db)
+    return templates.TemplateResponse("progress.html", {
+        "request": request,
+        "job": job,
+        "email": job.account.email,
+        "days_waited": (datetime.datetime.utcnow() - job.created_at).days
+    })
 
 def main():
     import uvicorn
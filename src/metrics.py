@@ -0,0 +1,195 @@
+# 进程内指标：路由、SQL、账户命令和邮件发送的耗时直方图与计数器，以 Prometheus 文本格式导出
+# 设置 SLOW_REQUEST_MS 后，超过该耗时的请求会在日志中记录 SQL / 模板渲染等各部分的耗时
+import os
+import re
+import time
+import logging
+import threading
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(items):
+            labels = format_labels(self.labels, key)
+            for bound, value in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), key + (str(bound),))} {value}')
+            lines.append(f'{self.name}_bucket{format_labels(self.labels + ("le",), key + ("+Inf",))} {count}')
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in items)
+        return lines
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)) + "}"
+
+def render_gauges(name: str, help: str, label: str, values: dict[str, float]) -> list[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    lines.extend(f"{name}{format_labels((label,), (key,))} {value}" for key, value in sorted(values.items()))
+    return lines
+
+http_request_seconds = Histogram("panel_http_request_seconds", "HTTP 请求耗时", ("method", "route", "status"))
+db_statement_seconds = Histogram("panel_db_statement_seconds", "SQL 语句耗时", ("statement",))
+command_seconds = Histogram("panel_command_seconds", "账户管理命令耗时", ("command", "result"))
+mail_seconds = Histogram("panel_mail_seconds", "SMTP 连接与发送耗时", ("operation", "result"))
+template_seconds = Histogram("panel_template_render_seconds", "模板渲染耗时", ("template",))
+job_results = Counter("panel_provision_jobs_total", "账户任务执行结果", ("kind", "result"))
+rate_limited = Counter("panel_rate_limited_total", "被限流拒绝的请求数", ("scope",))
+coalesced_applications = Counter("panel_coalesced_applications_total", "合并到已有未验证申请的重复提交数", ())
+
+ALL_METRICS = [http_request_seconds, db_statement_seconds, command_seconds, mail_seconds, template_seconds, job_results, rate_limited, coalesced_applications]
+
+# 当前请求各部分耗时，只在请求处理期间存在
+_breakdown: ContextVar[dict | None] = ContextVar("metrics_breakdown", default=None)
+
+def record(category: str, seconds: float):
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown[category] = breakdown.get(category, 0.0) + seconds
+        breakdown[f"{category}_count"] = breakdown.get(f"{category}_count", 0) + 1
+
+class timed:
+    # with timed(histogram, category, *labels): ...，异常时 result 标签为 error
+    def __init__(self, histogram: Histogram, category: str, *labels: str):
+        self.histogram = histogram
+        self.category = category
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed, *self.labels, "error" if exc_type else "ok")
+        record(self.category, elapsed)
+
+STATEMENT_TABLE = {
+    "SELECT": re.compile(r'\bFROM\s+"?(\w+)', re.IGNORECASE),
+    "DELETE": re.compile(r'\bFROM\s+"?(\w+)', re.IGNORECASE),
+    "INSERT": re.compile(r'\bINTO\s+"?(\w+)', re.IGNORECASE),
+    "UPDATE": re.compile(r'^\s*UPDATE\s+"?(\w+)', re.IGNORECASE),
+}
+
+def statement_class(statement: str) -> str:
+    # 按语句类型和主表归类，例如 "SELECT applications"
+    words = statement.split(None, 1)
+    if not words:
+        return "UNKNOWN"
+    verb = words[0].upper()
+    match = STATEMENT_TABLE[verb].search(statement) if verb in STATEMENT_TABLE else None
+    return f"{verb} {match.group(1)}" if match else verb
+
+def instrument_engine(engine: Engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        db_statement_seconds.observe(elapsed, statement_class(statement))
+        record("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+def instrument_templates(templates):
+    template_response = templates.TemplateResponse
+
+    def timed_template_response(name, context, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return template_response(name, context, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            template_seconds.observe(elapsed, name)
+            record("render", elapsed)
+
+    templates.TemplateResponse = timed_template_response
+
+async def metrics_middleware(request, call_next):
+    breakdown = {}
+    token = _breakdown.set(breakdown)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        _breakdown.reset(token)
+        route = request.scope.get("route")
+        # 未匹配到路由（404）时统一归为一类，避免标签数量无限增长
+        path = route.path if route is not None else "unmatched"
+        http_request_seconds.observe(elapsed, request.method, path, str(status_code))
+        if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+            accounted = sum(v for k, v in breakdown.items() if not k.endswith("_count"))
+            details = ", ".join(
+                f"{k}={v * 1000:.1f}ms" if not k.endswith("_count") else f"{k}={v}"
+                for k, v in sorted(breakdown.items())
+            )
+            logging.warning(
+                f"慢请求 {request.method} {path} {status_code} 耗时 {elapsed * 1000:.1f}ms"
+                f"（{details or '无明细'}，其他 {(elapsed - accounted) * 1000:.1f}ms）"
+            )
+
+def render(gauges: list[str] | None = None) -> str:
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    lines.extend(gauges or [])
+    return "\n".join(lines) + "\n"
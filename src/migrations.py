@@ -0,0 +1,176 @@
+# 数据库版本迁移，版本号保存在 SQLite 的 PRAGMA user_version 中
+# 启动时由 init_db 调用；也可以手动执行：
+#   python -m src.migrations                # 升级到最新版本
+#   python -m src.migrations --check-plans  # 检查热点查询是否命中索引
+import sys
+import logging
+from sqlalchemy import text, select, func, tuple_
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Connection, Engine
+
+def get_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def column_exists(conn: Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.exec_driver_sql(f"PRAGMA table_info({table})"))
+
+def add_column(conn: Connection, table: str, ddl: str):
+    # 新数据库由 create_all 建表时已经包含该列
+    if not column_exists(conn, table, ddl.split()[0]):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+
+def m001_application_keyset_index(conn: Connection):
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_applications_time_id ON applications (application_time, id)"
+    )
+
+def m002_verification_code_index(conn: Connection):
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_applications_verification_code "
+        "ON applications (verification_code) WHERE verification_code IS NOT NULL"
+    )
+
+def m003_account_history_index(conn: Connection):
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_applications_account_time "
+        "ON applications (account_id, application_time)"
+    )
+
+def m004_latest_application_pointer(conn: Connection):
+    from src.database import Base
+    from src.pending import backfill
+    add_column(conn, "accounts", "latest_application_id INTEGER")
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_accounts_latest_application_id ON accounts (latest_application_id)"
+    )
+    Base.metadata.tables["pending_applications"].create(conn, checkfirst=True)
+    backfill(conn)
+
+def m005_account_expiry_index(conn: Connection):
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_accounts_status_approval_time "
+        "ON accounts (status, latest_approval_time)"
+    )
+
+def m006_host_accounts(conn: Connection):
+    from src.database import Base
+    add_column(conn, "provision_jobs", "password_hash VARCHAR")
+    Base.metadata.tables["host_accounts"].create(conn, checkfirst=True)
+
+def m007_whitelist_kind(conn: Connection):
+    add_column(conn, "whitelist", "kind VARCHAR DEFAULT 'allow'")
+
+def m008_application_search(conn: Connection):
+    from src.search import rebuild_search_index
+    rebuild_search_index(conn)
+
+def m009_application_archive(conn: Connection):
+    from src.database import Base
+    add_column(conn, "settings", "archive_after_days INTEGER DEFAULT 0")
+    Base.metadata.tables["application_archive"].create(conn, checkfirst=True)
+
+def m010_clear_mail_bodies(conn: Connection):
+    # 已结束的邮件不再需要正文（可能包含密码和验证码）
+    conn.exec_driver_sql("UPDATE mail_outbox SET body = NULL WHERE status IN ('sent', 'skipped', 'failed')")
+
+# (版本号, 说明, 迁移函数)，只能追加，不能修改已发布的迁移
+MIGRATIONS = [
+    (1, "申请列表键集分页索引", m001_application_keyset_index),
+    (2, "验证码部分唯一索引", m002_verification_code_index),
+    (3, "账户申请历史复合索引", m003_account_history_index),
+    (4, "账户最新申请指针与待审批队列", m004_latest_application_pointer),
+    (5, "账户过期调度索引", m005_account_expiry_index),
+    (6, "多服务器账户状态", m006_host_accounts),
+    (7, "邮箱黑名单", m007_whitelist_kind),
+    (8, "申请全文搜索索引", m008_application_search),
+    (9, "申请归档", m009_application_archive),
+    (10, "清除已发送邮件正文", m010_clear_mail_bodies),
+]
+
+def run_migrations(engine: Engine) -> int:
+    # pysqlite 只在 INSERT / UPDATE 等语句前隐式开启事务，CREATE INDEX、ALTER TABLE 会立即自动提交，
+    # 因此显式 BEGIN IMMEDIATE：每个迁移和它的 user_version 在同一个事务中提交，中途失败时整体回滚，不会留下一半的结构
+    # 版本号在事务内读取，多个进程同时启动时只有一个执行迁移；迁移本身也可以重复执行（IF NOT EXISTS、add_column 等）
+    with engine.connect() as conn:
+        while True:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                current = get_version(conn)
+                pending = [migration for migration in MIGRATIONS if migration[0] > current]
+                if not pending:
+                    conn.rollback()
+                    return current
+                version, description, migrate = pending[0]
+                logging.info(f"执行数据库迁移 {version}：{description}")
+                migrate(conn)
+                conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+def hot_queries() -> dict[str, tuple]:
+    # (语句, 期望使用的索引)
+    from src.models import Account, Application, ApplicationArchive, PendingApplication
+    return {
+        "verify_email": (
+            select(Application).where(Application.verification_code == "code"),
+            "ix_applications_verification_code",
+        ),
+        "latest_application": (
+            select(Application.id)
+            .where(Application.account_id == 1)
+            .order_by(Application.application_time.desc())
+            .limit(1),
+            "ix_applications_account_time",
+        ),
+        "admin_keyset_page": (
+            select(Application)
+            .where(tuple_(Application.application_time, Application.id) < tuple_(text("'2024-01-01'"), 1))
+            .order_by(Application.application_time.desc(), Application.id.desc())
+            .limit(50),
+            "ix_applications_time_id",
+        ),
+        "pending_queue": (
+            select(PendingApplication.application_id).order_by(PendingApplication.application_time),
+            "ix_pending_applications_application_time",
+        ),
+        "next_expiry": (
+            select(func.min(Account.latest_approval_time))
+            .where(Account.status == '活跃状态', Account.latest_approval_time >= text("'2024-01-01'")),
+            "ix_accounts_status_approval_time",
+        ),
+        "account_archive": (
+            select(ApplicationArchive)
+            .where(ApplicationArchive.account_id == 1)
+            .order_by(ApplicationArchive.id.desc())
+            .limit(50),
+            "ix_application_archive_account_time",
+        ),
+    }
+
+def check_query_plans(engine: Engine) -> list[str]:
+    failures = []
+    with engine.connect() as conn:
+        for name, (statement, index) in hot_queries().items():
+            sql = str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+            plan = " | ".join(row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}"))
+            if index not in plan:
+                failures.append(f"{name}: 未使用 {index}（{plan}）")
+    return failures
+
+def main():
+    from src.database import engine, init_db
+    init_db()
+    with engine.connect() as conn:
+        print(f"数据库版本：{get_version(conn)}")
+    if "--check-plans" in sys.argv:
+        failures = check_query_plans(engine)
+        for failure in failures:
+            print(failure)
+        if failures:
+            sys.exit(1)
+        print("热点查询均命中索引")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, Text, LargeBinary, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from src.database import Base
 import datetime
@@ -14,8 +14,15 @@ class Account(Base):
     status = Column(String, default='未创建')  # 未创建, 活跃状态, 不活跃状态
     latest_approval_time = Column(DateTime, nullable=True)
     server_password = Column(String, nullable=True)
+    # 最新一次申请，由写入路径在同一事务中维护（不建外键，避免两张表互相引用）
+    latest_application_id = Column(Integer, nullable=True, index=True)
     applications = relationship("Application", back_populates="account")
 
+    __table_args__ = (
+        # 过期调度按状态和批准时间查找最早到期的活跃账户
+        Index("ix_accounts_status_approval_time", "status", "latest_approval_time"),
+    )
+
 class Application(Base):
     __tablename__ = "applications"
     id = Column(Integer, primary_key=True, index=True)
@@ -28,14 +35,101 @@ class Application(Base):
     application_time = Column(DateTime, default=datetime.datetime.utcnow)
     account = relationship("Account", back_populates="applications")
 
+    __table_args__ = (
+        # 管理面板按 (application_time, id) 做键集分页
+        Index("ix_applications_time_id", "application_time", "id"),
+        # 验证链接按验证码查找，已验证的申请验证码为空
+        Index("ix_applications_verification_code", "verification_code", unique=True,
+              sqlite_where=text("verification_code IS NOT NULL")),
+        # 查找账户的最新申请
+        Index("ix_applications_account_time", "account_id", "application_time"),
+    )
+
+class PendingApplication(Base):
+    # 等待管理员处理的队列：每个账户最多一条，且必须是该账户的最新申请
+    __tablename__ = "pending_applications"
+    application_id = Column(Integer, ForeignKey("applications.id"), primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), unique=True)
+    application_time = Column(DateTime, index=True)
+    application = relationship("Application")
+
+class ApplicationArchive(Base):
+    # 归档的历史申请，见 src/archive.py；id 沿用原申请 id，公钥和申请理由压缩保存在 payload 中
+    __tablename__ = "application_archive"
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer)
+    status = Column(String)
+    is_first_application = Column(Boolean)
+    application_time = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+    payload = Column(LargeBinary)  # zlib 压缩的 JSON：{"public_key": ..., "application_reason": ...}
+
+    __table_args__ = (
+        # 按账户查询归档历史
+        Index("ix_application_archive_account_time", "account_id", "application_time"),
+    )
+
 class Whitelist(Base):
+    # 申请邮箱白名单 / 黑名单，见 src/policy.py
     __tablename__ = "whitelist"
     id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True)
+    email = Column(String, unique=True, index=True)  # 邮箱，或域名规则 pku.edu.cn / @pku.edu.cn
+    kind = Column(String, default='allow')  # allow, block
 
 class Settings(Base):
     __tablename__ = "settings"
     id = Column(Integer, primary_key=True, index=True)
     auto_approve = Column(Boolean, default=False)
     account_expiry_days = Column(Integer, default=365)
-    homepage_message = Column(Text, default=os.getenv("HOMEPAGE_MESSAGE", "欢迎使用本系统！"))
\ No newline at end of file
+    # 早于该天数的已处理申请移入 application_archive，0 表示不归档
+    archive_after_days = Column(Integer, default=0)
+    homepage_message = Column(Text, default=os.getenv("HOMEPAGE_MESSAGE", "欢迎使用本系统！"))
+
+class ProvisionJob(Base):
+    __tablename__ = "provision_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String, unique=True, index=True)  # create:<application_id>, ban:<account_id>:<批准时间>
+    kind = Column(String)  # create, ban
+    account_id = Column(Integer, ForeignKey("accounts.id"))
+    application_id = Column(Integer, ForeignKey("applications.id"), nullable=True)
+    status = Column(String, default='queued', index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # 创建任务首次在某台服务器上新建账户时保存的密码哈希，重试其他服务器时使用同一个密码
+    password_hash = Column(String, nullable=True)
+    account = relationship("Account")
+    application = relationship("Application")
+
+class HostAccount(Base):
+    # 账户在每台服务器上最近一次任务的执行结果
+    __tablename__ = "host_accounts"
+    account_id = Column(Integer, ForeignKey("accounts.id"), primary_key=True)
+    host = Column(String, primary_key=True)  # PROVISION_HOSTS 中的地址，本机为 local
+    kind = Column(String)  # create, ban
+    status = Column(String)  # done, failed
+    last_error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class MailOutbox(Base):
+    __tablename__ = "mail_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String)
+    subject = Column(String)
+    body = Column(Text)
+    status = Column(String, default='queued', index=True)  # queued, sending, sent, failed, skipped
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+class RateLimitBucket(Base):
+    # 令牌桶状态，多个 uvicorn 进程通过该表共享限流计数
+    __tablename__ = "rate_limit_buckets"
+    key = Column(String, primary_key=True)  # <范围>:<邮箱或 IP>
+    tokens = Column(Float)
+    updated_at = Column(Float)  # time.time()
@@ -0,0 +1,115 @@
+# 维护 Account.latest_application_id 和待审批队列 pending_applications
+# 写入路径调用下面的异步函数，与业务修改在同一事务中提交
+#   python -m src.pending --check          # 检查与申请历史是否一致
+#   python -m src.pending --check --fix    # 不一致时重新回填
+import sys
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from src.models import Account, Application, PendingApplication
+
+async def record_application(db: AsyncSession, account: Account, application: Application):
+    # 新申请成为账户的最新申请，之前的待审批申请随之失效
+    await db.flush()
+    account.latest_application_id = application.id
+    await db.execute(delete(PendingApplication).where(PendingApplication.account_id == account.id))
+
+async def mark_pending(db: AsyncSession, account: Account, application: Application):
+    # 只有最新申请才能进入待审批队列
+    if account.latest_application_id != application.id:
+        return
+    await db.execute(
+        sqlite_insert(PendingApplication)
+        .values(application_id=application.id, account_id=account.id, application_time=application.application_time)
+        .on_conflict_do_nothing()
+    )
+
+async def clear_pending(db: AsyncSession, application: Application):
+    await clear_pending_ids(db, [application.id])
+
+async def clear_pending_ids(db: AsyncSession, application_ids: list[int]):
+    await db.execute(delete(PendingApplication).where(PendingApplication.application_id.in_(application_ids)))
+
+async def is_pending(db: AsyncSession, application_id: int) -> bool:
+    return await db.get(PendingApplication, application_id) is not None
+
+async def pending_ids(db: AsyncSession, application_ids) -> set[int]:
+    if not application_ids:
+        return set()
+    return set((await db.execute(
+        select(PendingApplication.application_id)
+        .where(PendingApplication.application_id.in_(application_ids))
+    )).scalars().all())
+
+async def list_pending(db: AsyncSession) -> list[Application]:
+    return (await db.execute(
+        select(Application)
+        .join(PendingApplication, PendingApplication.application_id == Application.id)
+        .order_by(PendingApplication.application_time)
+        .options(selectinload(Application.account))
+    )).scalars().all()
+
+# 以下基于完整的申请历史重新计算，只用于迁移回填和一致性检查
+
+LATEST_APPLICATIONS_SQL = """
+    SELECT account_id, id, status, application_time FROM (
+        SELECT account_id, id, status, application_time,
+               ROW_NUMBER() OVER (PARTITION BY account_id ORDER BY application_time DESC, id DESC) AS rn
+        FROM applications
+    ) WHERE rn = 1
+"""
+
+def expected_state(conn: Connection) -> tuple[dict[int, int], dict[int, tuple]]:
+    latest, pending = {}, {}
+    for account_id, application_id, status, application_time in conn.exec_driver_sql(LATEST_APPLICATIONS_SQL):
+        latest[account_id] = application_id
+        if status == '等待管理员同意':
+            pending[application_id] = (account_id, application_time)
+    return latest, pending
+
+def backfill(conn: Connection):
+    conn.exec_driver_sql(f"""
+        UPDATE accounts SET latest_application_id = (
+            SELECT latest.id FROM ({LATEST_APPLICATIONS_SQL}) AS latest
+            WHERE latest.account_id = accounts.id
+        )
+    """)
+    conn.exec_driver_sql("DELETE FROM pending_applications")
+    conn.exec_driver_sql(f"""
+        INSERT INTO pending_applications (application_id, account_id, application_time)
+        SELECT id, account_id, application_time FROM ({LATEST_APPLICATIONS_SQL})
+        WHERE status = '等待管理员同意'
+    """)
+
+def check_consistency(conn: Connection) -> list[str]:
+    latest, pending = expected_state(conn)
+    problems = []
+    for account_id, latest_application_id in conn.exec_driver_sql("SELECT id, latest_application_id FROM accounts"):
+        if latest.get(account_id) != latest_application_id:
+            problems.append(f"账户 {account_id} 的最新申请应为 {latest.get(account_id)}，实际为 {latest_application_id}")
+    actual = {row[0] for row in conn.exec_driver_sql("SELECT application_id FROM pending_applications")}
+    for application_id in sorted(set(pending) - actual):
+        problems.append(f"申请 {application_id} 应在待审批队列中")
+    for application_id in sorted(actual - set(pending)):
+        problems.append(f"申请 {application_id} 不应在待审批队列中")
+    return problems
+
+def main():
+    from src.database import engine, init_db
+    init_db()
+    with engine.begin() as conn:
+        problems = check_consistency(conn)
+        for problem in problems:
+            print(problem)
+        if problems and "--fix" in sys.argv:
+            backfill(conn)
+            print("已重新回填")
+        elif problems:
+            sys.exit(1)
+        else:
+            print("待审批队列与申请历史一致")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# 申请邮箱策略：ALLOWED_EMAIL_DOMAINS / BLOCKED_EMAIL_DOMAINS 与 whitelist 表编译为一个快照，只在变化时重新编译
+# 域名规则 pku.edu.cn 匹配该域名及其子域名，@pku.edu.cn 只匹配该域名本身
+# whitelist 表中每行为一个邮箱或域名规则，kind 为 allow（白名单）或 block（黑名单）
+# 判断顺序：黑名单邮箱 → 白名单邮箱 → 黑名单域名 → 白名单域名（未配置任何白名单域名时不限制）
+# 表变更后替换 POLICY_STAMP_PATH，其他 uvicorn 进程通过 stat 发现变化后重新加载
+import io
+import os
+import re
+import csv
+import codecs
+import asyncio
+from dataclasses import dataclass
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.database import AsyncSessionLocal, DATABASE_PATH
+from src.models import Whitelist
+from src.settings_cache import read_stamp, bump_stamp
+
+POLICY_STAMP_PATH = os.getenv("POLICY_STAMP_PATH", DATABASE_PATH + ".policy-version")
+# CSV 导入导出时每个事务 / 每次查询处理的行数
+POLICY_IMPORT_BATCH_SIZE = int(os.getenv("POLICY_IMPORT_BATCH_SIZE", 1000))
+# 导入结果中最多列出的错误行
+POLICY_IMPORT_MAX_ERRORS = 20
+KINDS = ('allow', 'block', 'remove')
+
+EMAIL_PATTERN = re.compile(r"^[^@\s,]+@[a-z0-9-]+(\.[a-z0-9-]+)+$")
+DOMAIN_PATTERN = re.compile(r"^@?[a-z0-9-]+(\.[a-z0-9-]+)+$")
+
+# 标签不会是 * 或空串，用作节点上的标记
+SUBTREE = "*"
+EXACT = ""
+
+class DomainTrie:
+    # 按标签倒序存储：pku.edu.cn → cn / edu / pku，查找时间只与域名的标签数有关
+    def __init__(self):
+        self._root: dict = {}
+        self.size = 0
+
+    def add(self, rule: str):
+        exact = rule.startswith("@")
+        node = self._root
+        for label in reversed(rule.lstrip("@").strip(".").split(".")):
+            node = node.setdefault(label, {})
+        node[EXACT if exact else SUBTREE] = True
+        self.size += 1
+
+    def match(self, domain: str) -> bool:
+        node = self._root
+        for label in reversed(domain.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            if SUBTREE in node:
+                return True
+        return EXACT in node
+
+def normalize(value: str) -> str:
+    return value.strip().lower()
+
+def is_domain_rule(value: str) -> bool:
+    return "@" not in value.lstrip("@")
+
+def valid_entry(value: str) -> bool:
+    return bool(DOMAIN_PATTERN.match(value) if is_domain_rule(value) else EMAIL_PATTERN.match(value))
+
+def env_rules(name: str) -> list[str]:
+    return [normalize(rule) for rule in os.getenv(name, "").split(",") if rule.strip()]
+
+@dataclass(frozen=True)
+class EmailPolicy:
+    allowed_emails: frozenset[str]
+    blocked_emails: frozenset[str]
+    allowed_domains: DomainTrie
+    blocked_domains: DomainTrie
+
+    def check(self, email: str) -> str | None:
+        # 返回拒绝原因，允许时为 None
+        email = normalize(email)
+        if email in self.blocked_emails:
+            return "该邮箱已被禁止申请"
+        if email in self.allowed_emails:
+            return None
+        domain = email.rpartition("@")[2]
+        if self.blocked_domains.match(domain):
+            return "该邮箱域名已被禁止申请"
+        if self.allowed_domains.size and not self.allowed_domains.match(domain):
+            return "无效的邮箱域名"
+        return None
+
+def compile_policy(rows) -> EmailPolicy:
+    allowed_emails, blocked_emails = set(), set()
+    allowed_domains, blocked_domains = DomainTrie(), DomainTrie()
+    for rule in env_rules("ALLOWED_EMAIL_DOMAINS"):
+        allowed_domains.add(rule)
+    for rule in env_rules("BLOCKED_EMAIL_DOMAINS"):
+        blocked_domains.add(rule)
+    for value, kind in rows:
+        value = normalize(value)
+        if is_domain_rule(value):
+            (blocked_domains if kind == 'block' else allowed_domains).add(value)
+        else:
+            (blocked_emails if kind == 'block' else allowed_emails).add(value)
+    return EmailPolicy(frozenset(allowed_emails), frozenset(blocked_emails), allowed_domains, blocked_domains)
+
+_cached: EmailPolicy | None = None
+_cached_stamp = None
+_lock = asyncio.Lock()
+
+async def get_policy() -> EmailPolicy:
+    global _cached, _cached_stamp
+    stamp = read_stamp(POLICY_STAMP_PATH)
+    if _cached is not None and stamp == _cached_stamp:
+        return _cached
+    # 表可能有数万行，同时到达的请求只加载一次
+    async with _lock:
+        if _cached is not None and stamp == _cached_stamp:
+            return _cached
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(Whitelist.email, Whitelist.kind))).all()
+        _cached = compile_policy(rows)
+        _cached_stamp = stamp
+    return _cached
+
+def policy_changed():
+    # 写入方提交后调用，本进程和其他进程在下一次检查时重新编译
+    global _cached
+    bump_stamp(POLICY_STAMP_PATH)
+    _cached = None
+
+async def iter_csv_rows(chunks):
+    # 逐块解码请求体，只保留最后一个不完整的行，不把整个文件读入内存
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for row in csv.reader(lines):
+            yield row
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        for row in csv.reader([pending]):
+            yield row
+
+async def write_batch(batch: dict[str, str]) -> tuple[int, int]:
+    upserts = [{"email": email, "kind": kind} for email, kind in batch.items() if kind != 'remove']
+    removals = [email for email, kind in batch.items() if kind == 'remove']
+    async with AsyncSessionLocal() as db:
+        if upserts:
+            statement = sqlite_insert(Whitelist).values(upserts)
+            await db.execute(statement.on_conflict_do_update(
+                index_elements=[Whitelist.email], set_={"kind": statement.excluded.kind},
+            ))
+        if removals:
+            await db.execute(delete(Whitelist).where(Whitelist.email.in_(removals)))
+        await db.commit()
+    return len(upserts), len(removals)
+
+async def import_csv(chunks, default_kind: str = 'allow') -> dict:
+    # 每行为 邮箱或域名[,allow|block|remove]，可以有 email,kind 表头；每 POLICY_IMPORT_BATCH_SIZE 行提交一次
+    summary = {"rows": 0, "imported": 0, "removed": 0, "invalid": 0, "errors": []}
+    # 同一批次中重复出现的条目以最后一行为准
+    batch: dict[str, str] = {}
+    line = 0
+
+    async def flush():
+        imported, removed = await write_batch(batch)
+        summary["imported"] += imported
+        summary["removed"] += removed
+        batch.clear()
+
+    try:
+        async for row in iter_csv_rows(chunks):
+            line += 1
+            if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+                continue
+            value = normalize(row[0])
+            kind = normalize(row[1]) if len(row) > 1 and row[1].strip() else default_kind
+            if line == 1 and value == "email":
+                continue
+            summary["rows"] += 1
+            if kind not in KINDS or not valid_entry(value):
+                summary["invalid"] += 1
+                if len(summary["errors"]) < POLICY_IMPORT_MAX_ERRORS:
+                    summary["errors"].append({"line": line, "value": row[0][:200], "kind": kind[:20]})
+                continue
+            batch[value] = kind
+            if len(batch) >= POLICY_IMPORT_BATCH_SIZE:
+                await flush()
+        if batch:
+            await flush()
+    finally:
+        # 中途失败时已提交的批次同样需要生效
+        if summary["imported"] or summary["removed"]:
+            policy_changed()
+    return summary
+
+async def export_csv():
+    # 按 id 分页读取，逐页输出
+    yield "email,kind\n"
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Whitelist.id, Whitelist.email, Whitelist.kind)
+                .where(Whitelist.id > last_id)
+                .order_by(Whitelist.id)
+                .limit(POLICY_IMPORT_BATCH_SIZE)
+            )).all()
+        if not rows:
+            return
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows((email, kind or 'allow') for _, email, kind in rows)
+        yield buffer.getvalue()
+        last_id = rows[-1][0]
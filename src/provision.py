@@ -0,0 +1,171 @@
+# 账户操作后端：未设置 PROVISION_HOSTS 时直接在本机执行；设置后并发发送到每台服务器上的账户代理（src/agent.py）
+# 地址为 http://node1:9100 或 unix:/run/panel-agent.sock，多个地址用逗号分隔
+# 每个账户在每台服务器上的结果保存在 host_accounts 中，任务重试时只重新执行尚未成功的服务器
+import os
+import asyncio
+import datetime
+import httpx
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.models import HostAccount, ProvisionJob
+from src.utils import create_server_accounts, ban_server_accounts, update_public_keys, inspect_server_accounts
+
+PROVISION_HOSTS = [host.strip() for host in os.getenv("PROVISION_HOSTS", "").split(",") if host.strip()]
+PROVISION_AGENT_TOKEN = os.getenv("PROVISION_AGENT_TOKEN", "")
+PROVISION_AGENT_TIMEOUT = float(os.getenv("PROVISION_AGENT_TIMEOUT", 60))
+
+LOCAL_HOST = "local"
+
+# create 的条目为 (邮箱, 公钥, 密码哈希)，keys 的条目为 (邮箱, 公钥)，lock / inspect 的条目为邮箱
+# 每个操作返回 {email: {"created": bool, "error": str | None}}，inspect 返回 inspect_server_accounts 的结果
+class LocalBackend:
+    async def create(self, host: str, entries: list[tuple[str, str | None, str]]) -> dict[str, dict]:
+        return await asyncio.to_thread(create_server_accounts, entries)
+
+    async def lock(self, host: str, emails: list[str]) -> dict[str, dict]:
+        errors = await asyncio.to_thread(ban_server_accounts, emails)
+        return {email: {"created": False, "error": error} for email, error in errors.items()}
+
+    async def update_keys(self, host: str, entries: list[tuple[str, str]]) -> dict[str, dict]:
+        errors = await asyncio.to_thread(update_public_keys, entries)
+        return {email: {"created": False, "error": error} for email, error in errors.items()}
+
+    async def inspect(self, host: str, emails: list[str]) -> dict[str, dict]:
+        return await asyncio.to_thread(inspect_server_accounts, emails)
+
+    async def close(self):
+        pass
+
+class AgentBackend:
+    def __init__(self, token: str, timeout: float):
+        self.token = token
+        self.timeout = timeout
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def client(self, host: str) -> httpx.AsyncClient:
+        # 每台服务器一个长连接客户端
+        client = self._clients.get(host)
+        if client is None:
+            headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+            if host.startswith("unix:"):
+                transport = httpx.AsyncHTTPTransport(uds=host[len("unix:"):])
+                client = httpx.AsyncClient(transport=transport, base_url="http://agent", headers=headers, timeout=self.timeout)
+            else:
+                client = httpx.AsyncClient(base_url=host, headers=headers, timeout=self.timeout)
+            self._clients[host] = client
+        return client
+
+    async def call(self, host: str, path: str, payload: dict) -> dict[str, dict]:
+        response = await self.client(host).post(path, json=payload)
+        response.raise_for_status()
+        return response.json()["results"]
+
+    async def create(self, host: str, entries: list[tuple[str, str | None, str]]) -> dict[str, dict]:
+        return await self.call(host, "/accounts/create", {"accounts": [
+            {"email": email, "public_key": public_key, "password_hash": password_hash}
+            for email, public_key, password_hash in entries
+        ]})
+
+    async def lock(self, host: str, emails: list[str]) -> dict[str, dict]:
+        return await self.call(host, "/accounts/lock", {"emails": emails})
+
+    async def update_keys(self, host: str, entries: list[tuple[str, str]]) -> dict[str, dict]:
+        return await self.call(host, "/accounts/keys", {"accounts": [
+            {"email": email, "public_key": public_key} for email, public_key in entries
+        ]})
+
+    async def inspect(self, host: str, emails: list[str]) -> dict[str, dict]:
+        return await self.call(host, "/accounts/inspect", {"emails": emails})
+
+    async def close(self):
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+backend = AgentBackend(PROVISION_AGENT_TOKEN, PROVISION_AGENT_TIMEOUT) if PROVISION_HOSTS else LocalBackend()
+
+def configured_hosts() -> list[str]:
+    return PROVISION_HOSTS or [LOCAL_HOST]
+
+async def fan_out(operation: str, host_entries: dict[str, list]) -> dict[str, dict[str, dict]]:
+    # 并发地在每台服务器上执行，返回 {host: {email: 结果}}；某台服务器不可达时该服务器上的条目全部记为失败
+    async def run(host: str, entries: list) -> dict[str, dict]:
+        emails = [entry if isinstance(entry, str) else entry[0] for entry in entries]
+        try:
+            results = await getattr(backend, operation)(host, entries)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            return {email: {"created": False, "error": error} for email in emails}
+        missing = {"created": False, "error": "代理未返回结果"}
+        return {email: results.get(email, missing) for email in emails}
+
+    hosts = [host for host, entries in host_entries.items() if entries]
+    outcomes = await asyncio.gather(*(run(host, host_entries[host]) for host in hosts))
+    return dict(zip(hosts, outcomes))
+
+async def remaining_hosts(db: AsyncSession, jobs: list[ProvisionJob]) -> dict[int, list[str]]:
+    # 任务创建后已经在某台服务器上成功执行过同类操作时，重试时跳过该服务器
+    if not jobs:
+        return {}
+    hosts = configured_hosts()
+    rows = (await db.execute(
+        select(HostAccount).where(HostAccount.account_id.in_({job.account_id for job in jobs}))
+    )).scalars().all()
+    done = {
+        (row.account_id, row.host, row.kind): row.updated_at
+        for row in rows if row.status == 'done'
+    }
+    remaining = {}
+    for job in jobs:
+        remaining[job.id] = []
+        for host in hosts:
+            done_at = done.get((job.account_id, host, job.kind))
+            if done_at is None or done_at < job.created_at:
+                remaining[job.id].append(host)
+    return remaining
+
+async def record_host_results(db: AsyncSession, kind: str, account_ids: dict[str, int], results: dict[str, dict[str, dict]]):
+    # results 为 fan_out 的返回值，account_ids 为 {email: account_id}；由调用方提交事务
+    now = datetime.datetime.utcnow()
+    rows = [
+        dict(
+            account_id=account_ids[email],
+            host=host,
+            kind=kind,
+            status='failed' if result["error"] else 'done',
+            last_error=result["error"],
+            updated_at=now,
+        )
+        for host, host_results in results.items()
+        for email, result in host_results.items()
+    ]
+    if not rows:
+        return
+    statement = sqlite_insert(HostAccount).values(rows)
+    await db.execute(statement.on_conflict_do_update(
+        index_elements=[HostAccount.account_id, HostAccount.host],
+        set_={
+            "kind": statement.excluded.kind,
+            "status": statement.excluded.status,
+            "last_error": statement.excluded.last_error,
+            "updated_at": statement.excluded.updated_at,
+        },
+    ))
+
+async def host_statuses(db: AsyncSession, account_id: int) -> list[dict]:
+    rows = {row.host: row for row in (await db.execute(
+        select(HostAccount).where(HostAccount.account_id == account_id)
+    )).scalars().all()}
+    # 已配置但尚未执行过任务的服务器也列出，状态为空
+    hosts = configured_hosts() + sorted(set(rows) - set(configured_hosts()))
+    return [
+        {
+            "host": host,
+            "kind": rows[host].kind if host in rows else None,
+            "status": rows[host].status if host in rows else None,
+            "last_error": rows[host].last_error if host in rows else None,
+            "updated_at": rows[host].updated_at.isoformat() if host in rows else None,
+        }
+        for host in hosts
+    ]
@@ -0,0 +1,109 @@
+# /apply 令牌桶限流：按邮箱和客户端 IP 分别计数
+# 每个桶最多 burst 个令牌，每 refill_seconds 秒补充一个；burst 为 0 表示不限流
+# RATE_LIMIT_STORE=memory 时计数保存在进程内，多个 uvicorn 进程时使用 sqlite 在数据库中共享
+import os
+import time
+import threading
+from dataclasses import dataclass
+from sqlalchemy import text
+from src.database import async_engine
+
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+# 位于反向代理之后时，从 X-Forwarded-For 取客户端 IP
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+# 进程内最多保存的桶数，超过后清理已经补满的桶
+MEMORY_STORE_MAX_KEYS = 10000
+SQLITE_CLEANUP_EVERY = 1000
+
+@dataclass(frozen=True)
+class Limit:
+    scope: str
+    burst: int
+    refill_seconds: float
+
+    @property
+    def rate(self) -> float:
+        return 1 / self.refill_seconds
+
+APPLY_EMAIL_LIMIT = Limit(
+    "apply-email",
+    int(os.getenv("APPLY_EMAIL_BURST", 3)),
+    float(os.getenv("APPLY_EMAIL_REFILL_SECONDS", 600)),
+)
+APPLY_IP_LIMIT = Limit(
+    "apply-ip",
+    int(os.getenv("APPLY_IP_BURST", 20)),
+    float(os.getenv("APPLY_IP_REFILL_SECONDS", 30)),
+)
+
+def refill(tokens: float, updated_at: float, now: float, limit: Limit) -> float:
+    return min(limit.burst, tokens + (now - updated_at) * limit.rate)
+
+class MemoryStore:
+    def __init__(self):
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, limit: Limit, now: float) -> float:
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit.burst, now))
+            tokens = refill(tokens, updated_at, now, limit)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) * limit.refill_seconds
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > MEMORY_STORE_MAX_KEYS:
+                self._prune(now, limit)
+            return 0.0
+
+    def _prune(self, now: float, limit: Limit):
+        full_after = limit.burst * limit.refill_seconds
+        prefix = f"{limit.scope}:"
+        for key, (_, updated_at) in list(self._buckets.items()):
+            if key.startswith(prefix) and now - updated_at >= full_after:
+                del self._buckets[key]
+
+class SQLiteStore:
+    # 一条 UPSERT 完成补充和扣减，WHERE 不满足时不更新（rowcount 为 0）即为拒绝
+    TAKE = text("""
+        INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (:key, :burst - 1, :now)
+        ON CONFLICT(key) DO UPDATE SET
+            tokens = min(:burst, tokens + (:now - updated_at) * :rate) - 1,
+            updated_at = :now
+        WHERE min(:burst, tokens + (:now - updated_at) * :rate) >= 1
+    """)
+
+    def __init__(self):
+        self._takes = 0
+
+    async def take(self, key: str, limit: Limit, now: float) -> float:
+        params = {"key": key, "burst": limit.burst, "rate": limit.rate, "now": now}
+        async with async_engine.begin() as conn:
+            if (await conn.execute(self.TAKE, params)).rowcount == 1:
+                self._takes += 1
+                if self._takes % SQLITE_CLEANUP_EVERY == 0:
+                    # 已经补满的桶与不存在等价，可以删除
+                    await conn.execute(
+                        text("DELETE FROM rate_limit_buckets WHERE key LIKE :prefix AND updated_at < :now - :full_after"),
+                        {"prefix": f"{limit.scope}:%", "now": now, "full_after": limit.burst * limit.refill_seconds},
+                    )
+                return 0.0
+            tokens, updated_at = (await conn.execute(
+                text("SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = :key"), {"key": key}
+            )).one()
+        return (1 - refill(tokens, updated_at, now, limit)) * limit.refill_seconds
+
+store = SQLiteStore() if RATE_LIMIT_STORE == "sqlite" else MemoryStore()
+
+async def check(limit: Limit, identity: str) -> float:
+    # 返回需要等待的秒数，0 表示允许
+    if limit.burst <= 0 or not identity:
+        return 0.0
+    return await store.take(f"{limit.scope}:{identity.lower()}", limit, time.time())
+
+def client_ip(request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else ""
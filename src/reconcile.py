@@ -0,0 +1,222 @@
+# 账户对账：以 accounts 表为准，检查每台服务器上的系统账户是否与账户状态一致，并批量修复
+# 每台服务器只读取一次全部系统账户（passwd / shadow 索引），在内存中与账户表对照，不为每个用户启动子进程
+#   python -m src.reconcile          # 只报告，存在不一致时退出码为 1
+#   python -m src.reconcile --fix    # 报告并修复，仍有修复失败时退出码为 1
+# 不一致类型及修复方式：
+#   missing_user           活跃账户在服务器上不存在 → 创建（沿用任务中保存的密码哈希，没有时生成新密码并发邮件）
+#   locked_but_active      活跃账户在服务器上被锁定或 shell 不可登录 → 解锁
+#   missing_keys           活跃账户缺少 authorized_keys → 写入最近一次通过的申请中的公钥
+#   unlocked_but_inactive  不活跃账户（或曾提交过创建任务的未创建账户）在服务器上可以登录 → 禁用
+# 从未提交过创建任务的未创建账户不检查：同名的系统用户与面板无关，不能被禁用
+# 有排队或执行中任务的账户由任务 worker 处理，对账时跳过
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, asdict
+from sqlalchemy import select, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import AsyncSessionLocal
+from src.models import Account, Application, ProvisionJob
+from src.provision import configured_hosts, fan_out, record_host_results
+from src.utils import ACTIVE_SHELL, BANNED_SHELL, generate_password, hash_password, send_account_details
+
+# 报告中最多列出的不一致条目和修复失败条目
+RECONCILE_REPORT_LIMIT = int(os.getenv("RECONCILE_REPORT_LIMIT", 500))
+
+MISSING_USER = 'missing_user'
+LOCKED_BUT_ACTIVE = 'locked_but_active'
+MISSING_KEYS = 'missing_keys'
+UNLOCKED_BUT_INACTIVE = 'unlocked_but_inactive'
+
+# 不一致类型 → 修复时调用的后端操作
+FIX_OPERATIONS = {
+    MISSING_USER: 'create',
+    LOCKED_BUT_ACTIVE: 'create',
+    MISSING_KEYS: 'update_keys',
+    UNLOCKED_BUT_INACTIVE: 'lock',
+}
+
+# 同一进程中的对账依次执行
+_lock = asyncio.Lock()
+
+@dataclass
+class Mismatch:
+    account_id: int
+    email: str
+    host: str
+    kind: str
+    account_status: str
+
+def classify(account_status: str, state: dict, public_key: str | None, provisioned: bool) -> str | None:
+    # 无法读取 /etc/shadow 时 locked 为 None，只按 shell 判断；provisioned 表示账户曾提交过创建任务
+    if account_status == '活跃状态':
+        if not state["exists"]:
+            return MISSING_USER
+        if state["locked"] is True or state["shell"] != ACTIVE_SHELL:
+            return LOCKED_BUT_ACTIVE
+        if public_key and not state["has_keys"]:
+            return MISSING_KEYS
+        return None
+    if account_status == '未创建' and not provisioned:
+        return None
+    if state["exists"] and (state["locked"] is False or state["shell"] != BANNED_SHELL):
+        return UNLOCKED_BUT_INACTIVE
+    return None
+
+async def load_accounts(db: AsyncSession) -> tuple[list, dict[int, str], set[int], set[int]]:
+    # 返回 (账户列表, {account_id: 公钥}, 有未完成任务的 account_id, 曾提交过创建任务的 account_id)
+    accounts = (await db.execute(select(Account.id, Account.email, Account.status).order_by(Account.id))).all()
+    latest_approved = (
+        select(func.max(Application.id))
+        .where(Application.status == '同意')
+        .group_by(Application.account_id)
+    )
+    public_keys = dict((await db.execute(
+        select(Application.account_id, Application.public_key).where(Application.id.in_(latest_approved))
+    )).all())
+    busy = set((await db.execute(
+        select(ProvisionJob.account_id).where(ProvisionJob.status.in_(('queued', 'running')))
+    )).scalars().all())
+    provisioned = set((await db.execute(
+        select(ProvisionJob.account_id).where(ProvisionJob.kind == 'create').distinct()
+    )).scalars().all())
+    return accounts, public_keys, busy, provisioned
+
+async def find_mismatches(accounts: list, public_keys: dict[int, str], provisioned: set[int]) -> tuple[list[Mismatch], dict[str, str | None]]:
+    # 每台服务器一次请求取得全部账户的状态，返回 (不一致列表, {host: 错误信息})
+    emails = [email for _, email, _ in accounts]
+    snapshots = await fan_out('inspect', {host: emails for host in configured_hosts()})
+    mismatches = []
+    host_errors = {host: None for host in configured_hosts()}
+    for host, states in snapshots.items():
+        for account_id, email, account_status in accounts:
+            state = states[email]
+            if state["error"]:
+                host_errors[host] = host_errors[host] or state["error"]
+                continue
+            kind = classify(account_status, state, public_keys.get(account_id), account_id in provisioned)
+            if kind is not None:
+                mismatches.append(Mismatch(account_id, email, host, kind, account_status))
+    return mismatches, host_errors
+
+async def creation_hashes(db: AsyncSession, account_ids: set[int]) -> tuple[dict[int, str], dict[int, str], dict[int, int]]:
+    # 沿用账户最近一次创建任务的密码哈希，保证各服务器密码一致；没有时生成新密码
+    # 返回 ({account_id: 哈希}, {account_id: 新生成的明文密码}, {account_id: 需要保存新哈希的任务 id})
+    jobs = (await db.execute(
+        select(ProvisionJob.account_id, ProvisionJob.id, ProvisionJob.password_hash)
+        .where(ProvisionJob.account_id.in_(account_ids), ProvisionJob.kind == 'create')
+        .order_by(ProvisionJob.id)
+    )).all()
+    latest = {account_id: (job_id, password_hash) for account_id, job_id, password_hash in jobs}
+    passwords = {
+        account_id: generate_password()
+        for account_id in account_ids if latest.get(account_id, (None, None))[1] is None
+    }
+    generated = await asyncio.to_thread(lambda: {account_id: hash_password(p) for account_id, p in passwords.items()})
+    hashes = {account_id: generated.get(account_id) or latest[account_id][1] for account_id in account_ids}
+    save_to = {account_id: latest[account_id][0] for account_id in passwords if account_id in latest}
+    return hashes, passwords, save_to
+
+async def fix_mismatches(db: AsyncSession, mismatches: list[Mismatch], public_keys: dict[int, str]) -> dict:
+    # 每种操作在每台服务器上合并为一次批量调用，各服务器并发执行
+    creates = [m for m in mismatches if FIX_OPERATIONS[m.kind] == 'create']
+    hashes, passwords, save_to = await creation_hashes(db, {m.account_id for m in creates})
+    host_entries = {operation: {host: [] for host in configured_hosts()} for operation in set(FIX_OPERATIONS.values())}
+    for m in mismatches:
+        operation = FIX_OPERATIONS[m.kind]
+        if operation == 'create':
+            entry = (m.email, public_keys.get(m.account_id), hashes[m.account_id])
+        elif operation == 'update_keys':
+            entry = (m.email, public_keys[m.account_id])
+        else:
+            entry = m.email
+        host_entries[operation][m.host].append(entry)
+
+    account_ids = {m.email: m.account_id for m in mismatches}
+    results = {}
+    for operation in ('create', 'lock', 'update_keys'):
+        results[operation] = await fan_out(operation, host_entries[operation])
+    await record_host_results(db, 'create', account_ids, results['create'])
+    await record_host_results(db, 'ban', account_ids, results['lock'])
+
+    fixed, failed = 0, []
+    created = set()
+    for m in mismatches:
+        result = results[FIX_OPERATIONS[m.kind]][m.host][m.email]
+        if result["created"]:
+            created.add(m.account_id)
+        if result["error"]:
+            failed.append({**asdict(m), "error": result["error"]})
+        else:
+            fixed += 1
+
+    # 只在确实新建了账户时保存并发送新密码
+    for account_id in created & set(save_to):
+        await db.execute(
+            update(ProvisionJob).where(ProvisionJob.id == save_to[account_id]).values(password_hash=hashes[account_id])
+        )
+    await db.commit()
+    emails = {m.account_id: m.email for m in creates}
+    sent = 0
+    for account_id in created & set(passwords):
+        try:
+            await send_account_details(emails[account_id], passwords[account_id])
+            sent += 1
+        except Exception as e:
+            logging.error(f"发送账户信息至 {emails[account_id]} 失败: {str(e)}")
+    return {"fixed": fixed, "failed": len(failed), "errors": failed[:RECONCILE_REPORT_LIMIT], "passwords_sent": sent}
+
+async def reconcile(fix: bool = False) -> dict:
+    async with _lock:
+        started = time.perf_counter()
+        async with AsyncSessionLocal() as db:
+            accounts, public_keys, busy, provisioned = await load_accounts(db)
+            # 结束读事务，避免在等待各服务器期间占用数据库连接
+            await db.commit()
+            checked = [account for account in accounts if account[0] not in busy]
+            mismatches, host_errors = await find_mismatches(checked, public_keys, provisioned)
+            report = {
+                "accounts": len(checked),
+                "skipped": len(accounts) - len(checked),
+                "hosts": host_errors,
+                "total": len(mismatches),
+                "counts": dict(Counter(m.kind for m in mismatches)),
+                "mismatches": [asdict(m) for m in mismatches[:RECONCILE_REPORT_LIMIT]],
+            }
+            if fix and mismatches:
+                report["fix"] = await fix_mismatches(db, mismatches, public_keys)
+        report["seconds"] = round(time.perf_counter() - started, 3)
+
+    summary = f"对账完成：检查 {report['accounts']} 个账户，发现 {report['total']} 处不一致"
+    if "fix" in report:
+        summary += f"，修复 {report['fix']['fixed']} 处，失败 {report['fix']['failed']} 处"
+    logging.info(summary, extra={"counts": report["counts"], "seconds": report["seconds"]})
+    for host, error in host_errors.items():
+        if error:
+            logging.error(f"对账时无法读取 {host} 的系统账户: {error}")
+    return report
+
+def main():
+    from src.database import async_engine, init_db
+    from src.provision import backend
+    init_db()
+    fix = "--fix" in sys.argv
+
+    async def run() -> dict:
+        try:
+            return await reconcile(fix)
+        finally:
+            await backend.close()
+            await async_engine.dispose()
+
+    report = asyncio.run(run())
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    unresolved = report["fix"]["failed"] if "fix" in report else report["total"]
+    sys.exit(1 if unresolved or any(report["hosts"].values()) else 0)
+
+if __name__ == "__main__":
+    main()
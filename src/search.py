@@ -0,0 +1,152 @@
+# 申请全文搜索：applications_fts 为 FTS5 虚拟表（rowid 为申请 id），保存账户邮箱和申请理由的副本
+# 由触发器与 applications / accounts 保持同步；trigram 分词可以匹配中文的任意子串（至少 3 个字符）
+# 少于 3 个字符的词（如两个字的姓名）无法用 trigram 索引，改为对原表做 LIKE 扫描
+# 已有数据库由迁移建立索引；索引损坏或与数据不一致时可以重建：
+#   python -m src.search --rebuild
+import re
+import sys
+import html
+import datetime
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS applications_fts USING fts5(email, reason, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS applications_fts_insert AFTER INSERT ON applications BEGIN
+        INSERT INTO applications_fts (rowid, email, reason)
+        VALUES (new.id, (SELECT email FROM accounts WHERE id = new.account_id), new.application_reason);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS applications_fts_update AFTER UPDATE OF application_reason, account_id ON applications BEGIN
+        DELETE FROM applications_fts WHERE rowid = old.id;
+        INSERT INTO applications_fts (rowid, email, reason)
+        VALUES (new.id, (SELECT email FROM accounts WHERE id = new.account_id), new.application_reason);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS applications_fts_delete AFTER DELETE ON applications BEGIN
+        DELETE FROM applications_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS accounts_fts_email AFTER UPDATE OF email ON accounts BEGIN
+        UPDATE applications_fts SET email = new.email
+        WHERE rowid IN (SELECT id FROM applications WHERE account_id = new.id);
+    END""",
+]
+
+# trigram 分词器能索引的最短词长
+MIN_TRIGRAM_LENGTH = 3
+# 邮箱匹配比申请理由匹配更重要
+BM25_WEIGHTS = "2.0, 1.0"
+SNIPPET_TOKENS = 24
+# snippet() 中使用控制字符标记命中位置，转义 HTML 后再替换为 <mark>
+MARK_OPEN = "\x02"
+MARK_CLOSE = "\x03"
+
+def create_search_index(conn: Connection):
+    for statement in SEARCH_DDL:
+        conn.exec_driver_sql(statement)
+
+def rebuild_search_index(conn: Connection) -> int:
+    create_search_index(conn)
+    conn.exec_driver_sql("DELETE FROM applications_fts")
+    conn.exec_driver_sql(
+        "INSERT INTO applications_fts (rowid, email, reason) "
+        "SELECT applications.id, accounts.email, applications.application_reason "
+        "FROM applications JOIN accounts ON accounts.id = applications.account_id"
+    )
+    conn.exec_driver_sql("INSERT INTO applications_fts (applications_fts) VALUES ('optimize')")
+    return conn.exec_driver_sql("SELECT COUNT(*) FROM applications_fts").scalar()
+
+def parse_query(query: str) -> tuple[str | None, list[str]]:
+    # 按空白拆分为多个词，全部需要命中；长词组成 FTS5 查询（每个词作为短语，避免用户输入被当作查询语法），短词返回给调用方做 LIKE
+    terms = [term for term in query.split() if term]
+    long_terms = [term for term in terms if len(term) >= MIN_TRIGRAM_LENGTH]
+    short_terms = [term for term in terms if len(term) < MIN_TRIGRAM_LENGTH]
+    match = " AND ".join('"' + term.replace('"', '""') + '"' for term in long_terms) or None
+    return match, short_terms
+
+def escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def render_marked(value: str | None) -> str:
+    return html.escape(value or "").replace(MARK_OPEN, "<mark>").replace(MARK_CLOSE, "</mark>")
+
+def mark_terms(value: str | None, terms: list[str]) -> str | None:
+    # 短词不经过 FTS5，在 Python 中标记
+    if not value or not terms:
+        return value
+    pattern = re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+    return pattern.sub(lambda m: MARK_OPEN + m.group(0) + MARK_CLOSE, value)
+
+def excerpt(value: str | None, terms: list[str], width: int = SNIPPET_TOKENS * 2) -> str | None:
+    # 截取第一个命中位置附近的文本
+    if not value:
+        return value
+    positions = [value.lower().find(term.lower()) for term in terms]
+    positions = [p for p in positions if p >= 0]
+    start = max(0, min(positions) - width // 4) if positions else 0
+    fragment = value[start:start + width]
+    return ("…" if start > 0 else "") + fragment + ("…" if start + width < len(value) else "")
+
+async def search_applications(db: AsyncSession, query: str, limit: int, offset: int) -> tuple[int, list[dict]]:
+    match, short_terms = parse_query(query)
+    if match is None and not short_terms:
+        return 0, []
+    conditions = []
+    params = {"limit": limit, "offset": offset, "open": MARK_OPEN, "close": MARK_CLOSE}
+    for i, term in enumerate(short_terms):
+        # 直接扫描原表比通过虚拟表读取内容更快
+        conditions.append(f"(applications.application_reason LIKE :like{i} ESCAPE '\\' OR accounts.email LIKE :like{i} ESCAPE '\\')")
+        params[f"like{i}"] = f"%{escape_like(term)}%"
+    accounts_join = "JOIN accounts ON accounts.id = applications.account_id"
+    source = f"applications {accounts_join}"
+    if match is not None:
+        # 排序和高亮由 FTS5 完成
+        source = f"applications_fts JOIN applications ON applications.id = applications_fts.rowid {accounts_join}"
+        conditions.insert(0, "applications_fts MATCH :match")
+        params["match"] = match
+        columns = (
+            "highlight(applications_fts, 0, :open, :close) AS email_marked, "
+            f"snippet(applications_fts, 1, :open, :close, '…', {SNIPPET_TOKENS}) AS reason_marked, "
+            f"bm25(applications_fts, {BM25_WEIGHTS}) AS score"
+        )
+        order = "score, applications.id DESC"
+    else:
+        columns = "accounts.email AS email_marked, applications.application_reason AS reason_marked, NULL AS score"
+        order = "applications.id DESC"
+    where = " AND ".join(conditions)
+
+    total = (await db.execute(text(f"SELECT COUNT(*) FROM {source} WHERE {where}"), params)).scalar_one()
+    rows = (await db.execute(text(
+        f"SELECT applications.id, {columns}, applications.status, "
+        "applications.is_first_application, applications.application_time "
+        f"FROM {source} WHERE {where} ORDER BY {order} LIMIT :limit OFFSET :offset"
+    ), params)).mappings().all()
+
+    items = []
+    for row in rows:
+        email, reason = row["email_marked"], row["reason_marked"]
+        if match is None:
+            reason = excerpt(reason, short_terms)
+        email, reason = mark_terms(email, short_terms), mark_terms(reason, short_terms)
+        items.append({
+            "id": row["id"],
+            "email_html": render_marked(email),
+            "snippet_html": render_marked(reason),
+            "status": row["status"],
+            "is_first_application": bool(row["is_first_application"]),
+            "application_time": datetime.datetime.fromisoformat(row["application_time"]).isoformat(),
+            "score": row["score"],
+        })
+    return total, items
+
+def main():
+    from src.database import engine, init_db
+    init_db()
+    if "--rebuild" in sys.argv:
+        with engine.begin() as conn:
+            count = rebuild_search_index(conn)
+        print(f"已重建搜索索引，共 {count} 条申请")
+    else:
+        print("用法：python -m src.search --rebuild")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import os
+from dataclasses import dataclass
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import AsyncSessionLocal, DATABASE_PATH
+from src.models import Settings
+
+# 设置变更时替换该文件，其他 uvicorn 进程通过 stat 发现变化后重新加载
+SETTINGS_STAMP_PATH = os.getenv("SETTINGS_STAMP_PATH", DATABASE_PATH + ".settings-version")
+
+@dataclass(frozen=True)
+class SettingsSnapshot:
+    auto_approve: bool
+    account_expiry_days: int
+    archive_after_days: int
+    homepage_message: str
+
+    @classmethod
+    def from_row(cls, settings: Settings) -> "SettingsSnapshot":
+        return cls(
+            auto_approve=bool(settings.auto_approve),
+            account_expiry_days=settings.account_expiry_days,
+            archive_after_days=settings.archive_after_days or 0,
+            homepage_message=settings.homepage_message,
+        )
+
+_cached: SettingsSnapshot | None = None
+_cached_stamp = None
+
+def read_stamp(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+def bump_stamp(path: str):
+    try:
+        with open(path) as f:
+            version = int(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        version = 0
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(version + 1))
+    # 原子替换，inode 一定会变化，不依赖 mtime 精度
+    os.replace(tmp_path, path)
+
+async def _load(db: AsyncSession) -> Settings:
+    settings = (await db.execute(select(Settings).limit(1))).scalar_one_or_none()
+    if not settings:
+        settings = Settings()
+        db.add(settings)
+        await db.commit()
+    return settings
+
+async def get_settings() -> SettingsSnapshot:
+    global _cached, _cached_stamp
+    # 先读版本再读数据库：写入方先提交再更新版本，因此不会把旧数据缓存在新版本下
+    stamp = read_stamp(SETTINGS_STAMP_PATH)
+    if _cached is not None and stamp == _cached_stamp:
+        return _cached
+    async with AsyncSessionLocal() as db:
+        _cached = SettingsSnapshot.from_row(await _load(db))
+    _cached_stamp = stamp
+    return _cached
+
+async def update_settings(db: AsyncSession, **changes) -> SettingsSnapshot:
+    global _cached, _cached_stamp
+    settings = await _load(db)
+    for key, value in changes.items():
+        setattr(settings, key, value)
+    await db.commit()
+    bump_stamp(SETTINGS_STAMP_PATH)
+    _cached = SettingsSnapshot.from_row(settings)
+    _cached_stamp = read_stamp(SETTINGS_STAMP_PATH)
+    return _cached
@@ -0,0 +1,109 @@
+# 进程内的简易 SMTP 服务器，用于开发和测试时代替真实邮件服务器
+# 支持 EHLO / AUTH / MAIL / RCPT / DATA，不支持 STARTTLS，需配合 SMTP_STARTTLS=false 使用
+#   python -m src.smtp_stub --port 8025
+import argparse
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        server: LocalSMTPServer = self.server
+        server.connections += 1
+        self.reply("220 localhost smtp stub ready")
+        mail_from, rcpt_to = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                server.logins += 1
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                mail_from, rcpt_to = command[10:].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                rcpt_to.append(command[8:].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                if server.latency:
+                    time.sleep(server.latency)
+                message = message_from_bytes(b"".join(data))
+                with server.lock:
+                    server.messages.append({"from": mail_from, "to": rcpt_to, "message": message})
+                if server.verbose:
+                    print(f"{rcpt_to} {message['Subject']}\n{message.get_payload(decode=True).decode(errors='replace')}\n")
+                self.reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, verbose: bool = False):
+        super().__init__((host, port), SMTPHandler)
+        self.latency = latency
+        self.verbose = verbose
+        self.messages: list[dict] = []
+        self.connections = 0
+        self.logins = 0
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+    server = LocalSMTPServer(args.host, args.port, verbose=True)
+    print(f"SMTP stub listening on {args.host}:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
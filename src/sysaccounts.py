@@ -0,0 +1,86 @@
+# 系统账户索引：解析 /etc/passwd 和 /etc/shadow，文件变化（mtime / inode / 大小）时才重新加载
+# 查询用户是否存在、是否锁定、登录 shell 和主目录都不再需要启动子进程
+import os
+import threading
+from dataclasses import dataclass
+
+PASSWD_PATH = os.getenv("SYSTEM_PASSWD_PATH", "/etc/passwd")
+SHADOW_PATH = os.getenv("SYSTEM_SHADOW_PATH", "/etc/shadow")
+
+@dataclass(frozen=True)
+class SystemAccount:
+    name: str
+    uid: int
+    gid: int
+    home: str
+    shell: str
+    # 没有读取 /etc/shadow 的权限时为 None
+    locked: bool | None
+
+def _stat(path: str):
+    try:
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def parse_passwd(path: str) -> dict[str, tuple]:
+    entries = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            fields = line.rstrip("\n").split(":")
+            if len(fields) < 7 or line.startswith(("#", "+", "-")):
+                continue
+            name, _, uid, gid, _, home, shell = fields[:7]
+            entries[name] = (int(uid), int(gid), home, shell)
+    return entries
+
+def parse_shadow(path: str) -> dict[str, bool] | None:
+    # usermod -L 会在密码字段前加 "!"
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return {
+                fields[0]: fields[1].startswith("!")
+                for fields in (line.rstrip("\n").split(":") for line in f)
+                if len(fields) >= 2
+            }
+    except OSError:
+        return None
+
+class SystemAccountIndex:
+    def __init__(self, passwd_path: str = PASSWD_PATH, shadow_path: str = SHADOW_PATH):
+        self.passwd_path = passwd_path
+        self.shadow_path = shadow_path
+        self.reloads = 0
+        self._stamps = None
+        self._accounts: dict[str, SystemAccount] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self) -> dict[str, SystemAccount]:
+        stamps = (_stat(self.passwd_path), _stat(self.shadow_path))
+        if stamps != self._stamps:
+            with self._lock:
+                if stamps != self._stamps:
+                    passwd = parse_passwd(self.passwd_path)
+                    shadow = parse_shadow(self.shadow_path)
+                    self._accounts = {
+                        name: SystemAccount(name, uid, gid, home, shell, shadow.get(name) if shadow is not None else None)
+                        for name, (uid, gid, home, shell) in passwd.items()
+                    }
+                    self._stamps = stamps
+                    self.reloads += 1
+        return self._accounts
+
+    def get(self, username: str) -> SystemAccount | None:
+        return self.refresh().get(username)
+
+    def exists(self, username: str) -> bool:
+        return username in self.refresh()
+
+    def usernames(self) -> set[str]:
+        return set(self.refresh())
+
+    def __len__(self) -> int:
+        return len(self.refresh())
+
+system_accounts = SystemAccountIndex()
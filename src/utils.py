@@ -1,94 +1,349 @@
-import smtplib
 import subprocess
 import os
+import re
 import logging
-from email.mime.text import MIMEText
 from passlib.context import CryptContext
+from passlib.hash import sha512_crypt
+from src.mailer import enqueue_mail
+from src.sysaccounts import SystemAccount, system_accounts
+from src.metrics import timed, command_seconds
 import string
 import random
-
-logging.basicConfig(filename='account_management.log', level=logging.INFO,
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+import shutil
+import time
+import tempfile
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+FAKE_BACKEND = os.getenv("PROVISION_BACKEND") == "fake"
+# fake 后端不创建真实用户，未指定目录时主目录和 authorized_keys 写入临时目录，不触碰 /home
+HOME_ROOT = os.getenv("PROVISION_HOME_ROOT") or (None if FAKE_BACKEND else "/home")
+
+def home_root() -> str:
+    # 临时目录在第一次使用时才创建，只导入模块不会留下空目录
+    global HOME_ROOT
+    if HOME_ROOT is None:
+        HOME_ROOT = tempfile.mkdtemp(prefix="panel-home-")
+    return HOME_ROOT
+SKEL_DIR = "/etc/skel"
+
+class CommandFailed(subprocess.CalledProcessError):
+    # 默认的错误信息只有命令和退出码，附上 stderr 以便在任务错误和日志中看到失败原因
+    def __str__(self):
+        message = super().__str__()
+        return f"{message} {self.stderr.strip()}" if self.stderr and self.stderr.strip() else message
+
+class CommandRunner:
+    def run(self, args: list[str], input: str | None = None):
+        with timed(command_seconds, "command", args[0]):
+            return self.execute(args, input)
+
+    def execute(self, args: list[str], input: str | None = None):
+        try:
+            return subprocess.run(args, check=True, capture_output=True, text=True, input=input)
+        except subprocess.CalledProcessError as e:
+            raise CommandFailed(e.returncode, e.cmd, e.output, e.stderr) from None
+
+    def lookup(self, username: str) -> SystemAccount | None:
+        return system_accounts.get(username)
+
+    def existing_usernames(self) -> set[str]:
+        return system_accounts.usernames()
+
+    def snapshot(self) -> dict[str, SystemAccount]:
+        return system_accounts.refresh()
+
+    def lookup_ids(self, username: str) -> tuple[int, int]:
+        account = self.lookup(username)
+        if account is None:
+            raise KeyError(f"系统中不存在用户 {username}")
+        return account.uid, account.gid
+
+class FakeCommandRunner(CommandRunner):
+    # 不真正执行命令，只记录调用并模拟进程启动耗时，用于基准测试与开发环境
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: list[list[str]] = []
+        self.accounts: dict[str, SystemAccount] = {}
+
+    def _add(self, username: str, home: str, shell: str):
+        self.accounts[username] = SystemAccount(username, os.getuid(), os.getgid(), home, shell, False)
+
+    def execute(self, args: list[str], input: str | None = None):
+        self.calls.append(args)
+        if self.latency:
+            time.sleep(self.latency)
+        if args[0] == 'useradd':
+            self._add(args[-1], os.path.join(home_root(), args[-1]), args[args.index('-s') + 1])
+        elif args[0] == 'newusers':
+            for line in input.splitlines():
+                fields = line.split(':')
+                self._add(fields[0], fields[5], fields[6])
+        elif args[0] == 'usermod':
+            username = args[-1]
+            if username not in self.accounts:
+                raise subprocess.CalledProcessError(6, args)
+            account = self.accounts[username]
+            self.accounts[username] = SystemAccount(
+                username, account.uid, account.gid, account.home,
+                args[args.index('-s') + 1] if '-s' in args else account.shell,
+                True if '-L' in args else False if '-U' in args else account.locked,
+            )
+        return subprocess.CompletedProcess(args, 0, '', '')
+
+    def lookup(self, username: str) -> SystemAccount | None:
+        return self.accounts.get(username)
+
+    def existing_usernames(self) -> set[str]:
+        return set(self.accounts)
+
+    def snapshot(self) -> dict[str, SystemAccount]:
+        return self.accounts
+
+if FAKE_BACKEND:
+    command_runner = FakeCommandRunner(float(os.getenv("FAKE_COMMAND_LATENCY", 0)))
+else:
+    command_runner = CommandRunner()
+
+# 用户名和密码哈希会写入 newusers / chpasswd 的标准输入，含有 ':' 或换行时可以伪造 passwd 行，必须先校验
+USERNAME_PATTERN = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]{0,31}$")
+PASSWORD_HASH_PATTERN = re.compile(r"^\$[A-Za-z0-9./$=,-]+$")
+
 def get_username_from_email(email: str) -> str:
-    return 'p' + email.split('@')[0]
+    username = 'p' + email.split('@')[0]
+    if '@' not in email or not USERNAME_PATTERN.fullmatch(username):
+        raise ValueError(f"邮箱 {email!r} 不能生成有效的用户名")
+    return username
+
+def check_password_hash(password_hash: str) -> str:
+    if not PASSWORD_HASH_PATTERN.fullmatch(password_hash):
+        raise ValueError("密码哈希格式无效")
+    return password_hash
+
+def generate_password() -> str:
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+
+ACTIVE_SHELL = '/bin/bash'
+BANNED_SHELL = '/sbin/nologin'
 
 def user_exists(username):
-    try:
-        subprocess.run(["id", username], check=True, capture_output=True)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    return command_runner.lookup(username) is not None
+
+def is_active(account: SystemAccount) -> bool:
+    return account.locked is False and account.shell == ACTIVE_SHELL
+
+def is_banned(account: SystemAccount) -> bool:
+    return account.locked is True and account.shell == BANNED_SHELL
+
+def chown_tree(path: str, uid: int, gid: int):
+    os.chown(path, uid, gid)
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            os.chown(os.path.join(root, name), uid, gid, follow_symlinks=False)
+
+def write_authorized_keys(username: str, public_key: str):
+    # 在进程内写入公钥并设置属主和权限，避免 mkdir / chown / chmod 的进程开销
+    uid, gid = command_runner.lookup_ids(username)
+    ssh_dir = os.path.join(home_root(), username, ".ssh")
+    os.makedirs(ssh_dir, exist_ok=True)
+    keys_file = os.path.join(ssh_dir, "authorized_keys")
+    with open(keys_file, 'w') as f:
+        f.write(public_key)
+        f.write('\n')
+    chown_tree(ssh_dir, uid, gid)
+    os.chmod(ssh_dir, 0o700)
+    os.chmod(keys_file, 0o600)
+
+def hash_password(password: str) -> str:
+    # 与 chpasswd 默认一致的 SHA-512 crypt，多台服务器使用同一个哈希，用户只需要记住一个密码
+    return sha512_crypt.using(rounds=5000).hash(password)
 
-def create_server_account(email: str, public_key: str | None) -> str:
+def create_server_account(email: str, public_key: str | None, password_hash: str) -> bool:
+    # 返回是否新建了账户；已存在的账户只解锁，不修改密码
     username = get_username_from_email(email)
-    password = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-    
+    check_password_hash(password_hash)
+
+    account = command_runner.lookup(username)
     # 如果不存在
-    if not user_exists(username):
-        subprocess.run(['useradd', '-m', '-s', '/bin/bash', username], check=True)
-        subprocess.run(['bash', '-c', f'echo "{username}:{password}" | chpasswd'], check=True)
+    if account is None:
+        # 密码哈希通过 chpasswd 的标准输入设置，不出现在命令行参数（ps、错误信息）中
+        command_runner.run(['useradd', '-m', '-s', ACTIVE_SHELL, username])
+        command_runner.run(['chpasswd', '-e'], input=f"{username}:{password_hash}\n")
         logging.info(f"已为 {email} 创建服务器账户")
+        created = True
     else:
-        subprocess.run(['usermod', '-U', username], check=True)
-        subprocess.run(['usermod', '-s', '/bin/bash', username], check=True)
+        # 已经是解锁状态时不需要再执行 usermod
+        if not is_active(account):
+            command_runner.run(['usermod', '-U', '-s', ACTIVE_SHELL, username])
         logging.info(f"已解锁 {email} 的服务器账户")
-        password = "未修改"
-    
+        created = False
+
     if public_key:
-        home_dir = f"/home/{username}"
-        ssh_dir = f"{home_dir}/.ssh"
-        subprocess.run(['mkdir', '-p', ssh_dir], check=True)
-        with open(f"{ssh_dir}/authorized_keys", 'w') as f:
-            f.write(public_key)
-            f.write('\n')
-        subprocess.run(['chown', '-R', f"{username}:{username}", ssh_dir], check=True)
-        subprocess.run(['chmod', '700', ssh_dir], check=True)
-        subprocess.run(['chmod', '600', f"{ssh_dir}/authorized_keys"], check=True)
-    
-    return password
+        write_authorized_keys(username, public_key)
+
+    return created
+
+def create_server_accounts(entries: list[tuple[str, str | None, str]]) -> dict[str, dict]:
+    # 批量创建账户：新用户通过一次 newusers 创建，再通过一次 chpasswd -e 设置密码哈希，已存在的用户逐个解锁
+    # entries 为 (邮箱, 公钥, 密码哈希)，返回 {email: {"created": ..., "error": ...}}
+    results = {}
+    new_entries = []
+    for email, public_key, password_hash in entries:
+        try:
+            username = get_username_from_email(email)
+            check_password_hash(password_hash)
+        except ValueError as e:
+            results[email] = {"created": False, "error": str(e)}
+            continue
+        account = command_runner.lookup(username)
+        if account is not None:
+            try:
+                if not is_active(account):
+                    command_runner.run(['usermod', '-U', '-s', ACTIVE_SHELL, username])
+                results[email] = {"created": False, "error": None}
+                logging.info(f"已解锁 {email} 的服务器账户")
+            except subprocess.CalledProcessError as e:
+                results[email] = {"created": False, "error": str(e)}
+        elif any(username == pending for _, pending, _ in new_entries):
+            results[email] = {"created": False, "error": f"用户名 {username} 与同批次的其他申请重复"}
+        else:
+            new_entries.append((email, username, password_hash))
+
+    if new_entries:
+        # newusers 只接受明文密码，先设置随机密码，随后在同一批次中替换为哈希
+        batch = ''.join(
+            f"{username}:{generate_password()}:::,,,:{os.path.join(home_root(), username)}:{ACTIVE_SHELL}\n"
+            for _, username, _ in new_entries
+        )
+        try:
+            command_runner.run(['newusers'], input=batch)
+            command_runner.run(['chpasswd', '-e'], input=''.join(
+                f"{username}:{password_hash}\n" for _, username, password_hash in new_entries
+            ))
+        except subprocess.CalledProcessError as e:
+            # 整批失败时退回逐个创建，以便得到每个用户的结果
+            # newusers 可能在中途失败（或 chpasswd 失败），已经由它创建的用户不能当作已存在账户只解锁，仍要设置密码哈希并复制 /etc/skel
+            logging.error(f"批量创建账户失败，改为逐个创建: {str(e)}")
+            existing = command_runner.existing_usernames()
+            keys = {email: public_key for email, public_key, _ in entries}
+            batch_created = []
+            for email, username, password_hash in new_entries:
+                try:
+                    if username in existing:
+                        command_runner.run(['chpasswd', '-e'], input=f"{username}:{password_hash}\n")
+                        batch_created.append((email, username, password_hash))
+                    else:
+                        results[email] = {"created": create_server_account(email, keys[email], password_hash), "error": None}
+                except Exception as e:
+                    results[email] = {"created": username in existing, "error": str(e)}
+            new_entries = batch_created
+
+        for email, username, _ in new_entries:
+            try:
+                # newusers 不会复制 /etc/skel
+                if os.path.isdir(SKEL_DIR):
+                    home_dir = os.path.join(home_root(), username)
+                    shutil.copytree(SKEL_DIR, home_dir, dirs_exist_ok=True)
+                    chown_tree(home_dir, *command_runner.lookup_ids(username))
+                results[email] = {"created": True, "error": None}
+                logging.info(f"已为 {email} 创建服务器账户")
+            except Exception as e:
+                results[email] = {"created": True, "error": str(e)}
+
+    for email, public_key, _ in entries:
+        if public_key and results[email]["error"] is None:
+            try:
+                write_authorized_keys(get_username_from_email(email), public_key)
+            except Exception as e:
+                results[email]["error"] = str(e)
+    return results
+
+def update_public_keys(entries: list[tuple[str, str]]) -> dict[str, str | None]:
+    # 只替换已存在账户的公钥，返回每个邮箱的错误信息（成功为 None）
+    errors = {}
+    for email, public_key in entries:
+        try:
+            username = get_username_from_email(email)
+            if command_runner.lookup(username) is None:
+                raise KeyError(f"系统中不存在用户 {username}")
+            write_authorized_keys(username, public_key)
+            logging.info(f"已更新 {email} 的公钥")
+            errors[email] = None
+        except Exception as e:
+            errors[email] = str(e)
+    return errors
 
 def ban_server_account(email: str):
     username = get_username_from_email(email)
+    account = command_runner.lookup(username)
+    if account is None:
+        logging.warning(f"系统中不存在 {email} 的服务器账户，无需禁用")
+        return
+    if is_banned(account):
+        logging.info(f"{email} 的服务器账户已处于禁用状态")
+        return
     try:
-        subprocess.run(['usermod', '-L', username], check=True)
-        subprocess.run(['usermod', '-s', '/sbin/nologin', username], check=True)
+        command_runner.run(['usermod', '-L', '-s', BANNED_SHELL, username])
         logging.info(f"已禁用 {email} 的服务器账户")
     except subprocess.CalledProcessError as e:
         logging.error(f"禁用 {email} 的服务器账户失败: {str(e)}")
         raise
 
-def send_email(email: str, subject: str, content: str):
-    msg = MIMEText(content)
-    msg['Subject'] = subject
-    msg["From"] = os.getenv('SMTP_USER')
-    msg["To"] = email
-    logging.info(f"发送邮件：\n收件人: {email}\n主题: {subject}\n正文: {content}")
-    if os.getenv('SMTP_PASSWORD') == 'your-smtp-password':
-        logging.info("SMTP 未设置，跳过发送邮件")
-        return
+def ban_server_accounts(emails: list[str]) -> dict[str, str | None]:
+    # 在同一个线程中依次禁用，返回每个邮箱的错误信息（成功为 None）
+    errors = {}
+    for email in emails:
+        try:
+            ban_server_account(email)
+            errors[email] = None
+        except Exception as e:
+            errors[email] = str(e)
+    return errors
+
+def has_authorized_keys(username: str) -> bool:
     try:
-        with smtplib.SMTP(os.getenv('SMTP_HOST'), os.getenv('SMTP_PORT')) as server:
-            server.starttls()
-            server.login(os.getenv('SMTP_USER'), os.getenv('SMTP_PASSWORD'))
-            server.send_message(msg)
-            logging.info(f"已发送邮件至 {email}")
-    except Exception as e:
-        logging.error(f"发送邮件至 {email} 失败: {str(e)}")
-        raise
+        return os.path.getsize(os.path.join(home_root(), username, ".ssh", "authorized_keys")) > 0
+    except OSError:
+        return False
+
+def inspect_server_accounts(emails: list[str]) -> dict[str, dict]:
+    # 对账用：一次取得全部系统账户（passwd / shadow 索引），逐个对照，只对存在的账户检查 authorized_keys
+    # 返回 {email: {"exists", "locked", "shell", "has_keys", "error"}}，locked 在无法读取 /etc/shadow 时为 None
+    accounts = command_runner.snapshot()
+    states = {}
+    for email in emails:
+        try:
+            username = get_username_from_email(email)
+        except ValueError:
+            # 无法生成有效用户名的邮箱不可能有系统账户
+            states[email] = {"exists": False, "locked": None, "shell": None, "has_keys": False, "error": None}
+            continue
+        account = accounts.get(username)
+        states[email] = {
+            "exists": account is not None,
+            "locked": account.locked if account else None,
+            "shell": account.shell if account else None,
+            "has_keys": account is not None and has_authorized_keys(username),
+            "error": None,
+        }
+    return states
+
+async def send_email(email: str, subject: str, content: str):
+    # 写入发件箱，由后台任务通过 SMTP 长连接发送
+    # 正文可能包含验证码和服务器密码，不写入日志
+    logging.info("发送邮件", extra={"recipient": email, "subject": subject})
+    await enqueue_mail(email, subject, content)
 
-def send_verification_email(email: str, code: str):
+async def send_verification_email(email: str, code: str):
     uri = os.getenv('WEBSITE_URL')
     if uri is None:
         uri = f"http://{os.getenv('HOST')}:{os.getenv('PORT')}"
     else:
         uri = uri.rstrip('/')
-    send_email(email, f'[{os.getenv("APP_TITLE")}] 验证您的邮箱', f"您的验证代码是：{code}\n请点击以下链接验证：{uri}/verify/{code}")
+    await send_email(email, f'[{os.getenv("APP_TITLE")}] 验证您的邮箱', f"您的验证代码是：{code}\n请点击以下链接验证：{uri}/verify/{code}")
 
-def send_rejection_email(email: str):
-    send_email(email, f'[{os.getenv("APP_TITLE")}] 账户创建失败', "您的账户创建请求已被拒绝，你可以重新申请或者联系管理员。")
+async def send_rejection_email(email: str):
+    await send_email(email, f'[{os.getenv("APP_TITLE")}] 账户创建失败', "您的账户创建请求已被拒绝，你可以重新申请或者联系管理员。")
 
-def send_account_details(email: str, password: str):
-    send_email(email, f'[{os.getenv("APP_TITLE")}] 账号创建成功', f"您的账户已创建！\n用户名: {get_username_from_email(email)}\n密码: {password}")
\ No newline at end of file
+async def send_account_details(email: str, password: str):
+    await send_email(email, f'[{os.getenv("APP_TITLE")}] 账号创建成功', f"您的账户已创建！\n用户名: {get_username_from_email(email)}\n密码: {password}")
\ No newline at end of file
@@ -0,0 +1,41 @@
+# 测试使用临时目录中的数据库、日志和主目录，账户操作使用 fake 后端，不会修改系统账户
+# src.database 等模块在导入时读取环境变量，必须在导入 src 之前设置
+import os
+import atexit
+import shutil
+import tempfile
+
+_root = tempfile.mkdtemp(prefix="panel-test-")
+# 先于日志的 atexit 注册，因此在日志线程写完之后才删除
+atexit.register(shutil.rmtree, _root, ignore_errors=True)
+os.environ.update({
+    "DATABASE_PATH": os.path.join(_root, "panel.db"),
+    "LOG_FILE": os.path.join(_root, "panel.log"),
+    "PROVISION_BACKEND": "fake",
+    "PROVISION_HOME_ROOT": os.path.join(_root, "home"),
+    "SMTP_PASSWORD": "your-smtp-password",
+})
+os.environ.pop("PROVISION_HOSTS", None)
+os.makedirs(os.environ["PROVISION_HOME_ROOT"])
+
+import asyncio
+import pytest
+
+@pytest.fixture(scope="session")
+def database():
+    from src.database import init_db
+    init_db()
+
+@pytest.fixture
+def run(database):
+    # 每次在新的事件循环中执行协程；异步连接绑定在事件循环上，结束前关闭连接池
+    from src.database import async_engine
+
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+        return asyncio.run(main())
+    return run
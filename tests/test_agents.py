@@ -0,0 +1,160 @@
+# 两个 fake 后端的账户代理（各自独立的进程和账户表），通过 Unix socket 与面板通信
+import os
+import sys
+import time
+import datetime
+import subprocess
+import httpx
+import pytest
+from sqlalchemy import select, update
+from src import provision
+from src.database import AsyncSessionLocal
+from src.jobs import enqueue_job, claim_jobs, run_jobs
+from src.models import Account, Application, HostAccount, ProvisionJob
+from src.provision import AgentBackend, host_statuses
+
+TOKEN = "test-token"
+
+def start_agent(tmp_path, name: str) -> subprocess.Popen:
+    socket_path = str(tmp_path / f"{name}.sock")
+    home = tmp_path / f"{name}-home"
+    home.mkdir()
+    env = {
+        **os.environ,
+        "PROVISION_BACKEND": "fake",
+        "PROVISION_AGENT_TOKEN": TOKEN,
+        "PROVISION_HOME_ROOT": str(home),
+        "LOG_FILE": str(tmp_path / f"{name}.log"),
+        "DATABASE_PATH": str(tmp_path / f"{name}.db"),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.agent:app", "--uds", socket_path, "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 20
+    transport = httpx.HTTPTransport(uds=socket_path)
+    while True:
+        try:
+            with httpx.Client(transport=transport, base_url="http://agent") as client:
+                if client.get("/health").status_code == 200:
+                    return process
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise RuntimeError(f"代理 {name} 未能启动")
+        time.sleep(0.05)
+
+@pytest.fixture
+def agents(tmp_path, monkeypatch):
+    processes = []
+
+    def start(name: str) -> str:
+        processes.append(start_agent(tmp_path, name))
+        return f"unix:{tmp_path / f'{name}.sock'}"
+
+    hosts = [f"unix:{tmp_path / 'node1.sock'}", f"unix:{tmp_path / 'node2.sock'}"]
+    monkeypatch.setattr(provision, "PROVISION_HOSTS", hosts)
+    monkeypatch.setattr(provision, "backend", AgentBackend(TOKEN, 10))
+    yield start, hosts
+    for process in processes:
+        process.terminate()
+        process.wait(timeout=10)
+
+async def submit_create(email: str) -> tuple[int, int]:
+    async with AsyncSessionLocal() as db:
+        account = Account(email=email, status='未创建')
+        db.add(account)
+        await db.flush()
+        application = Application(
+            account_id=account.id, public_key="ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAItest test",
+            application_reason="测试", status='等待管理员同意', is_first_application=True,
+            application_time=datetime.datetime.utcnow(),
+        )
+        db.add(application)
+        await db.commit()
+        job = await enqueue_job(db, 'create', account, application, notify=False)
+        return account.id, job.id
+
+async def run_claimed(job_id: int):
+    # 让任务立即可领取（跳过重试等待），再像 worker 一样领取并执行
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(ProvisionJob).where(ProvisionJob.id == job_id).values(run_after=datetime.datetime.utcnow()))
+        await db.commit()
+        claimed = await claim_jobs(db, 50)
+    assert job_id in claimed
+    try:
+        await run_jobs([job_id])
+    finally:
+        # 代理客户端绑定在当前事件循环上
+        await provision.backend.close()
+
+async def job_and_hosts(account_id: int, job_id: int) -> tuple[ProvisionJob, dict[str, dict], Account]:
+    async with AsyncSessionLocal() as db:
+        job = await db.get(ProvisionJob, job_id)
+        account = await db.get(Account, account_id)
+        return job, {status["host"]: status for status in await host_statuses(db, account_id)}, account
+
+def test_failed_host_is_recorded_and_retried_alone(run, agents):
+    start, (node1, node2) = agents
+    start("node1")
+
+    async def first_attempt():
+        account_id, job_id = await submit_create("multi-agent@example.com")
+        await run_claimed(job_id)
+        return account_id, job_id, await job_and_hosts(account_id, job_id)
+
+    account_id, job_id, (job, hosts, account) = run(first_attempt())
+    # node2 不可达：node1 上已创建，任务等待重试，账户仍未创建
+    assert hosts[node1]["status"] == 'done'
+    assert hosts[node2]["status"] == 'failed'
+    assert hosts[node2]["last_error"]
+    assert job.status == 'queued'
+    assert account.status == '未创建'
+    assert job.password_hash is not None
+
+    start("node2")
+
+    async def retry():
+        async with AsyncSessionLocal() as db:
+            node1_done_at = (await db.execute(
+                select(HostAccount.updated_at).where(HostAccount.account_id == account_id, HostAccount.host == node1)
+            )).scalar_one()
+        await run_claimed(job_id)
+        return node1_done_at, await job_and_hosts(account_id, job_id)
+
+    node1_done_at, (job, hosts, account) = run(retry())
+    assert hosts[node1]["status"] == 'done'
+    assert hosts[node2]["status"] == 'done'
+    # 重试只发往失败的服务器
+    assert hosts[node1]["updated_at"] == node1_done_at.isoformat()
+    assert job.status == 'done'
+    assert account.status == '活跃状态'
+
+def test_invalid_email_fails_only_its_own_entry(run, agents):
+    start, (node1, node2) = agents
+    start("node1")
+    start("node2")
+
+    async def scenario():
+        try:
+            return await provision.fan_out('create', {
+                host: [("good@example.com", None, "$6$salt$hash"), ("a+b@example.com", None, "$6$salt$hash")]
+                for host in (node1, node2)
+            })
+        finally:
+            await provision.backend.close()
+
+    results = run(scenario())
+    for host in (node1, node2):
+        assert results[host]["good@example.com"] == {"created": True, "error": None}
+        assert results[host]["a+b@example.com"]["created"] is False
+        assert results[host]["a+b@example.com"]["error"]
+
+def test_agent_rejects_missing_token(agents, tmp_path):
+    start, (node1, _) = agents
+    start("node1")
+    transport = httpx.HTTPTransport(uds=str(tmp_path / "node1.sock"))
+    with httpx.Client(transport=transport, base_url="http://agent") as client:
+        assert client.post("/accounts/lock", json={"emails": []}).status_code == 401
+        assert client.post("/accounts/lock", json={"emails": []}, headers={"Authorization": "Bearer wrong"}).status_code == 401
@@ -0,0 +1,91 @@
+import json
+import time
+import logging
+import pytest
+from contextlib import asynccontextmanager
+from fastapi.testclient import TestClient
+from src import logconfig
+
+class SlowHandler(logging.Handler):
+    # 模拟慢磁盘：每条日志写入耗时 latency 秒
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord):
+        time.sleep(self.latency)
+        self.records.append(record)
+
+    def wait_for(self, predicate, timeout: float = 10) -> list[logging.LogRecord]:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            matched = [record for record in self.records if predicate(record)]
+            if matched:
+                return matched
+            time.sleep(0.01)
+        raise AssertionError("日志未在限定时间内写出")
+
+@pytest.fixture
+def slow_handler(database, monkeypatch):
+    # 挂到后台线程的 QueueListener 上，与文件 handler 一起接收日志
+    handler = SlowHandler(0.02)
+    listener = logconfig._listener
+    monkeypatch.setattr(listener, "handlers", listener.handlers + (handler,))
+    yield handler
+
+@pytest.fixture
+def client(database, monkeypatch):
+    # 这些用例只关心请求日志，不启动 worker、邮件和调度等后台任务：
+    # 它们在连接池中排队时被取消，Python 3.11 的 asyncio.wait_for 可能吞掉取消，导致关闭时一直等待
+    from src.main import app
+    from src.database import async_engine
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await async_engine.dispose()
+
+    monkeypatch.setattr(app.router, "lifespan_context", lifespan)
+    with TestClient(app) as client:
+        yield client
+
+def test_logging_does_not_block_caller(slow_handler):
+    logger = logging.getLogger("test")
+    started = time.perf_counter()
+    for i in range(50):
+        logger.info(f"第 {i} 条")
+    # 直接写入需要 50 × 0.02 = 1 秒
+    assert time.perf_counter() - started < 0.5
+    slow_handler.wait_for(lambda record: record.getMessage() == "第 49 条")
+    assert len([record for record in slow_handler.records if record.name == "test"]) == 50
+
+def test_request_does_not_wait_for_log_writes(slow_handler, client):
+    slow_handler.latency = 1.0
+    started = time.perf_counter()
+    response = client.get("/", headers={"X-Request-ID": "req-nonblocking"})
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "req-nonblocking"
+    assert elapsed < 1.0
+    slow_handler.latency = 0
+    [record] = slow_handler.wait_for(lambda record: record.name == "access" and record.request_id == "req-nonblocking")
+    assert record.route == "/"
+
+def test_access_log_masks_secret_path_parameters(slow_handler, client):
+    slow_handler.latency = 0
+    client.get("/verify/0123456789abcdef", headers={"X-Request-ID": "req-verify"})
+    [record] = slow_handler.wait_for(lambda record: record.name == "access" and record.request_id == "req-verify")
+    assert record.path == "/verify/***"
+    assert record.route == "/verify/{code}"
+    assert not [r for r in slow_handler.records if "0123456789abcdef" in r.getMessage()]
+
+def test_formatter_redacts_secret_fields():
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "发送邮件", None, None)
+    record.recipient = "student@example.com"
+    record.server_password = "hunter2"
+    record.verification_code = "123456"
+    entry = json.loads(logconfig.JSONFormatter().format(record))
+    assert entry["recipient"] == "student@example.com"
+    assert entry["server_password"] == logconfig.REDACTED
+    assert entry["verification_code"] == logconfig.REDACTED
@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from sqlalchemy import select, delete
+from src import mailer
+from src.database import AsyncSessionLocal
+from src.models import MailOutbox
+from src.smtp_stub import LocalSMTPServer
+
+async def wait_for_mails(mail_ids: list[int], timeout: float = 10) -> list[MailOutbox]:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        async with AsyncSessionLocal() as db:
+            mails = (await db.execute(select(MailOutbox).where(MailOutbox.id.in_(mail_ids)))).scalars().all()
+        if all(mail.status not in ('queued', 'sending') for mail in mails):
+            return mails
+        assert asyncio.get_running_loop().time() < deadline, "邮件未在限定时间内发送完成"
+        await asyncio.sleep(0.02)
+
+@pytest.fixture
+def smtp_server(run, monkeypatch):
+    # 测试共用一个数据库，先清空其他用例留下的邮件，保证本用例只发送自己入队的邮件
+    async def clear_outbox():
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(MailOutbox))
+            await db.commit()
+
+    run(clear_outbox())
+    with LocalSMTPServer() as server:
+        monkeypatch.setenv("SMTP_HOST", "127.0.0.1")
+        monkeypatch.setenv("SMTP_PORT", str(server.port))
+        monkeypatch.setenv("SMTP_STARTTLS", "false")
+        monkeypatch.setenv("SMTP_USER", "panel@example.com")
+        monkeypatch.setenv("SMTP_PASSWORD", "stub")
+        monkeypatch.setattr(mailer, "MAIL_RATE_PER_MINUTE", 0)
+        yield server
+
+def test_queued_mails_share_one_smtp_connection(run, smtp_server):
+    total = 20
+
+    async def scenario():
+        mail_ids = [await mailer.enqueue_mail(f"student{i}@example.com", "测试", f"密码: {i}") for i in range(total)]
+        mailer.start_sender()
+        try:
+            return await wait_for_mails(mail_ids)
+        finally:
+            await mailer.stop_sender()
+
+    mails = run(scenario())
+    assert [mail.status for mail in mails] == ['sent'] * total
+    assert smtp_server.connections == 1
+    assert smtp_server.logins == 1
+    assert sorted(m["to"][0] for m in smtp_server.messages) == sorted(f"<student{i}@example.com>" for i in range(total))
+    # 发送完成后不保留可能包含密码的正文
+    assert all(mail.body is None for mail in mails)
+
+def test_unconfigured_smtp_skips_and_drops_body(run, monkeypatch):
+    monkeypatch.setenv("SMTP_PASSWORD", "your-smtp-password")
+
+    async def scenario():
+        mail_id = await mailer.enqueue_mail("student@example.com", "测试", "验证码: 123456")
+        mailer.start_sender()
+        try:
+            return await wait_for_mails([mail_id])
+        finally:
+            await mailer.stop_sender()
+
+    [mail] = run(scenario())
+    assert mail.status == 'skipped'
+    assert mail.body is None
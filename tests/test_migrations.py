@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine
+from src import migrations
+from src.database import Base
+import src.models  # 导入模型以注册全部表
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    Base.metadata.create_all(bind=engine)
+    migrations.run_migrations(engine)
+    yield engine
+    engine.dispose()
+
+def version(engine) -> int:
+    with engine.connect() as conn:
+        return migrations.get_version(conn)
+
+def test_fresh_database_is_at_latest_version(engine):
+    assert version(engine) == migrations.MIGRATIONS[-1][0]
+
+def test_hot_queries_use_their_indexes(engine):
+    assert migrations.check_query_plans(engine) == []
+
+def test_migrations_can_run_again(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA user_version = 0")
+    assert migrations.run_migrations(engine) == migrations.MIGRATIONS[-1][0]
+    assert migrations.check_query_plans(engine) == []
+
+def test_failed_migration_rolls_back_schema_and_version(engine, monkeypatch):
+    latest = migrations.MIGRATIONS[-1][0]
+
+    def broken(conn):
+        conn.exec_driver_sql("CREATE INDEX ix_accounts_broken ON accounts (email)")
+        raise RuntimeError("迁移失败")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + [(latest + 1, "失败的迁移", broken)])
+    with pytest.raises(RuntimeError):
+        migrations.run_migrations(engine)
+    assert version(engine) == latest
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE name = 'ix_accounts_broken'").first() is None